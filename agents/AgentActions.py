@@ -5,20 +5,43 @@ load_dotenv()
 
 from firecrawl import FirecrawlApp
 from pathlib import Path
-import pandas as pd
-import aiohttp
 import asyncio
+import time
+from collections import OrderedDict
+
+# SimplyDuty statuses that reject the code itself, so repeating the lookup soon gives the same answer
+DEFINITIVE_FAILURES = {400, 404, 422}
 
 class AgentActions:
 
-    def __init__(self, logger, chapter_descs, four_digit_codes, final_full_codes, tariffy_org_id, tariffy_api_key, simpleduty_api_key):
+    def __init__(self, logger, chapter_descs, catalog, tariffy_org_id, tariffy_api_key, simpleduty_api_key, http_sessions, duty_cache=None,
+                 tariffy_url="https://api.tariffy.net/v1/lookup-codes", simpleduty_url="https://www.api.simplyduty.com/api/duty/getduty",
+                 max_prefetch_pending=1000, prefetch_ttl=300, duty_engine=None, duty_flights=None):
         self.logger = logger
         self.chapter_descs = chapter_descs
-        self.four_digit_codes = four_digit_codes
-        self.final_full_codes = final_full_codes
+        self.catalog = catalog
         self.tariffy_org_id = tariffy_org_id
         self.tariffy_api_key = tariffy_api_key
         self.simpleduty_api_key = simpleduty_api_key
+        self.http_sessions = http_sessions
+        self.duty_cache = duty_cache
+        self.tariffy_url = tariffy_url
+        self.simpleduty_url = simpleduty_url
+
+        # Local column-1 rates from the catalog; SimplyDuty is only called for what it cannot answer
+        self.duty_engine = duty_engine
+
+        # Concurrent lookups of the same (code, origin, destination) share one SimplyDuty call when set
+        self.duty_flights = duty_flights
+
+        # Duty lookups started ahead of need by prefetch_duty_rates, by cache key -> (started, task)
+        self.max_prefetch_pending = max_prefetch_pending
+        self.prefetch_ttl = prefetch_ttl
+        self._prefetched = OrderedDict()
+        self.prefetch_started = 0
+        self.prefetch_used = 0
+        self.prefetch_requests = 0
+        self.prefetch_wasted_requests = 0
     
     @staticmethod
     def get_hts_headers(app: FirecrawlApp, headers_save_path: Path = 'chapter_headers_final.txt', chapter_desc_save_path: Path = 'chapter_desc.json') -> list:
@@ -135,11 +158,50 @@ class AgentActions:
         
         return four_digit_codes, final_full_codes
 
-    async def get_tariffy_codes(self, descriptions: list) -> list[dict]:
+    async def get_tariffy_codes(self, descriptions: list, tags=[], chunk_size=None, max_concurrency=4, timeout=None, retries=0) -> list[dict]:
         """
         Get HTS codes from the Tariffy API based on product descriptions.
+
+        With `chunk_size` set, the descriptions are sent in chunks of that size, at most
+        `max_concurrency` at a time, so a failed chunk only affects its own items.
+        """
+        size = chunk_size or max(len(descriptions), 1)
+        slots = asyncio.Semaphore(max_concurrency)
+
+        async def lookup(chunk):
+            async with slots:
+                return await self.get_tariffy_chunk(chunk, tags=tags, timeout=timeout, retries=retries)
+
+        chunks = [descriptions[start:start + size] for start in range(0, len(descriptions), size)]
+        chunk_codes = await asyncio.gather(*[lookup(chunk) for chunk in chunks])
+        return [
+            {"description": desc, "tariffy_hts_code": code}
+            for chunk, codes in zip(chunks, chunk_codes) for desc, code in zip(chunk, codes)
+        ]
+
+    async def get_tariffy_chunk(self, descriptions: list, tags=[], timeout=None, retries=0) -> list[str]:
+        """
+        Look up one chunk of descriptions, retrying up to `retries` times with backoff and
+        giving each attempt `timeout` seconds.
+
+        Returns:
+            list[str]: The Tariffy code for each description by position, or "unable to retrieve code"
+                for every description if all attempts fail.
         """
-        url = "https://api.tariffy.net/v1/lookup-codes"
+        for attempt in range(retries + 1):
+            try:
+                response_data = await asyncio.wait_for(self._post_tariffy(descriptions, tags), timeout)
+                return self._align_tariffy_codes(descriptions, response_data)
+            except Exception as e:
+                if attempt < retries:
+                    self.logger.warning(f"Tariffy lookup for {len(descriptions)} descriptions failed (attempt {attempt + 1}), retrying: {e!r}", _tags=tags)
+                    await asyncio.sleep(0.5 * 2 ** attempt)
+                else:
+                    self.logger.error(f"Tariffy lookup for {len(descriptions)} descriptions failed: {e!r}", _tags=tags)
+        return ["unable to retrieve code"] * len(descriptions)
+
+    async def _post_tariffy(self, descriptions: list, tags=[]) -> list[dict]:
+        url = self.tariffy_url
         headers = {"Content-Type": "application/json"}
         data = {
             "organization_id": self.tariffy_org_id,
@@ -149,26 +211,122 @@ class AgentActions:
             "language": "en"
         }
 
-        try:
-            with self.logger.span('Calling Tariffy API', _level='info'):
-                async with aiohttp.ClientSession() as session:
-                    async with session.post(url, headers=headers, json=data) as response:
-                        if response.status == 200:
-                            response_data = await response.json()
-                            return [{'description': item['description'], 'tariffy_hts_code': item['hs_code_usa']} for item in response_data]
-                        else:
-                            raise Exception(f"API call failed with status code {response.status}")
-        except Exception as e:
-            # Log the error and return a fallback response
-            fallback_response = [{"description": desc, "tariffy_hts_code": "unable to retrieve code"} for desc in descriptions]
-            return fallback_response
-    
-    async def get_duty_rates(self, origin: str, dest: str, code: str) -> list[dict]:
-     
+        with self.logger.span('Calling Tariffy API', _level='info', _tags=tags):
+            session = self.http_sessions.session('tariffy')
+            async with session.post(url, headers=headers, json=data) as response:
+                if response.status == 200:
+                    return await response.json()
+                else:
+                    raise Exception(f"API call failed with status code {response.status}")
+
+    @staticmethod
+    def _align_tariffy_codes(descriptions: list, response_data: list) -> list[str]:
+        """
+        Codes in the order of `descriptions`. Tariffy answers one entry per description in order;
+        if the response does not line up, entries are matched by description instead.
+        """
+        if len(response_data) == len(descriptions):
+            return [item['hs_code_usa'] for item in response_data]
+        by_description = {}
+        for item in response_data:
+            by_description.setdefault(item['description'], item['hs_code_usa'])
+        return [by_description.get(desc, "unable to retrieve code") for desc in descriptions]
+
+    async def get_duty_rates(self, origin: str, dest: str, code: str, tags=[]) -> list[dict]:
+
+        if self.duty_engine is not None:
+            local_rate = self.duty_engine.rate(code, origin, dest)
+            if local_rate is not None:
+                return {'code': code, 'DutyRate': local_rate}
+
         formatted_code = re.sub(r'\.', '', code)
         formatted_code = f"{formatted_code[:4]}.{formatted_code[4:6]}.{formatted_code[6:]}"
+        key = (formatted_code, origin, dest)
 
-        url = "https://www.api.simplyduty.com/api/duty/getduty"  # API endpoint [cite: 51]
+        prefetched = self._prefetched.pop(key, None)
+        if prefetched is not None:
+            self.prefetch_used += 1
+            result, _ = await prefetched[1]
+            return {'code': code, 'DutyRate': result['DutyRate']}
+
+        if self.duty_flights is not None:
+            # the shared result carries the first caller's spelling of the code
+            result, _ = await self.duty_flights.run(key, lambda: self._lookup_duty_rate(origin, dest, code, formatted_code, key, tags))
+            return {'code': code, 'DutyRate': result['DutyRate']}
+
+        result, _ = await self._lookup_duty_rate(origin, dest, code, formatted_code, key, tags)
+        return result
+
+    def prefetch_duty_rates(self, origin: str, dest: str, codes: list, tags=[]):
+        """
+        Start duty lookups for `codes` in the background. A later `get_duty_rates` call for the
+        same code, origin and destination waits on the prefetched lookup instead of making its own.
+
+        Prefetches that are never used count towards `prefetch_wasted_requests` when they made a
+        SimplyDuty call; they are dropped after `prefetch_ttl` seconds or beyond `max_prefetch_pending`.
+        """
+        self._drop_stale_prefetches()
+        for code in codes:
+            if self.duty_engine is not None and not self.duty_engine.needs_remote(code, origin, dest):
+                continue
+            formatted_code = re.sub(r'\.', '', code)
+            formatted_code = f"{formatted_code[:4]}.{formatted_code[4:6]}.{formatted_code[6:]}"
+            key = (formatted_code, origin, dest)
+            if key in self._prefetched:
+                continue
+            task = asyncio.ensure_future(self._lookup_duty_rate(origin, dest, code, formatted_code, key, tags, prefetch=True))
+            self._prefetched[key] = (time.monotonic(), task)
+            self.prefetch_started += 1
+        while len(self._prefetched) > self.max_prefetch_pending:
+            self._discard_prefetch(self._prefetched.popitem(last=False)[1][1])
+
+    def prefetch_stats(self) -> dict:
+        return {
+            "started": self.prefetch_started,
+            "used": self.prefetch_used,
+            "pending": len(self._prefetched),
+            "requests": self.prefetch_requests,
+            "wasted_requests": self.prefetch_wasted_requests,
+        }
+
+    def _drop_stale_prefetches(self):
+        cutoff = time.monotonic() - self.prefetch_ttl
+        while self._prefetched and next(iter(self._prefetched.values()))[0] < cutoff:
+            self._discard_prefetch(self._prefetched.popitem(last=False)[1][1])
+
+    def _discard_prefetch(self, task):
+        if not task.done():
+            self.prefetch_wasted_requests += 1
+        elif not task.cancelled() and task.exception() is None and task.result()[1]:
+            self.prefetch_wasted_requests += 1
+
+    async def _lookup_duty_rate(self, origin: str, dest: str, code: str, formatted_code: str, key: tuple, tags=[], prefetch=False) -> tuple[dict, bool]:
+        """
+        Cached duty lookup. Returns the result and whether a SimplyDuty call was made.
+        """
+        if self.duty_cache is not None:
+            cached = await self.duty_cache.get(key)
+            if cached is not None:
+                return {'code': code, 'DutyRate': cached[0]}, False
+
+        if prefetch:
+            self.prefetch_requests += 1
+        result, definitive = await self._fetch_duty_rate(origin, dest, code, formatted_code, tags)
+        # transient failures are retried by the next lookup; only SimplyDuty's own answers are cached
+        if self.duty_cache is not None and definitive:
+            await self.duty_cache.set(key, result['DutyRate'], negative=result['DutyRate'] == "unable to retrieve code")
+        return result, True
+
+    async def _fetch_duty_rate(self, origin: str, dest: str, code: str, formatted_code: str, tags=[]) -> tuple[dict, bool]:
+        """
+        Call SimplyDuty for one code.
+
+        Returns:
+            tuple: `(result, definitive)`. On any failure the result carries the "unable to retrieve code"
+                fallback; `definitive` is True only for a rate or a rejection of the code itself
+                (400, 404, 422), not for timeouts, connection errors, 429 or 5xx responses.
+        """
+        url = self.simpleduty_url
 
         headers = {
             "Content-Type": "application/json",
@@ -183,20 +341,24 @@ class AgentActions:
         })
 
         try:
-            with self.logger.span('Calling SimplyDuty API', _level='debug'):
-                async with aiohttp.ClientSession() as session:
-                    async with session.post(url, headers=headers, data=payload) as response:
-                        if response.status == 200:
-                            response_data = await response.json()
-                            return {'code': code, 'DutyRate': response_data['duty']['DutyRate']}
-                        else:
-                            raise Exception(f"API call failed with status code {response.status}")
+            with self.logger.span('Calling SimplyDuty API', _level='debug', _tags=tags):
+                session = self.http_sessions.session('simplyduty')
+                async with session.post(url, headers=headers, data=payload) as response:
+                    if response.status == 200:
+                        response_data = await response.json()
+                        return {'code': code, 'DutyRate': response_data['duty']['DutyRate']}, True
+                    elif response.status in DEFINITIVE_FAILURES:
+                        self.logger.warning(f"SimplyDuty rejected code {formatted_code} with status code {response.status}", _tags=tags)
+                        return {"code": code, "DutyRate": "unable to retrieve code"}, True
+                    else:
+                        raise Exception(f"API call failed with status code {response.status}")
         except Exception as e:
             # Log the error and return a fallback response
+            self.logger.warning(f"SimplyDuty lookup for {formatted_code} failed: {e}", _tags=tags)
             fallback_response = {"code": code, "DutyRate": "unable to retrieve code"}
-            return fallback_response
+            return fallback_response, False
     
-    async def get_rates_and_descs(self, origin: str, dest: str, code_one: str, code_two: str, code_three: str) -> dict:
+    async def get_rates_and_descs(self, origin: str, dest: str, code_one: str, code_two: str, code_three: str, tags=[]) -> dict:
         """
         Get the duty rates and descriptions for a given HTS code.
         
@@ -206,6 +368,7 @@ class AgentActions:
             code_one (str): The first HTS code to look up.
             code_two (str): The second HTS code to look up.
             code_three (str): The third HTS code to look up.
+            tags (list): Logfire tags for the lookups, e.g. the invoice number.
         
         Returns:
             dict: A dictionary with the HTS code, description, and duty rate.
@@ -213,7 +376,7 @@ class AgentActions:
         unique_codes = {code_one, code_two, code_three}
         
         duty_tasks = [
-            self.get_duty_rates(origin, dest, code) 
+            self.get_duty_rates(origin, dest, code, tags=tags) 
             for code in unique_codes
         ]
 
@@ -233,57 +396,67 @@ class AgentActions:
         return response_dict
 
 
-    def get_four_digit_code_options(self, chapter_list, tags=[]) -> str:
+    def get_four_digit_code_options(self, chapter_list, tags=[], limit_to=None) -> str:
         """
         Get the relevant level 1 data based on the chapter list.
+        If `limit_to` is given, only headings in it are returned.
         """
         four_digit_code_options = []
         try:
             for chapter in chapter_list:
-                for item in self.four_digit_codes:
-                    if item['htsno'][:2] == chapter:
-                        four_digit_code_options.append(item)
+                four_digit_code_options.extend(self.catalog.headings_for_chapter(chapter))
+            if limit_to:
+                four_digit_code_options = [item for item in four_digit_code_options if item['htsno'] in limit_to]
             self.logger.info(f"Relevant four-digit codes: {four_digit_code_options[0:10]} .etc ..", _tags=tags)
         except Exception as e:
             self.logger.exception(f"Error getting four-digit code options: {e}")
             raise e
         return json.dumps(four_digit_code_options)
 
-    def get_full_code_options(self, codes, four_digits=True, tags=[]) -> str:
+    def get_full_code_options(self, codes, four_digits=True, tags=[], limit_to=None) -> str:
         """
         Get the relevant full code options based on the four-digit code list.
+        If `limit_to` is given, only codes in it are returned.
         """
         full_code_options = []
         try:
             for code in codes:
-                for item in self.final_full_codes:
-                    if four_digits:
-                        if item['htsno'][:4] == code:
-                            full_code_options.append(item)
-                    else:
-                        if item['htsno'] == code:
-                            full_code_options.append(item)
+                if four_digits:
+                    full_code_options.extend(self.catalog.lines_for_heading(code))
+                else:
+                    item = self.catalog.get(code)
+                    if item is not None:
+                        full_code_options.append(item)
+            if limit_to:
+                full_code_options = [item for item in full_code_options if item['htsno'] in limit_to]
             self.logger.info(f"Relevant full codes: {full_code_options[0:10]} .etc ..", _tags=tags)
         except Exception as e:
             self.logger.exception(f"Error getting full code options: {e}")
             raise e
         return json.dumps(full_code_options)
     
-    def get_code_descriptions(self, codes: list) -> pd.DataFrame:
+    def get_full_code_candidates(self, codes) -> list[str]:
+        """
+        Get the 10-digit codes under a list of four-digit headings, without descriptions.
+        """
+        return [item['htsno'] for code in codes for item in self.catalog.lines_for_heading(code)]
+
+    def get_code_descriptions(self, codes: list) -> list[dict]:
         """
-        Get the descriptions of a list of HTS codes and return as a DataFrame.
+        Get the descriptions of a list of HTS codes.
         
         Args:
             codes (list): A list of HTS codes to look up.
         
         Returns:
-            pd.DataFrame: A DataFrame with columns 'code' and 'description'.
+            list[dict]: One {'code', 'description'} dict per code.
         """
 
         data = []
         try:
             for code in codes:
-                description = next((self.chapter_descs[code[0:2]] + ":<br>" + item['description'] for item in self.final_full_codes if item['htsno'] == code), "Code not found")
+                item = self.catalog.get(code)
+                description = self.chapter_descs[code[0:2]] + ":<br>" + item['description'] if item is not None else "Code not found"
                 data.append({'code': code, 'description': description})
         except Exception as e:
             self.logger.exception(f"Error getting code descriptions: {e}")
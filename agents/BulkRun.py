@@ -0,0 +1,377 @@
+import asyncio
+import csv
+import json
+import os
+import time
+from collections import deque
+from contextlib import aclosing
+
+from agents.ItemRecord import output_columns
+
+INPUT_FORMATS = ('csv', 'jsonl')
+
+
+def input_format(path: str, fmt: str = None) -> str:
+    """
+    The input format for a file: `fmt` when given, otherwise from the extension (.csv, .jsonl, .ndjson).
+
+    Raises:
+        ValueError: If the format is unknown.
+    """
+    if fmt is None:
+        extension = os.path.splitext(path)[1].lower()
+        fmt = {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl'}.get(extension)
+    if fmt not in INPUT_FORMATS:
+        raise ValueError(f"Unknown bulk input format for {path}: {fmt}")
+    return fmt
+
+
+def read_rows(path: str, fmt: str):
+    """
+    Stream the items of a CSV (with a header row) or JSONL file without loading the whole file.
+
+    Yields:
+        tuple: `(row_number, item)`, numbered from 0 in file order. Blank JSONL lines are skipped
+            but still numbered, so numbers stay stable between runs.
+    """
+    with open(path, 'r', encoding='utf-8', newline='') as file:
+        if fmt == 'csv':
+            for row_number, item in enumerate(csv.DictReader(file)):
+                yield row_number, item
+        else:
+            for row_number, line in enumerate(file):
+                if line.strip():
+                    yield row_number, json.loads(line)
+
+
+def count_rows(path: str, fmt: str) -> int:
+    """
+    Number of items in an input file, for the progress ETA.
+    """
+    return sum(1 for _ in read_rows(path, fmt))
+
+
+class BulkOutput:
+    """
+    JSONL results file that doubles as the checkpoint of a bulk run. Every finished row is
+    written as one line carrying its input `row` number and flushed straight away, so after a
+    crash the file holds exactly the rows that finished. `checkpoint` also records the completed
+    offset in `<path>.offset`: every input row below it is in the output, so a resumed run skips
+    those rows by number and only keeps the rows finished past it in memory.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.offset_path = f"{path}.offset"
+        self._file = None
+
+    def resume(self) -> tuple[int, set, int]:
+        """
+        Where an earlier run stopped, after truncating any incomplete last line of the output.
+
+        Returns:
+            tuple: `(offset, done, resumed)`: the completed offset, the row numbers at or past it
+                already in the output, and the number of rows in the output.
+        """
+        if not os.path.exists(self.path):
+            return 0, set(), 0
+        offset, size = self._read_offset()
+        done = set()
+        resumed = 0
+        with open(self.path, 'r+b') as file:
+            end = 0
+            for line in file:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    row_number = json.loads(line)["row"]
+                except (ValueError, KeyError):
+                    break
+                if row_number >= offset:
+                    done.add(row_number)
+                resumed += 1
+                end += len(line)
+            file.truncate(end)
+        if end < size:
+            # the output lost rows the offset counts as written, so trust only the rows in it
+            return 0, self._rows_in_output(), resumed
+        return offset, done, resumed
+
+    def _read_offset(self) -> tuple[int, int]:
+        try:
+            with open(self.offset_path, 'r', encoding='utf-8') as file:
+                checkpoint = json.load(file)
+            return checkpoint["offset"], checkpoint["size"]
+        except (FileNotFoundError, ValueError, KeyError, TypeError):
+            return 0, 0
+
+    def _rows_in_output(self) -> set:
+        with open(self.path, 'r', encoding='utf-8') as file:
+            return {json.loads(line)["row"] for line in file}
+
+    def open(self):
+        self._file = open(self.path, 'a', encoding='utf-8')
+
+    def write(self, row_number: int, row: dict):
+        self._file.write(json.dumps({"row": row_number, **row}, default=str) + "\n")
+        self._file.flush()
+
+    def sync(self):
+        """
+        Force written rows to disk.
+        """
+        os.fsync(self._file.fileno())
+
+    def checkpoint(self, offset: int):
+        """
+        Sync the output, then record `offset` as completed. The offset file is replaced
+        atomically and only names rows already on disk.
+        """
+        self.sync()
+        temporary = f"{self.offset_path}.tmp"
+        with open(temporary, 'w', encoding='utf-8') as file:
+            json.dump({"offset": offset, "size": self._file.tell()}, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, self.offset_path)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class CompletedOffset:
+    """
+    Watermark of a bulk run: the row number below which every input row is in the output.
+
+    Rows are added in input order and finish in any order; the offset moves past a row once it
+    and every row before it has finished. A failed row is never finished, so the offset stops
+    there and the next run retries it.
+    """
+
+    def __init__(self, offset: int = 0):
+        self.offset = offset
+        self._pending = deque()
+        self._finished = set()
+        self.checkpointed = 0
+
+    def add(self, row_number: int, finished: bool = False):
+        if finished and not self._pending:
+            self.offset = row_number + 1
+            return
+        self._pending.append(row_number)
+        if finished:
+            self._finished.add(row_number)
+
+    def finish(self, row_number: int):
+        self._finished.add(row_number)
+        while self._pending and self._pending[0] in self._finished:
+            row_number = self._pending.popleft()
+            self._finished.discard(row_number)
+            self.offset = row_number + 1
+
+
+class BulkProgress:
+    """
+    Progress of a bulk run: rows done, failed and skipped from an earlier run, throughput and ETA.
+    The rate only counts rows processed by this run, so resumed rows do not inflate it.
+    """
+
+    def __init__(self, total: int, skipped: int = 0):
+        self.total = total
+        self.skipped = skipped
+        self.done = 0
+        self.failed = 0
+        self.started = time.monotonic()
+        self.reported = self.started
+
+    def record(self, ok: bool):
+        if ok:
+            self.done += 1
+        else:
+            self.failed += 1
+
+    def snapshot(self) -> dict:
+        elapsed = time.monotonic() - self.started
+        processed = self.done + self.failed
+        rate = processed / elapsed if elapsed > 0 else 0.0
+        remaining = max(self.total - self.skipped - processed, 0)
+        return {
+            "rows_total": self.total,
+            "rows_done": self.skipped + self.done,
+            "rows_failed": self.failed,
+            "rows_resumed": self.skipped,
+            "rows_per_s": round(rate, 2),
+            "elapsed_s": round(elapsed, 1),
+            "eta_s": 0.0 if remaining == 0 else round(remaining / rate, 1) if rate > 0 else None,
+        }
+
+    def describe(self) -> str:
+        snapshot = self.snapshot()
+        percent = 100 * snapshot["rows_done"] / self.total if self.total else 100.0
+        eta = "unknown" if snapshot["eta_s"] is None else time.strftime('%H:%M:%S', time.gmtime(snapshot["eta_s"]))
+        return (f"{snapshot['rows_done']}/{self.total} rows ({percent:.1f}%), {snapshot['rows_failed']} failed, "
+                f"{snapshot['rows_per_s']} rows/s, ETA {eta}")
+
+
+class BulkRunner:
+    """
+    Runs a large CSV or JSONL file through the item pipeline with up to `chunk_size` rows in flight.
+
+    The input is streamed and split into batches of `batch_size` rows, each run through its own
+    pipeline; all batches share one set of stage bounds, so the pipeline's per-stage concurrency
+    holds for the whole run. The window is refilled as rows finish: a new batch starts as soon
+    as enough rows of the earlier ones are done, so one slow row never holds back the rest.
+    Each finished row is appended to the JSONL output at once, and new classifications are saved
+    to the classification store after every batch. Every `chunk_size` finished rows the output is
+    synced and the completed offset recorded (see `BulkOutput.checkpoint`). Failed rows are
+    logged and left out of the output, so running the same input and output again retries them
+    and skips every row that already finished, without new LLM calls.
+
+    Args:
+        build_pipeline: Function `build_pipeline(name, stored_codes, new_codes, representatives, items) -> ItemPipeline`.
+        store (ClassificationStore): Stored classifications, read and updated per batch.
+        logger: Logfire logger.
+        chunk_size (int): Rows in flight at once, and rows between checkpoints.
+        batch_size (int): Rows per pipeline run; capped at `chunk_size`.
+        progress_interval (float): Seconds between progress reports.
+        clusterer (NearDuplicateClusterer): Optional; groups near-duplicate descriptions within each
+            batch so only one per group is classified.
+    """
+
+    def __init__(self, build_pipeline, store, logger, chunk_size: int = 500, batch_size: int = 100, progress_interval: float = 10,
+                 clusterer=None):
+        self.build_pipeline = build_pipeline
+        self.store = store
+        self.logger = logger
+        self.chunk_size = max(chunk_size, 1)
+        self.batch_size = min(max(batch_size, 1), self.chunk_size)
+        self.progress_interval = progress_interval
+        self.clusterer = clusterer
+
+    async def run(self, name: str, input_path: str, output_path: str, fmt: str = None, on_progress=None) -> dict:
+        """
+        Classify every row of the input not already in the output.
+
+        Args:
+            name (str): Run name, used as the invoice number for logging and LLM fair queuing.
+            input_path (str): CSV or JSONL file of items with the same fields as a request's `Items`.
+            output_path (str): JSONL results file, resumed if it exists.
+            fmt (str): 'csv' or 'jsonl'; taken from the input extension when None.
+            on_progress: Optional callback called with the run's `BulkProgress` at the start, every
+                `progress_interval` seconds and at the end.
+
+        Returns:
+            dict: The final progress snapshot.
+        """
+        fmt = input_format(input_path, fmt)
+        bulk_logger = self.logger.with_tags(name)
+        output = BulkOutput(output_path)
+        offset, done_rows, resumed = output.resume()
+        progress = BulkProgress(total=count_rows(input_path, fmt), skipped=resumed)
+        bulk_logger.info(f"Bulk run {name}: {progress.total} rows in {input_path}, {resumed} already in {output_path} "
+                         f"(completed up to row {offset})")
+        if on_progress is not None:
+            on_progress(progress)
+
+        completed = CompletedOffset(offset)
+        window = asyncio.Semaphore(self.chunk_size)
+        stage_slots = None
+        batches = set()
+        output.open()
+        try:
+            batch = []
+            for row_number, item in read_rows(input_path, fmt):
+                if row_number < offset:
+                    continue
+                if row_number in done_rows:
+                    completed.add(row_number, finished=True)
+                    continue
+                completed.add(row_number)
+                batch.append((row_number, item))
+                if len(batch) < self.batch_size:
+                    continue
+                stage_slots = await self._start_batch(name, batch, output, progress, completed, window, batches, stage_slots, bulk_logger, on_progress)
+                batch = []
+            if batch:
+                await self._start_batch(name, batch, output, progress, completed, window, batches, stage_slots, bulk_logger, on_progress)
+            while batches:
+                finished, _ = await asyncio.wait(batches, return_when=asyncio.FIRST_COMPLETED)
+                self._reap(finished, batches)
+        finally:
+            for task in batches:
+                task.cancel()
+            await asyncio.gather(*batches, return_exceptions=True)
+            output.checkpoint(completed.offset)
+            output.close()
+
+        bulk_logger.info(f"Bulk run {name} finished: {progress.describe()}")
+        if on_progress is not None:
+            on_progress(progress)
+        return progress.snapshot()
+
+    async def _start_batch(self, name: str, batch: list, output: BulkOutput, progress: BulkProgress, completed: CompletedOffset,
+                           window: asyncio.Semaphore, batches: set, stage_slots: dict, bulk_logger, on_progress) -> dict:
+        """
+        Wait for a window slot per row of the batch, then start it in the background.
+
+        Returns:
+            dict: The stage bounds shared by every batch of the run.
+        """
+        for _ in batch:
+            await window.acquire()
+        # surface a batch that failed as a whole (e.g. the store) instead of reading on
+        self._reap([task for task in batches if task.done()], batches)
+        items = [item for _, item in batch]
+        descriptions = [item.get("Description", "") for item in items]
+        stored_codes = await self.store.get_many(descriptions)
+        new_codes = {}
+        representatives = self.clusterer.representatives(descriptions) if self.clusterer is not None else {}
+        pipeline = self.build_pipeline(name, stored_codes, new_codes, representatives, items)
+        stage_slots = stage_slots if stage_slots is not None else pipeline.new_slots()
+        batches.add(asyncio.ensure_future(self._run_batch(name, batch, pipeline, stage_slots, new_codes, output, progress, completed,
+                                                          window, bulk_logger, on_progress)))
+        return stage_slots
+
+    @staticmethod
+    def _reap(finished, batches: set):
+        for task in finished:
+            batches.discard(task)
+            task.result()
+
+    async def _run_batch(self, name: str, batch: list, pipeline, stage_slots: dict, new_codes: dict, output: BulkOutput,
+                         progress: BulkProgress, completed: CompletedOffset, window: asyncio.Semaphore, bulk_logger, on_progress):
+        row_numbers = [row_number for row_number, _ in batch]
+        items = [item for _, item in batch]
+        descriptions = [item.get("Description", "") for item in items]
+        columns = output_columns(items, propagated=self.clusterer is not None)
+        released = 0
+        try:
+            async with aclosing(pipeline.run(items, descriptions, slots=stage_slots)) as records:
+                async for record in records:
+                    row_number = row_numbers[record.index]
+                    if record.error is not None:
+                        bulk_logger.error(f"Error classifying row {row_number}: {record.error}", _tags=[record.description, name])
+                        progress.record(False)
+                    else:
+                        output.write(row_number, record.row(columns))
+                        completed.finish(row_number)
+                        progress.record(True)
+                    # the row's slot goes to the next batch straight away
+                    window.release()
+                    released += 1
+                    processed = progress.done + progress.failed
+                    if processed - completed.checkpointed >= self.chunk_size:
+                        completed.checkpointed = processed
+                        output.checkpoint(completed.offset)
+                    if time.monotonic() - progress.reported >= self.progress_interval:
+                        progress.reported = time.monotonic()
+                        bulk_logger.info(f"Bulk run {name}: {progress.describe()}")
+                        if on_progress is not None:
+                            on_progress(progress)
+        finally:
+            for _ in range(len(batch) - released):
+                window.release()
+            # keep what this batch classified even if the run is interrupted part way
+            await self.store.put_many(new_codes)
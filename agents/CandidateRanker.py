@@ -0,0 +1,128 @@
+import bisect
+import heapq
+import math
+import re
+from collections import Counter
+
+STOPWORDS = {'a', 'an', 'and', 'are', 'as', 'at', 'be', 'br', 'by', 'for', 'from', 'in', 'is', 'its', 'not',
+             'of', 'on', 'or', 'other', 'than', 'the', 'their', 'to', 'whether', 'with', 'nesoi'}
+
+
+def tokenize(text: str) -> list[str]:
+    return [t for t in re.findall(r'[a-z0-9]+', text.lower()) if t not in STOPWORDS and len(t) > 1]
+
+
+class BM25Index:
+    """
+    Okapi BM25 over a fixed set of keyed documents, with an inverted index so scoring a query
+    only touches documents that share a term with it.
+    """
+
+    def __init__(self, documents: list[tuple[str, str]], k1: float = 1.5, b: float = 0.75):
+        self.keys = [key for key, _ in documents]
+        self.k1 = k1
+        self.b = b
+        self.postings = {}
+        self.terms = []
+        lengths = []
+        for index, (_, text) in enumerate(documents):
+            terms = Counter(tokenize(text))
+            self.terms.append(terms)
+            lengths.append(sum(terms.values()))
+            for term, count in terms.items():
+                self.postings.setdefault(term, []).append((index, count))
+        self.lengths = lengths
+        self.avg_length = (sum(lengths) / len(lengths)) if lengths else 0.0
+        count = len(documents)
+        self.idf = {term: math.log(1 + (count - len(p) + 0.5) / (len(p) + 0.5)) for term, p in self.postings.items()}
+        self.sorted_keys = sorted((key, index) for index, key in enumerate(self.keys))
+
+    def top_k(self, query: str, k: int, prefixes: tuple = None) -> list[tuple[str, float]]:
+        """
+        Best `k` documents for the query as (key, score), optionally only keys starting with one of `prefixes`.
+        With `prefixes`, fewer than `k` scoring documents are padded with the unscored ones under
+        the prefixes in catalog order (score 0), since no lexical overlap does not rule a candidate out.
+        """
+        terms = [term for term in set(tokenize(query)) if term in self.idf]
+        if prefixes is None:
+            scores = {}
+            for term in terms:
+                for index, count in self.postings[term]:
+                    scores[index] = scores.get(index, 0.0) + self._term_score(term, index, count)
+        else:
+            # score only the documents under the given prefixes
+            scores = {}
+            unscored = []
+            for index in self._prefix_range(prefixes):
+                doc_terms = self.terms[index]
+                score = sum(self._term_score(term, index, doc_terms[term]) for term in terms if term in doc_terms)
+                if score > 0:
+                    scores[index] = score
+                else:
+                    unscored.append(index)
+            ranked = [(self.keys[i], s) for i, s in heapq.nlargest(k, scores.items(), key=lambda item: item[1])]
+            return ranked + [(self.keys[i], 0.0) for i in unscored[:k - len(ranked)]]
+        return [(self.keys[i], s) for i, s in heapq.nlargest(k, scores.items(), key=lambda item: item[1])]
+
+    def _term_score(self, term: str, index: int, count: int) -> float:
+        norm = self.k1 * (1 - self.b + self.b * self.lengths[index] / self.avg_length)
+        return self.idf[term] * count * (self.k1 + 1) / (count + norm)
+
+    def _prefix_range(self, prefixes: tuple):
+        for prefix in sorted(set(prefixes)):
+            start = bisect.bisect_left(self.sorted_keys, (prefix,))
+            for key, index in self.sorted_keys[start:]:
+                if not key.startswith(prefix):
+                    break
+                yield index
+
+
+class CandidateRanker:
+    """
+    Offline lexical ranker over HTS chapters, 4-digit headings and 10-digit lines.
+
+    Used to cut the candidate lists sent to the selectors down to the top N options, and to
+    pick chapters without an LLM call when the top chapters clearly stand out. Chapter and
+    heading documents include the text of everything beneath them, so a product matches the
+    chapter that contains its heading even when the chapter title is generic.
+    """
+
+    def __init__(self, catalog, chapter_descs: dict):
+        self.chapter_descs = chapter_descs
+
+        chapter_text = {chapter: [description] for chapter, description in chapter_descs.items()}
+        heading_text = {}
+        for item in catalog.four_digit_codes:
+            chapter_text.setdefault(item['htsno'][:2], []).append(item['description'])
+            heading_text[item['htsno']] = [item['description']]
+        lines = []
+        for item in catalog.final_full_codes:
+            heading_text.setdefault(item['htsno'][:4], []).append(item['description'])
+            lines.append((item['htsno'], item['description']))
+
+        self.chapters = BM25Index([(k, ' '.join(v)) for k, v in chapter_text.items()])
+        self.headings = BM25Index([(k, ' '.join(v)) for k, v in heading_text.items()])
+        self.lines = BM25Index(lines)
+
+    def rank_chapters(self, description: str, k: int) -> list[tuple[str, float]]:
+        return self.chapters.top_k(description, k)
+
+    def rank_headings(self, description: str, chapters: list, k: int) -> list[str]:
+        return [key for key, _ in self.headings.top_k(description, k, prefixes=tuple(chapters))]
+
+    def rank_lines(self, description: str, headings: list, k: int) -> list[str]:
+        return [key for key, _ in self.lines.top_k(description, k, prefixes=tuple(headings))]
+
+    @staticmethod
+    def margin(ranked: list[tuple[str, float]], n: int) -> float:
+        """
+        How far the n-th ranked option is ahead of the next one, relative to the best score.
+        0 when the ranking does not separate the top n at all.
+        """
+        if len(ranked) < n or ranked[0][1] <= 0:
+            return 0.0
+        next_score = ranked[n][1] if len(ranked) > n else 0.0
+        return (ranked[n - 1][1] - next_score) / ranked[0][1]
+
+    def render_chapters(self, chapters: list) -> str:
+        return '\n'.join(f"Chapter {chapter}: {self.chapter_descs.get(chapter, '')}" for chapter in chapters)
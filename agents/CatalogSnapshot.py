@@ -0,0 +1,232 @@
+import bisect
+import functools
+import json
+import mmap
+import os
+import struct
+import sys
+
+from agents.HtsCatalog import HtsCatalog
+
+MAGIC = b'HTSSNAP\x00'
+FORMAT_VERSION = 1
+HEADER_SIZE = 1024
+RECORD_CACHE_SIZE = 8192
+
+_PREAMBLE = struct.Struct('<8sII')   # magic, format version, header length
+_ENTRY = struct.Struct('<16sII')      # htsno (NUL padded), record offset, record length
+
+
+class _KeyTable:
+    """
+    Sequence view over one sorted key table in the snapshot, so `bisect` can search it
+    in place without copying keys out of the mapped file.
+    """
+
+    def __init__(self, buffer, offset: int, count: int):
+        self.buffer = buffer
+        self.offset = offset
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index: int) -> bytes:
+        return self.entry(index)[0]
+
+    def entry(self, index: int) -> tuple:
+        key, offset, length = _ENTRY.unpack_from(self.buffer, self.offset + index * _ENTRY.size)
+        return key.rstrip(b'\x00'), offset, length
+
+
+class CatalogSnapshot:
+    """
+    HTS catalog backed by a memory-mapped snapshot file written by `build_snapshot`.
+
+    Opening a snapshot only reads the header. Key tables are binary searched inside the
+    mapping and records are decoded on first use, so startup cost does not grow with the
+    size of the schedule and the pages are shared between processes through the page cache.
+    Exposes the same lookup interface as `HtsCatalog`.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, format_version, header_length = _PREAMBLE.unpack_from(self._mmap, 0)
+        if magic != MAGIC or format_version != FORMAT_VERSION:
+            self._mmap.close()
+            if magic != MAGIC:
+                raise ValueError(f"{path} is not an HTS catalog snapshot")
+            raise ValueError(f"{path} has snapshot format {format_version}, expected {FORMAT_VERSION}")
+
+        self.header = json.loads(self._mmap[_PREAMBLE.size:_PREAMBLE.size + header_length])
+        self._four_digit = _KeyTable(self._mmap, self.header['four_digit']['offset'], self.header['four_digit']['count'])
+        self._full = _KeyTable(self._mmap, self.header['full']['offset'], self.header['full']['count'])
+        self._records_offset = self.header['records']['offset']
+        # Bounded so a long-running worker does not end up holding a decoded copy of the whole schedule.
+        self._load_record = functools.lru_cache(maxsize=RECORD_CACHE_SIZE)(self._load_record)
+
+    @property
+    def version(self) -> str:
+        return self.header['catalog_version']
+
+    @property
+    def four_digit_codes(self) -> tuple:
+        return self._decode_range(self._four_digit, 0, len(self._four_digit))
+
+    @property
+    def final_full_codes(self) -> tuple:
+        return self._decode_range(self._full, 0, len(self._full))
+
+    def headings_for_chapter(self, chapter: str) -> tuple:
+        # only exact 2-digit chapters, like HtsCatalog; a shorter key would match a range of chapters
+        if len(chapter) != 2:
+            return ()
+        return self._prefix(self._four_digit, chapter)
+
+    def lines_for_heading(self, heading: str) -> tuple:
+        if len(heading) != 4:
+            return ()
+        return self._prefix(self._full, heading)
+
+    def get(self, htsno: str):
+        key = htsno.encode('ascii', errors='replace')
+        index = bisect.bisect_left(self._full, key)
+        if index < len(self._full) and self._full[index] == key:
+            return self._decode(self._full, index)
+        return None
+
+    def close(self):
+        self._mmap.close()
+
+    def __len__(self):
+        return len(self._full)
+
+    def _prefix(self, table: _KeyTable, prefix: str) -> tuple:
+        key = prefix.encode('ascii', errors='replace')
+        start = bisect.bisect_left(table, key)
+        end = bisect.bisect_left(table, key + b'\xff', lo=start)
+        return self._decode_range(table, start, end)
+
+    def _decode_range(self, table: _KeyTable, start: int, end: int) -> tuple:
+        return tuple(self._decode(table, index) for index in range(start, end))
+
+    def _decode(self, table: _KeyTable, index: int) -> dict:
+        _, offset, length = table.entry(index)
+        return self._load_record(offset, length)
+
+    def _load_record(self, offset: int, length: int) -> dict:
+        start = self._records_offset + offset
+        return json.loads(self._mmap[start:start + length])
+
+
+def build_snapshot(htsdata: list, snapshot_path: str) -> HtsCatalog:
+    """
+    Wrangle raw HTS data and write it to a versioned snapshot file.
+
+    Args:
+        htsdata: Raw HTS data list, as loaded from `htsdata.json`.
+        snapshot_path: Where to write the snapshot. The file is replaced atomically.
+
+    Returns:
+        HtsCatalog: The catalog that was written.
+    """
+    catalog = HtsCatalog.from_hts_data(htsdata)
+
+    records = bytearray()
+    tables = []
+    for items in (catalog.four_digit_codes, catalog.final_full_codes):
+        entries = []
+        for position, item in enumerate(items):
+            encoded = json.dumps(item, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+            entries.append((item['htsno'].encode('ascii'), position, len(records), len(encoded)))
+            records += encoded
+        entries.sort()
+        tables.append(b''.join(_ENTRY.pack(key, offset, length) for key, _, offset, length in entries))
+
+    four_digit_offset = _PREAMBLE.size + HEADER_SIZE
+    full_offset = four_digit_offset + len(tables[0])
+    header = json.dumps({
+        'catalog_version': catalog.version,
+        'four_digit': {'offset': four_digit_offset, 'count': len(tables[0]) // _ENTRY.size},
+        'full': {'offset': full_offset, 'count': len(tables[1]) // _ENTRY.size},
+        'records': {'offset': full_offset + len(tables[1]), 'length': len(records)},
+    }).encode('utf-8').ljust(HEADER_SIZE)
+
+    tmp_path = f"{snapshot_path}.tmp"
+    with open(tmp_path, 'wb') as file:
+        file.write(_PREAMBLE.pack(MAGIC, FORMAT_VERSION, HEADER_SIZE))
+        file.write(header)
+        file.write(tables[0])
+        file.write(tables[1])
+        file.write(records)
+    os.replace(tmp_path, snapshot_path)
+
+    return catalog
+
+
+def load_catalog(hts_data_path: str, snapshot_path: str, logger):
+    """
+    Open the catalog snapshot if there is a current one, otherwise wrangle the raw HTS data.
+
+    Args:
+        hts_data_path: Path to the raw `htsdata.json` export.
+        snapshot_path: Path to a snapshot written by `build_snapshot`. Empty skips the snapshot.
+        logger: Logger used to report which path was taken.
+
+    Returns:
+        CatalogSnapshot | HtsCatalog: The loaded catalog.
+    """
+    if snapshot_path and os.path.exists(snapshot_path):
+        if _is_stale(hts_data_path, snapshot_path):
+            logger.warning(f"HTS snapshot {snapshot_path} is older than {hts_data_path}, wrangling raw data instead")
+        else:
+            try:
+                catalog = CatalogSnapshot(snapshot_path)
+                logger.info(f"Loaded HTS catalog snapshot {snapshot_path} (version {catalog.version})")
+                return catalog
+            except ValueError as e:
+                logger.warning(f"Ignoring HTS snapshot: {e}")
+
+    with open(hts_data_path, 'r', encoding='utf-8') as file:
+        htsdata = json.load(file)
+    catalog = HtsCatalog.from_hts_data(htsdata)
+    logger.info(f"Loaded HTS catalog from {hts_data_path} (version {catalog.version})")
+    return catalog
+
+
+def ensure_snapshot(hts_data_path: str, snapshot_path: str, logger) -> bool:
+    """
+    Build the snapshot from the raw HTS data unless a current one exists, e.g. once before
+    starting several worker processes so they all map the same file instead of each
+    wrangling the raw data into its own memory.
+
+    Returns:
+        bool: True if a snapshot was written.
+    """
+    if os.path.exists(snapshot_path) and not _is_stale(hts_data_path, snapshot_path):
+        try:
+            # only opened to validate it; the workers map their own
+            CatalogSnapshot(snapshot_path).close()
+            return False
+        except ValueError as e:
+            logger.warning(f"Rebuilding HTS snapshot: {e}")
+    with open(hts_data_path, 'r', encoding='utf-8') as file:
+        built = build_snapshot(json.load(file), snapshot_path)
+    logger.info(f"Wrote HTS catalog snapshot {snapshot_path} (version {built.version})")
+    return True
+
+
+def _is_stale(hts_data_path: str, snapshot_path: str) -> bool:
+    return os.path.exists(hts_data_path) and os.path.getmtime(hts_data_path) > os.path.getmtime(snapshot_path)
+
+
+if __name__ == "__main__":
+    # python -m agents.CatalogSnapshot [files/htsdata.json] [files/htsdata.snapshot]
+    source = sys.argv[1] if len(sys.argv) > 1 else 'files/htsdata.json'
+    target = sys.argv[2] if len(sys.argv) > 2 else 'files/htsdata.snapshot'
+    with open(source, 'r', encoding='utf-8') as file:
+        built = build_snapshot(json.load(file), target)
+    print(f"Wrote {target}: {len(built.four_digit_codes)} headings, {len(built)} full codes, version {built.version}")
@@ -1,7 +1,11 @@
+from langchain_core.messages import AIMessage
 from langchain_core.prompts import ChatPromptTemplate
 
+from agents.CandidateRanker import CandidateRanker
+from agents.CodeExtractor import parse_selection, selection_schema
+
 class ChapterSelector:
-    def __init__(self, llm, logger, chapters_list, code_extractor):
+    def __init__(self, llm, logger, chapters_list, code_extractor, structured_output=False, ranker=None, top_chapters=0, skip_margin=None):
 
         self.logger = logger
 
@@ -15,7 +19,7 @@ Here is a list of chapters and their descriptions:
         
 Select the 3 most likely chapters, and be sure to provide your reasoning. Consider what are the most common or likely chapters and make sure to select at least 3 options, since this is the first step we don't want our search to be too narrow at the beginning."""
 
-        self.human_prompt = """Based on the list of chapters provided, please select the 3 most likely chapters to consult for the HTS code for the follow product: {product_description}."""
+        self.human_prompt = """Based on the list of chapters provided, please select the 3 most likely chapters to consult for the HTS code for the follow product: {product_description}.""" + code_extractor.selected_line_instruction("01, 02, 03")
 
         self.prompt = ChatPromptTemplate.from_messages(
             [
@@ -26,8 +30,20 @@ Select the 3 most likely chapters, and be sure to provide your reasoning. Consid
 
         self.agent_deploy = self.prompt | llm.with_retry(stop_after_attempt=3)
 
+        # Single call returning reasoning and chapters together, instead of a second extraction call
+        self.structured_deploy = None
+        if structured_output:
+            output_structure = selection_schema('chapters_list', 'The selected two digit HTS chapters, such as 01, 02, 03.')
+            self.structured_deploy = self.prompt | llm.bind(generation_config={"response_mime_type":'application/json',
+                "response_schema": output_structure}).with_retry(stop_after_attempt=3)
+
         self.code_extractor = code_extractor
 
+        # Optional lexical pre-ranking: show only the top chapters, or skip the LLM when the ranking is clear
+        self.ranker = ranker
+        self.top_chapters = top_chapters
+        self.skip_margin = skip_margin
+
     async def select_chapters(self, state):
         """
         Selects the most relevant chapters for a given product description.
@@ -38,17 +54,37 @@ Select the 3 most likely chapters, and be sure to provide your reasoning. Consid
         Returns:
             str: The selected chapters.
         """
-        tag = [state["product_description"]]
+        tag = [state["product_description"], state.get("invoice_number", "")]
+        chapters_list = self.chapters_list
+        if self.ranker is not None:
+            ranked = self.ranker.rank_chapters(state["product_description"], max(self.top_chapters, 4))
+            if self.skip_margin is not None and CandidateRanker.margin(ranked, 3) >= self.skip_margin:
+                chapter_list = [chapter for chapter, _ in ranked[:3]]
+                chapter_response = AIMessage(content=f"Selected chapters by lexical ranking: {', '.join(chapter_list)}")
+                self.logger.info(f"Selected chapters without LLM: {chapter_list}", _tags=tag)
+                return {"responses": chapter_response, "chapters_list": chapter_list}
+            if self.top_chapters and ranked:
+                chapters_list = self.ranker.render_chapters([chapter for chapter, _ in ranked[:self.top_chapters]])
+
+        inputs = {
+            "product_description": state["product_description"],
+            "chapters_list": chapters_list
+        }
+        if self.structured_deploy is not None:
+            try:
+                response = await self.structured_deploy.ainvoke(inputs)
+                chapter_response, chapter_list = parse_selection(response, 'chapters_list')
+                self.logger.info(f"Selected chapters: {chapter_response.content}", _tags=tag)
+                return {"responses": chapter_response, "chapters_list": chapter_list}
+            except Exception as e:
+                self.logger.warning(f"Structured chapter selection failed, falling back to extraction: {e}", _tags=tag)
         try:
-            chapter_response = await self.agent_deploy.ainvoke({
-                "product_description": state["product_description"],
-                "chapters_list": self.chapters_list
-            })
+            chapter_response = await self.agent_deploy.ainvoke(inputs)
             self.logger.info(f"Selected chapters: {chapter_response}", _tags=tag)
 
             chapter_list = await self.code_extractor.extract_chapters(chapter_response, tags=tag)
             
             return {"responses": chapter_response, "chapters_list": chapter_list}
         except Exception as e:
-            self.logger.error(f"Error selecting chapters: {e}")
+            self.logger.error(f"Error selecting chapters: {e}", _tags=tag)
             raise e
\ No newline at end of file
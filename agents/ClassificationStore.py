@@ -0,0 +1,124 @@
+import asyncio
+import json
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+
+
+def normalize_description(description: str) -> str:
+    """
+    Normalize a product description so trivially different spellings share one key.
+    """
+    text = unicodedata.normalize('NFKC', str(description)).lower()
+    text = re.sub(r'\s+', ' ', text)
+    return text.strip(' .,;:')
+
+
+class ClassificationStore:
+    """
+    Persistent store of `final_codes` keyed by normalized description and HTS catalog version.
+
+    A hit lets a request skip the whole LLM graph for a product that has already been
+    classified against the same catalog. Entries from other catalog versions are never
+    returned and are removed by `invalidate`. The store is capped at `max_entries`, evicting
+    the least recently used rows first.
+    """
+
+    def __init__(self, catalog_version: str, db_path: str = ':memory:', max_entries: int = 100000):
+        self.catalog_version = catalog_version
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("""CREATE TABLE IF NOT EXISTS classifications (
+            description TEXT, catalog_version TEXT, final_codes TEXT, last_used REAL,
+            PRIMARY KEY (description, catalog_version))""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS classifications_last_used ON classifications (last_used)")
+        self._db.commit()
+
+    async def get_many(self, descriptions: list) -> dict:
+        """
+        Look up a whole invoice at once.
+
+        Returns:
+            dict: Stored final codes keyed by the original description, for hits only.
+        """
+        keys = {description: normalize_description(description) for description in descriptions}
+        found = await asyncio.to_thread(self._get_many, set(keys.values()))
+        results = {description: found[key] for description, key in keys.items() if key in found}
+        self.hits += len(results)
+        self.misses += len(keys) - len(results)
+        return results
+
+    async def put_many(self, final_codes: dict):
+        """
+        Store final codes keyed by original description.
+        """
+        if final_codes:
+            await asyncio.to_thread(self._put_many, {normalize_description(d): codes for d, codes in final_codes.items()})
+
+    def invalidate(self, keep_current: bool = True) -> int:
+        """
+        Remove entries for other catalog versions, or everything when `keep_current` is False.
+
+        Returns:
+            int: Number of rows removed.
+        """
+        with self._lock:
+            if keep_current:
+                cursor = self._db.execute("DELETE FROM classifications WHERE catalog_version != ?", (self.catalog_version,))
+            else:
+                cursor = self._db.execute("DELETE FROM classifications")
+            self._db.commit()
+        return cursor.rowcount
+
+    def stats(self) -> dict:
+        with self._lock:
+            size = self._db.execute("SELECT COUNT(*) FROM classifications").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "size": size,
+            "catalog_version": self.catalog_version,
+        }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _get_many(self, keys: set) -> dict:
+        if not keys:
+            return {}
+        found = {}
+        keys = list(keys)
+        with self._lock:
+            # stay under SQLite's bound-parameter limit on large invoices
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                placeholders = ','.join('?' * len(batch))
+                rows = self._db.execute(
+                    f"SELECT description, final_codes FROM classifications WHERE catalog_version = ? AND description IN ({placeholders})",
+                    (self.catalog_version, *batch)).fetchall()
+                found.update((key, json.loads(codes)) for key, codes in rows)
+            if found:
+                self._db.executemany(
+                    "UPDATE classifications SET last_used = ? WHERE description = ? AND catalog_version = ?",
+                    [(time.time(), key, self.catalog_version) for key in found])
+                self._db.commit()
+        return found
+
+    def _put_many(self, final_codes: dict):
+        now = time.time()
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO classifications VALUES (?, ?, ?, ?)",
+                [(key, self.catalog_version, json.dumps(codes), now) for key, codes in final_codes.items()])
+            self._db.execute(
+                "DELETE FROM classifications WHERE rowid IN (SELECT rowid FROM classifications ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,))
+            self._db.commit()
@@ -1,11 +1,52 @@
 import json
+import re
+import time
+
+from langchain_core.messages import AIMessage
+
+# The "Selected: ..." line selectors are asked to end with when regex extraction is on
+SELECTED_LINE = re.compile(r'^[\s*_#>-]*selected\s*:\s*(.+?)[\s*_.]*$', re.IGNORECASE | re.MULTILINE)
+CHAPTER_CODE = re.compile(r'\d{1,2}')
+FOUR_DIGIT_CODE = re.compile(r'\d{4}')
+FULL_CODE = re.compile(r'\b\d{4}\.\d{2}\.\d{2}\.\d{2}\b')  # complete 10-digit codes only; anything shorter falls back to the LLM
 
 class CodeExtractor:
-    def __init__(self, llm, logger):
+    def __init__(self, llm, logger, regex_first=False, path_stats=None):
 
         self.logger = logger
         self.llm = llm
 
+        # Read the codes from the selector's "Selected:" line when it is well formed, and only
+        # ask the LLM to extract them when it is missing or malformed
+        self.regex_first = regex_first
+        self.path_stats = path_stats
+
+    def selected_line_instruction(self, example: str) -> str:
+        """
+        Text appended to a selector's prompt so its answer ends with a line `parse_selected_line` can read.
+        Empty unless regex extraction is on.
+        """
+        if not self.regex_first:
+            return ""
+        return f"""
+
+Finish with one last line listing only your final picks, separated by commas, exactly in this form:
+Selected: {example}"""
+
+    def _parse_first(self, step: str, response, pattern, tags) -> list:
+        if not self.regex_first:
+            return None
+        codes = parse_selected_line(response, pattern)
+        if codes is not None:
+            self.logger.info(f"Parsed {step} without LLM: {codes}", _tags=tags)
+            if self.path_stats is not None:
+                self.path_stats.record(step, fast=True)
+        return codes
+
+    def _record_llm_extraction(self, step: str, start: float):
+        if self.path_stats is not None:
+            self.path_stats.record(step, fast=False, elapsed=time.perf_counter() - start)
+
     async def extract_chapters(self, response, tags=[]):
         """
         Extracts the HTS chapters from the response.
@@ -16,6 +57,10 @@ class CodeExtractor:
         Returns:
             list[str]: The extracted HTS chapters.
         """
+        chapters = self._parse_first("extract_chapters", response, CHAPTER_CODE, tags)
+        if chapters is not None:
+            return [f"{int(chapter):02d}" for chapter in chapters]
+
         prompt = f"""Review the response and extract the HTS Chapters into a list. 
 HTS Chapters are two digit numbers, such as 01, 02, 03, etc. 
 Extract only the final Chapters selected in the response, and do not include any general reference to chapters such "I consulted chapters 10-20" etc.
@@ -30,11 +75,13 @@ Here is a response selecting 3 chapters, please extract the chapters to a list:
         }
 
         try:
+            start = time.perf_counter()
             output = await self.llm.ainvoke(prompt,
             generation_config={"response_mime_type":'application/json',
             "response_schema": output_structure})
             
             chapters = json.loads(output.content)
+            self._record_llm_extraction("extract_chapters", start)
 
             self.logger.info(f"Extracted chapters list: {chapters['chapters_list']}", _tags=tags)
             
@@ -53,6 +100,10 @@ Here is a response selecting 3 chapters, please extract the chapters to a list:
         Returns:
             list[str]: The extracted HTS four-digit codes.
         """
+        codes = self._parse_first("extract_four_digit_codes", response, FOUR_DIGIT_CODE, tags)
+        if codes is not None:
+            return codes
+
         prompt = f"""Review the response and extract the four digit HTS Codes into a list. 
 HTS Codes are four digit numbers, such as 0101, 2345, 0390, etc. 
 Extract only the final codes selected in the response, and do not include any general reference to codes such "I consulted codes 1000-9000" etc.
@@ -67,11 +118,13 @@ Here is a response selecting up to 6 codes, please extract the codes to a list:
         }
         
         try:
+            start = time.perf_counter()
             output = await self.llm.ainvoke(prompt,
             generation_config={"response_mime_type":'application/json',
             "response_schema": output_structure})
             
             codes = json.loads(output.content)
+            self._record_llm_extraction("extract_four_digit_codes", start)
 
             self.logger.info(f"Extracted four-digit code list: {codes['code_list']}", _tags=tags)
             
@@ -90,6 +143,10 @@ Here is a response selecting up to 6 codes, please extract the codes to a list:
         Returns:
             list[str]: The extracted HTS full codes.
         """
+        codes = self._parse_first("extract_full_codes", response, FULL_CODE, tags)
+        if codes is not None:
+            return codes
+
         prompt = f"""Review the response and extract the full HTS Codes into a list. 
 HTS Codes are full codes, such as 0101.01.9029, 2345.02.9800, 0390.03.3545, etc. 
 Extract only the final codes selected in the response, and do not include any general reference to codes such "I consulted codes 1000-9000" etc.
@@ -104,15 +161,66 @@ Here is a response selecting up to 6 codes, please extract the codes to a list:
         }
         
         try:
+            start = time.perf_counter()
             response = await self.llm.ainvoke(prompt,
             generation_config={"response_mime_type":'application/json',
             "response_schema": output_structure})
             
             codes = json.loads(response.content)
+            self._record_llm_extraction("extract_full_codes", start)
 
             self.logger.info(f"Extracted full code list: {codes['code_list']}", _tags=tags)
             
             return codes['code_list']
         except Exception as e:
             self.logger.error(f"Error extracting full codes: {e}")
-            raise e
\ No newline at end of file
+            raise e
+
+def parse_selected_line(response, pattern: re.Pattern, max_codes: int = 10) -> list:
+    """
+    Read the codes from the last "Selected: a, b, c" line of a selector response.
+
+    Returns:
+        list[str]: The codes in order without duplicates, or None unless every entry on the line
+            fully matches `pattern` and there are between 1 and `max_codes` of them.
+    """
+    content = getattr(response, "content", response)
+    if not isinstance(content, str):
+        return None
+    lines = SELECTED_LINE.findall(content)
+    if not lines:
+        return None
+    codes = [code.strip(" *_`'\"") for code in re.split(r'[,;]|\band\b', lines[-1])]
+    codes = list(dict.fromkeys(code for code in codes if code))
+    if not 0 < len(codes) <= max_codes or not all(pattern.fullmatch(code) for code in codes):
+        return None
+    return codes
+
+def selection_schema(list_key: str, list_description: str) -> dict:
+    """
+    Response schema for a selector that returns its reasoning and code list in one call.
+    """
+    return {
+        'type': 'OBJECT',
+        'properties': {
+            'reasoning': {'type': 'STRING', 'description': 'Your reasoning for the selection.'},
+            list_key: {'type': 'ARRAY', 'items': {'type': 'STRING'}, 'description': list_description},
+        },
+        'required': ['reasoning', list_key],
+    }
+
+
+def parse_selection(response, list_key: str) -> tuple[AIMessage, list]:
+    """
+    Parse a structured selector response into the reasoning message kept in the graph state
+    and the selected codes.
+
+    Raises:
+        ValueError: If the response is not valid JSON or selects no codes.
+    """
+    selection = json.loads(response.content)
+    codes = [str(code) for code in selection.get(list_key) or []]
+    if not codes:
+        raise ValueError(f"Structured response has no {list_key}")
+    reasoning = f"{selection.get('reasoning', '')}\n\nSelected: {', '.join(codes)}"
+    return AIMessage(content=reasoning), codes
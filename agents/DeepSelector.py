@@ -1,7 +1,11 @@
+import time
+
 from langchain_core.prompts import ChatPromptTemplate
 
+from agents.CodeExtractor import parse_selection, selection_schema
+
 class DeepSelector:
-    def __init__(self, llm, logger, code_extractor, agent_actions):
+    def __init__(self, llm, logger, code_extractor, agent_actions, structured_output=False, ranker=None, top_lines=0, prefetch_codes=0, skip_max_candidates=0, path_stats=None):
         self.logger = logger
 
         self.system_prompt = """You are a helpful assistant that can answer questions about the Harmonized Tariff Schedule (HTS) of the United States. The HTS system is used by U.S. Customs and Border Protection (CBP) to determine the duties and taxes that apply to imported goods. You will be provided with a product description, and you will help identify its relevant HTS code.
@@ -31,7 +35,7 @@ Overall, assume the product is as described. But don't rule out a code if you ca
 
         self.human_prompt = """Please select the 6 most likely HTS codes for the follow product: {product_description}
 Remember you MUST choose 6 codes, even if you are not sure.
-"""
+""" + code_extractor.selected_line_instruction("0101.21.00.10, 2345.02.98.00")
 
         self.prompt = ChatPromptTemplate.from_messages(
             [
@@ -42,10 +46,59 @@ Remember you MUST choose 6 codes, even if you are not sure.
 
         self.agent_deploy = self.prompt | llm.with_retry(stop_after_attempt=3)
 
+        # Single call returning reasoning and codes together, instead of a second extraction call
+        self.structured_deploy = None
+        if structured_output:
+            output_structure = selection_schema('code_list', 'The selected full HTS codes, such as 0101.01.90.29, 2345.02.98.00.')
+            self.structured_deploy = self.prompt | llm.bind(generation_config={"response_mime_type":'application/json',
+                "response_schema": output_structure}).with_retry(stop_after_attempt=3)
+
         self.code_extractor = code_extractor
 
         self.agent_actions = agent_actions
 
+        # Optional lexical pre-ranking: only show the top candidates to the LLM
+        self.ranker = ranker
+        self.top_lines = top_lines
+
+        # Start duty lookups for the first N candidates so they overlap with the final selection call
+        self.prefetch_codes = prefetch_codes
+
+        # Hand every candidate straight to the final selector when the headings expand to this few lines
+        self.skip_max_candidates = skip_max_candidates
+        self.path_stats = path_stats
+
+    def route(self, state) -> str:
+        """
+        Conditional edge after the four-digit selection: skip this selector when the selected
+        headings have at most `skip_max_candidates` 10-digit lines between them.
+
+        Returns:
+            str: "take_all_full_codes" or "select_full_codes".
+        """
+        count = len(self.agent_actions.get_full_code_candidates(state['four_digit_code_list']))
+        if 0 < count <= self.skip_max_candidates:
+            return "take_all_full_codes"
+        return "select_full_codes"
+
+    async def take_all_full_codes(self, state):
+        """
+        Pass every candidate line to the final selector without a deep selection call.
+
+        Args:
+            state (dict): Contains the product description and the selected four-digit codes.
+
+        Returns:
+            dict: The full code list.
+        """
+        tag = [state["product_description"], state.get("invoice_number", "")]
+        full_code_list = self.agent_actions.get_full_code_candidates(state['four_digit_code_list'])
+        self.logger.info(f"Skipped deep selection, passing all {len(full_code_list)} candidates: {full_code_list}", _tags=tag)
+        if self.path_stats is not None:
+            self.path_stats.record("deep_selector", fast=True)
+        self.prefetch_duty_rates(state, full_code_list, tag)
+        return {"full_code_list": full_code_list}
+
     async def select_full_codes(self, state):
         """
         Selects the most relevant full HTS codes for a given product description.
@@ -56,20 +109,46 @@ Remember you MUST choose 6 codes, even if you are not sure.
         Returns:
             str: The selected HTS codes.
         """
-        tag = [state["product_description"]]
+        tag = [state["product_description"], state.get("invoice_number", "")]
+        start = time.perf_counter()
         try:
-            full_code_options = self.agent_actions.get_full_code_options(state['four_digit_code_list'], tags=tag)
-            
-            full_code_response = await self.agent_deploy.ainvoke({
+            limit_to = None
+            if self.ranker is not None and self.top_lines:
+                limit_to = set(self.ranker.rank_lines(state["product_description"], state['four_digit_code_list'], self.top_lines))
+            full_code_options = self.agent_actions.get_full_code_options(state['four_digit_code_list'], tags=tag, limit_to=limit_to)
+            inputs = {
                 "product_description": state["product_description"],
                 "four_digit_code_response": state["responses"][-1],
                 "relevant_data": full_code_options
-            })
+            }
+
+            if self.structured_deploy is not None:
+                try:
+                    response = await self.structured_deploy.ainvoke(inputs)
+                    full_code_response, full_code_list = parse_selection(response, 'code_list')
+                    self.logger.info(f"Selected full codes: {full_code_response.content}", _tags=tag)
+                    self.prefetch_duty_rates(state, full_code_list, tag)
+                    self.record_full_path(start)
+                    return {"responses": full_code_response, "full_code_list": full_code_list}
+                except Exception as e:
+                    self.logger.warning(f"Structured full code selection failed, falling back to extraction: {e}", _tags=tag)
+
+            full_code_response = await self.agent_deploy.ainvoke(inputs)
             self.logger.info(f"Selected full codes: {full_code_response}", _tags=tag)
             
             full_code_list = await self.code_extractor.extract_full_codes(full_code_response, tags=tag)
+            self.prefetch_duty_rates(state, full_code_list, tag)
+            self.record_full_path(start)
 
             return {"responses": full_code_response, "full_code_list": full_code_list}
         except Exception as e:
-            self.logger.error(f"Error selecting deep HTS codes: {e}")
-            raise e
\ No newline at end of file
+            self.logger.error(f"Error selecting deep HTS codes: {e}", _tags=tag)
+            raise e
+
+    def record_full_path(self, start):
+        if self.path_stats is not None:
+            self.path_stats.record("deep_selector", fast=False, elapsed=time.perf_counter() - start)
+
+    def prefetch_duty_rates(self, state, full_code_list, tag):
+        if self.prefetch_codes and state.get("origin"):
+            self.agent_actions.prefetch_duty_rates(state["origin"], 'US', full_code_list[:self.prefetch_codes], tags=tag)
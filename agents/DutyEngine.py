@@ -0,0 +1,185 @@
+import json
+import re
+
+# Origins whose rates depend on more than the general column: Column 2 countries, Section 301
+# (CN, HK), USMCA (CA, MX) and the free trade agreement partners whose "Special" rates may apply.
+COLUMN_2_ORIGINS = ["CU", "KP", "RU", "BY"]
+FTA_PARTNERS = ["AU", "BH", "CL", "CO", "IL", "JO", "KR", "MA", "OM", "PA", "PE", "SG"]
+DEFAULT_RULES = [
+    {"origins": COLUMN_2_ORIGINS, "action": "remote", "reason": "Column 2"},
+    {"origins": ["CN", "HK"], "action": "remote", "reason": "Section 301"},
+    {"origins": ["CA", "MX"], "action": "remote", "reason": "USMCA"},
+    {"origins": FTA_PARTNERS, "action": "remote", "reason": "Free trade agreement"},
+    {"prefixes": ["72", "73", "76"], "action": "remote", "reason": "Section 232"},
+]
+
+AD_VALOREM = re.compile(r'^(\d+(?:\.\d+)?)%$')
+SPECIFIC = re.compile(r'^(?:(\d+(?:\.\d+)?)¢|\$(\d+(?:\.\d+)?))\s*(?:/\s*|\s+)([A-Za-z][A-Za-z. ]{0,29})$')
+FOOTNOTE = re.compile(r'\s*\d+/$')
+
+
+class RateExpression:
+    """
+    A parsed HTS rate: an ad valorem percentage plus any specific amounts in dollars per unit.
+    "Free" is a rate with neither.
+    """
+    __slots__ = ('text', 'ad_valorem', 'specific')
+
+    def __init__(self, text: str, ad_valorem: float = 0.0, specific: tuple = ()):
+        self.text = text
+        self.ad_valorem = ad_valorem
+        self.specific = specific
+
+    @property
+    def free(self) -> bool:
+        return self.ad_valorem == 0 and not self.specific
+
+    def value(self):
+        """
+        The rate as reported in the results: the percentage as a float, like SimplyDuty's
+        `DutyRate`, or the normalized expression (e.g. "2.4¢/kg + 5%") when it has a specific part.
+        """
+        if not self.specific:
+            return float(self.ad_valorem)
+        return self.describe()
+
+    def describe(self) -> str:
+        if self.free:
+            return "Free"
+        parts = []
+        for amount, unit in self.specific:
+            separator = " " if unit == "each" else "/"
+            parts.append(f"{amount * 100:g}¢{separator}{unit}" if amount < 1 else f"${amount:g}{separator}{unit}")
+        if self.ad_valorem:
+            parts.append(f"{self.ad_valorem:g}%")
+        return " + ".join(parts)
+
+    def duty(self, customs_value: float, quantities: dict = None) -> float:
+        """
+        Duty in dollars for a shipment.
+
+        Args:
+            customs_value (float): Customs value in dollars.
+            quantities (dict): Quantity per unit of the specific parts, e.g. {"kg": 120}.
+
+        Raises:
+            KeyError: If a quantity for a specific part is missing.
+        """
+        quantities = quantities or {}
+        return customs_value * self.ad_valorem / 100 + sum(amount * quantities[unit] for amount, unit in self.specific)
+
+
+def parse_rate(text: str):
+    """
+    Parse an HTS general-column rate such as "6.5%", "2.4¢/kg", "$1.09/kg + 9.6%" or "Free".
+
+    Returns:
+        RateExpression: The parsed rate, or None for empty or unsupported expressions
+            (e.g. "See 9903.88.03" or rates with conditions).
+    """
+    if not text:
+        return None
+    normalized = FOOTNOTE.sub('', " ".join(str(text).split()))
+    if normalized.lower() == "free":
+        return RateExpression(normalized)
+    ad_valorem = 0.0
+    specific = []
+    for part in normalized.split('+'):
+        part = part.strip()
+        match = AD_VALOREM.match(part)
+        if match:
+            ad_valorem += float(match.group(1))
+            continue
+        match = SPECIFIC.match(part)
+        if match is None:
+            return None
+        cents, dollars, unit = match.groups()
+        specific.append((float(cents) / 100 if cents is not None else float(dollars), unit.strip()))
+    return RateExpression(normalized, ad_valorem, tuple(specific))
+
+
+class DutyEngine:
+    """
+    Column-1 duty rates computed locally from the catalog's general rates, so SimplyDuty is only
+    called when a rule says the origin or code needs it.
+
+    Rules are checked in order and the first match decides; a rule without `origins` or
+    `prefixes` matches any. `"action": "remote"` sends the lookup to SimplyDuty, and
+    `"action": "add"` adds `ad_valorem` percentage points to the general rate, for tariffs
+    whose rate is known. `hook(code, origin, dest, rate)` runs before the rules and can return
+    a rule dict to use instead, or None to fall through to the table.
+
+    Args:
+        catalog (HtsCatalog | CatalogSnapshot): Source of the general rate per code.
+        rules (list): Rule dicts as described above; DEFAULT_RULES when None.
+        hook: Optional callable for origin-specific logic the table cannot express.
+        dest (str): The destination whose general column the catalog holds.
+    """
+
+    def __init__(self, catalog, rules: list = None, hook=None, dest: str = 'US'):
+        self.catalog = catalog
+        self.rules = [dict(rule, origins=set(rule.get("origins") or ()), prefixes=tuple(prefix.replace('.', '') for prefix in rule.get("prefixes") or ()))
+                      for rule in (DEFAULT_RULES if rules is None else rules)]
+        self.hook = hook
+        self.dest = dest
+        self.local = 0
+        self.remote = {}
+
+    @classmethod
+    def from_file(cls, catalog, path: str = None, hook=None):
+        """
+        Engine with the rules from a JSON file, or DEFAULT_RULES when no path is given.
+        """
+        rules = None
+        if path:
+            with open(path, 'r', encoding='utf-8') as file:
+                rules = json.load(file)
+        return cls(catalog, rules=rules, hook=hook)
+
+    def rate(self, code: str, origin: str, dest: str):
+        """
+        The duty rate for a code, or None if it has to come from SimplyDuty.
+        """
+        value, remote_reason = self._resolve(code, origin, dest)
+        if remote_reason is not None:
+            self.remote[remote_reason] = self.remote.get(remote_reason, 0) + 1
+        else:
+            self.local += 1
+        return value
+
+    def needs_remote(self, code: str, origin: str, dest: str) -> bool:
+        """
+        Whether `rate` would defer this code to SimplyDuty, without counting it in the stats.
+        """
+        return self._resolve(code, origin, dest)[1] is not None
+
+    def stats(self) -> dict:
+        return {"local": self.local, "remote": dict(self.remote)}
+
+    def _resolve(self, code: str, origin: str, dest: str) -> tuple:
+        if dest != self.dest:
+            return None, "destination"
+        item = self.catalog.get(code)
+        if item is None:
+            return None, "unknown code"
+        rate = parse_rate(item.get('duty_rate'))
+        if rate is None:
+            return None, "unparsed rate"
+        rule = self.hook(code, origin, dest, rate) if self.hook is not None else None
+        if rule is None:
+            rule = self._match(code, origin)
+        if rule is not None:
+            if rule.get("action") == "remote":
+                return None, rule.get("reason", "rule")
+            if rule.get("action") == "add":
+                rate = RateExpression(rate.text, rate.ad_valorem + float(rule.get("ad_valorem", 0)), rate.specific)
+        return rate.value(), None
+
+    def _match(self, code: str, origin: str):
+        for rule in self.rules:
+            if rule["origins"] and origin not in rule["origins"]:
+                continue
+            if rule["prefixes"] and not code.replace('.', '').startswith(rule["prefixes"]):
+                continue
+            return rule
+        return None
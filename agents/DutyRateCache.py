@@ -0,0 +1,108 @@
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class DutyRateCache:
+    """
+    LRU cache with TTL for duty rates keyed by (HTS code, origin, destination).
+
+    Failed lookups are cached too, with a shorter TTL, so a code SimplyDuty cannot resolve is
+    not requested again on every invoice. When `db_path` is set, entries are written through
+    to SQLite and survive restarts; the in-memory LRU stays the first level.
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl: float = 86400, negative_ttl: float = 900, db_path: str = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.db_path = db_path
+        self._entries = OrderedDict()
+        self._db = None
+        self._db_lock = threading.Lock()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute("""CREATE TABLE IF NOT EXISTS duty_rates (
+                code TEXT, origin TEXT, dest TEXT, rate TEXT, negative INTEGER, expires REAL,
+                PRIMARY KEY (code, origin, dest))""")
+            self._db.commit()
+
+    async def get(self, key: tuple):
+        """
+        Get a cached entry.
+
+        Returns:
+            tuple | None: (rate, negative) on a hit, None on a miss.
+        """
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is not None and entry[2] <= now:
+            del self._entries[key]
+            entry = None
+        if entry is None and self._db is not None:
+            entry = await asyncio.to_thread(self._db_get, key, now)
+            if entry is not None:
+                self._remember(key, entry)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        if entry[1]:
+            self.negative_hits += 1
+        else:
+            self.hits += 1
+        return entry[0], entry[1]
+
+    async def set(self, key: tuple, rate, negative: bool = False):
+        """
+        Store a duty rate, or a failed lookup when `negative` is True.
+        """
+        entry = (rate, negative, time.time() + (self.negative_ttl if negative else self.ttl))
+        self._remember(key, entry)
+        if self._db is not None:
+            await asyncio.to_thread(self._db_set, key, entry)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.negative_hits + self.misses
+        return {
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.negative_hits) / lookups if lookups else 0.0,
+            "size": len(self._entries),
+        }
+
+    def close(self):
+        if self._db is not None:
+            with self._db_lock:
+                self._db.close()
+            self._db = None
+
+    def _remember(self, key: tuple, entry: tuple):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _db_get(self, key: tuple, now: float):
+        with self._db_lock:
+            row = self._db.execute(
+                "SELECT rate, negative, expires FROM duty_rates WHERE code = ? AND origin = ? AND dest = ? AND expires > ?",
+                (*key, now)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), bool(row[1]), row[2]
+
+    def _db_set(self, key: tuple, entry: tuple):
+        with self._db_lock:
+            self._db.execute("INSERT OR REPLACE INTO duty_rates VALUES (?, ?, ?, ?, ?, ?)",
+                             (*key, json.dumps(entry[0]), int(entry[1]), entry[2]))
+            self._db.commit()
@@ -0,0 +1,328 @@
+import asyncio
+import base64
+import os
+import random
+import smtplib
+import tempfile
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+from agents.Gmail import create_mime_message
+
+GMAIL_SEND_URL = 'https://gmail.googleapis.com/gmail/v1/users/me/messages/send'
+
+
+class OutgoingEmail:
+    """
+    One email to deliver. The attachment is held as bytes, so the message does not depend on a
+    file that a later request may overwrite before it is sent.
+    """
+    __slots__ = ('job_uuid', 'recipient', 'subject', 'body', 'attachment', 'filename', 'attempts')
+
+    def __init__(self, job_uuid: str, recipient: str, subject: str, body: str, attachment: bytes = None, filename: str = None):
+        self.job_uuid = job_uuid
+        self.recipient = recipient
+        self.subject = subject
+        self.body = body
+        self.attachment = attachment
+        self.filename = filename
+        self.attempts = 0
+
+
+class EmailTransport(ABC):
+    """
+    How emails leave the process. `send` must not block the event loop; blocking clients run
+    in a worker thread.
+    """
+    name = 'transport'
+
+    @abstractmethod
+    async def send(self, email: OutgoingEmail):
+        """
+        Send one email, raising on failure.
+        """
+
+    async def send_batch(self, emails: list) -> list:
+        """
+        Send several emails, returning one exception (or None on success) per email.
+        """
+        results = []
+        for email in emails:
+            try:
+                await self.send(email)
+                results.append(None)
+            except Exception as e:
+                results.append(e)
+        return results
+
+
+class ComposioTransport(EmailTransport):
+    """
+    Gmail through Composio's GMAIL_SEND_EMAIL action. The action takes an attachment path, so the
+    bytes are written to a temporary file for the duration of the call.
+    """
+    name = 'composio'
+
+    def __init__(self, toolset, action):
+        self.toolset = toolset
+        self.action = action
+
+    async def send(self, email: OutgoingEmail):
+        await asyncio.to_thread(self._send, email)
+
+    def _send(self, email: OutgoingEmail):
+        params = {"recipient_email": email.recipient, "subject": email.subject, "body": email.body}
+        attachment_dir = None
+        try:
+            if email.attachment is not None:
+                attachment_dir = tempfile.mkdtemp(prefix='email-')
+                path = os.path.join(attachment_dir, email.filename)
+                with open(path, 'wb') as file:
+                    file.write(email.attachment)
+                params["attachment"] = path
+            response = self.toolset.execute_action(action=self.action, params=params)
+        finally:
+            if attachment_dir is not None:
+                for name in os.listdir(attachment_dir):
+                    os.remove(os.path.join(attachment_dir, name))
+                os.rmdir(attachment_dir)
+        if isinstance(response, dict) and response.get("successful", response.get("successfull", True)) is False:
+            raise Exception(f"Composio send failed: {response.get('error')}")
+
+
+class GmailApiTransport(EmailTransport):
+    """
+    Gmail API `messages.send` over the shared aiohttp sessions, authenticated with an OAuth access token.
+    """
+    name = 'gmail'
+
+    def __init__(self, access_token: str, http_sessions, url: str = GMAIL_SEND_URL):
+        self.access_token = access_token
+        self.http_sessions = http_sessions
+        self.url = url
+
+    async def send(self, email: OutgoingEmail):
+        message = create_mime_message(email.recipient, email.subject, email.body, email.attachment, email.filename)
+        payload = {'raw': base64.urlsafe_b64encode(message.as_bytes()).decode()}
+        headers = {'Authorization': f'Bearer {self.access_token}', 'Content-Type': 'application/json'}
+        session = self.http_sessions.session('gmail')
+        async with session.post(self.url, headers=headers, json=payload) as response:
+            if response.status != 200:
+                raise Exception(f"Gmail API send failed with status code {response.status}: {await response.text()}")
+
+
+class SmtpTransport(EmailTransport):
+    """
+    Plain SMTP, e.g. a relay or a local stand-in for tests. A batch is sent over one connection.
+    """
+    name = 'smtp'
+
+    def __init__(self, host: str, port: int = 25, sender: str = 'classification@localhost', username: str = None, password: str = None,
+                 starttls: bool = False, timeout: float = 30):
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+
+    async def send(self, email: OutgoingEmail):
+        error = (await self.send_batch([email]))[0]
+        if error is not None:
+            raise error
+
+    async def send_batch(self, emails: list) -> list:
+        return await asyncio.to_thread(self._send_batch, emails)
+
+    def _send_batch(self, emails: list) -> list:
+        try:
+            client = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        except Exception as e:
+            return [e] * len(emails)
+        results = []
+        try:
+            if self.starttls:
+                client.starttls()
+            if self.username:
+                client.login(self.username, self.password)
+            for email in emails:
+                try:
+                    message = create_mime_message(email.recipient, email.subject, email.body, email.attachment, email.filename, sender=self.sender)
+                    client.sendmail(self.sender, [email.recipient], message.as_bytes())
+                    results.append(None)
+                except Exception as e:
+                    results.append(e)
+        except Exception as e:
+            results.extend([e] * (len(emails) - len(results)))
+        finally:
+            try:
+                client.quit()
+            except Exception:
+                pass
+        return results
+
+
+class EmailDelivery:
+    """
+    Background delivery of result emails, so request handlers only enqueue.
+
+    Workers take up to `batch_size` queued emails at a time and hand them to the transport.
+    A failed email is retried after an exponential backoff with jitter, up to `max_attempts`
+    tries; the delivery status of each job (queued, retrying, sent, failed) is kept for the
+    most recent `history_size` jobs.
+
+    Args:
+        transport (EmailTransport): Where emails are sent.
+        logger: Logfire logger.
+        workers (int): Concurrent batches.
+        max_queued (int): Emails waiting beyond this are rejected by `submit`.
+        batch_size (int): Emails per transport call.
+        max_attempts (int): Tries per email before it is marked failed.
+        backoff_base (float): Seconds before the first retry, doubled on each further retry.
+        backoff_max (float): Upper bound on the retry delay in seconds.
+        history_size (int): Number of job delivery statuses kept.
+        metrics (Metrics): Optional metrics that record batch send time and per-email outcomes.
+    """
+
+    def __init__(self, transport: EmailTransport, logger, workers: int = 2, max_queued: int = 1000, batch_size: int = 10,
+                 max_attempts: int = 5, backoff_base: float = 2.0, backoff_max: float = 300.0, history_size: int = 1000, metrics=None):
+        self.transport = transport
+        self.logger = logger
+        self.workers = workers
+        self.batch_size = max(batch_size, 1)
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.history_size = history_size
+        self.metrics = metrics
+        self._queue = asyncio.Queue(maxsize=max_queued)
+        self._tasks = []
+        self._retries = set()
+        self._status = OrderedDict()
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+
+    async def start(self):
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, drain_timeout: float = 10.0):
+        """
+        Give queued emails up to `drain_timeout` seconds to go out, then stop the workers.
+        Emails still waiting for a retry are dropped and marked failed.
+        """
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=drain_timeout)
+        except asyncio.TimeoutError:
+            self.logger.warning(f"Stopping email delivery with {self._queue.qsize()} emails still queued")
+        for task in self._tasks + list(self._retries):
+            task.cancel()
+        await asyncio.gather(*self._tasks, *self._retries, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, email: OutgoingEmail):
+        """
+        Queue an email for delivery.
+
+        Raises:
+            asyncio.QueueFull: If the queue is at capacity.
+        """
+        self._queue.put_nowait(email)
+        self._set_status(email, "queued")
+
+    async def enqueue(self, email: OutgoingEmail, timeout: float = 5.0):
+        """
+        Queue an email for delivery without ever dropping it, for callers that have already
+        done the work the email reports. Waits up to `timeout` seconds for room in the queue;
+        if it is still full, the email is kept in a background task that queues it as soon as
+        there is room, with status "backlogged" until then.
+        """
+        try:
+            await asyncio.wait_for(self._queue.put(email), timeout=timeout)
+        except asyncio.TimeoutError:
+            self.logger.warning(f"Email queue full, holding results email for job {email.job_uuid} until there is room")
+            self._set_status(email, "backlogged")
+            task = asyncio.create_task(self._requeue(email, 0))
+            self._retries.add(task)
+            task.add_done_callback(self._retries.discard)
+            return
+        self._set_status(email, "queued")
+
+    def status(self, job_uuid: str):
+        """
+        Delivery status of the job's email as a dict, or None if none was submitted.
+        """
+        status = self._status.get(job_uuid)
+        return dict(status) if status is not None else None
+
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    def stats(self) -> dict:
+        return {"transport": self.transport.name, "queued": self._queue.qsize(), "retrying": len(self._retries),
+                "sent": self.sent, "failed": self.failed, "retried": self.retried}
+
+    async def _worker(self):
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            try:
+                for email in batch:
+                    email.attempts += 1
+                    self._set_status(email, "sending")
+                start = time.perf_counter()
+                try:
+                    errors = await self.transport.send_batch(batch)
+                except Exception as e:
+                    errors = [e] * len(batch)
+                if self.metrics is not None:
+                    self.metrics.email_batch_seconds.observe(time.perf_counter() - start, self.transport.name)
+                for email, error in zip(batch, errors):
+                    if error is None:
+                        self.sent += 1
+                        self._count("sent")
+                        self._set_status(email, "sent")
+                        self.logger.info(f"Sent results for job {email.job_uuid} to {email.recipient}")
+                    else:
+                        self._retry_or_fail(email, error)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _retry_or_fail(self, email: OutgoingEmail, error: Exception):
+        if email.attempts >= self.max_attempts:
+            self.failed += 1
+            self._count("failed")
+            self._set_status(email, "failed", error=str(error))
+            self.logger.error(f"Giving up on results email for job {email.job_uuid} after {email.attempts} attempts: {error}")
+            return
+        delay = min(self.backoff_base * 2 ** (email.attempts - 1), self.backoff_max) * random.uniform(0.8, 1.2)
+        self.retried += 1
+        self._count("retried")
+        self._set_status(email, "retrying", error=str(error), retry_in_s=round(delay, 1))
+        self.logger.warning(f"Results email for job {email.job_uuid} failed (attempt {email.attempts}), retrying in {delay:.1f}s: {error}")
+        task = asyncio.create_task(self._requeue(email, delay))
+        self._retries.add(task)
+        task.add_done_callback(self._retries.discard)
+
+    async def _requeue(self, email: OutgoingEmail, delay: float):
+        try:
+            await asyncio.sleep(delay)
+            await self._queue.put(email)
+        except asyncio.CancelledError:
+            self._set_status(email, "failed", error="Delivery stopped before the email was queued")
+            raise
+        self._set_status(email, "queued")
+
+    def _count(self, outcome: str):
+        if self.metrics is not None:
+            self.metrics.emails.inc(self.transport.name, outcome)
+
+    def _set_status(self, email: OutgoingEmail, status: str, **fields):
+        self._status[email.job_uuid] = {"status": status, "recipient": email.recipient, "attempts": email.attempts, "updated": time.time(), **fields}
+        self._status.move_to_end(email.job_uuid)
+        while len(self._status) > self.history_size:
+            self._status.popitem(last=False)
@@ -16,7 +16,7 @@ class FinalSelector:
         Returns:
             dict: A dictionary with the selected HTS codes.
         """
-        tag = [state["product_description"]]
+        tag = [state["product_description"], state.get("invoice_number", "")]
 
         full_code_options = self.agent_actions.get_full_code_options(state['full_code_list'], four_digits=False, tags=tag)
 
@@ -64,5 +64,5 @@ Return a dictionary with most_likely_code: YOUR_SELECTION, most_likely_lower_rat
             self.logger.info(f"Selected final codes: {final_codes}", _tags=tag)
             return {"final_codes": final_codes}
         except Exception as e:
-            self.logger.error(f"Error selecting final HTS codes: {e}")
+            self.logger.error(f"Error selecting final HTS codes: {e}", _tags=tag)
             raise e
\ No newline at end of file
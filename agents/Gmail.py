@@ -4,31 +4,41 @@ import mimetypes
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.mime.base import MIMEBase
+from email import encoders
 
 def create_message_with_attachment(to, subject, msg_body, file_path):
     """Creates a MIME message with an attachment."""
+    with open(file_path, 'rb') as fp:
+        attachment = fp.read()
+    filename = file_path.split('/')[-1]
+    return {'raw': base64.urlsafe_b64encode(create_mime_message(to, subject, msg_body, attachment, filename).as_bytes()).decode()}
+
+def create_mime_message(to, subject, msg_body, attachment=None, filename=None, sender=None):
+    """Creates a MIME message, attaching `attachment` (bytes) as `filename` if given."""
     message = MIMEMultipart()
     message['to'] = to
     message['subject'] = subject
+    if sender:
+        message['from'] = sender
 
     msg = MIMEText(msg_body)
     message.attach(msg)
 
-    content_type, encoding = mimetypes.guess_type(file_path)
-    if content_type is None or encoding is not None:
-        content_type = 'application/octet-stream'
+    if attachment is not None:
+        content_type, encoding = mimetypes.guess_type(filename)
+        if content_type is None or encoding is not None:
+            content_type = 'application/octet-stream'
 
-    main_type, sub_type = content_type.split('/', 1)
+        main_type, sub_type = content_type.split('/', 1)
 
-    with open(file_path, 'rb') as fp:
         msg = MIMEBase(main_type, sub_type)
-        msg.set_payload(fp.read())
+        msg.set_payload(attachment)
+        encoders.encode_base64(msg)
 
-    filename = file_path.split('/')[-1]
-    msg.add_header('Content-Disposition', 'attachment', filename=filename)
-    message.attach(msg)
+        msg.add_header('Content-Disposition', 'attachment', filename=filename)
+        message.attach(msg)
 
-    return {'raw': base64.urlsafe_b64encode(message.as_bytes()).decode()}
+    return message
 
 def send_message(access_token, message):
     """Sends the email message using the Gmail API."""
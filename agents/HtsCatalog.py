@@ -0,0 +1,84 @@
+import hashlib
+import json
+from types import MappingProxyType
+
+
+class HtsCatalog:
+    """
+    Read-only, indexed view over the output of `AgentActions.wrangle_hts_data`.
+
+    The catalog is built once at startup and shared by every request. All lookups
+    go through hash indexes, so each call costs O(result size) instead of a scan
+    over the whole schedule.
+    """
+
+    def __init__(self, four_digit_codes: list[dict], final_full_codes: list[dict]):
+        self._four_digit_codes = tuple(dict(item) for item in four_digit_codes)
+        self._final_full_codes = tuple(dict(item) for item in final_full_codes)
+
+        chapters = {}
+        for item in self._four_digit_codes:
+            chapters.setdefault(item['htsno'][:2], []).append(item)
+
+        headings = {}
+        records = {}
+        for item in self._final_full_codes:
+            headings.setdefault(item['htsno'][:4], []).append(item)
+            records.setdefault(item['htsno'], item)
+
+        # chapter -> 4-digit headings, heading -> 10-digit lines, htsno -> record
+        self._chapters = MappingProxyType({k: tuple(v) for k, v in chapters.items()})
+        self._headings = MappingProxyType({k: tuple(v) for k, v in headings.items()})
+        self._records = MappingProxyType(records)
+        self._version = None
+
+    @classmethod
+    def from_hts_data(cls, htsdata: list) -> "HtsCatalog":
+        """
+        Wrangle raw HTS data and build a catalog from the result.
+        """
+        from agents.AgentActions import AgentActions
+
+        four_digit_codes, final_full_codes = AgentActions.wrangle_hts_data(htsdata)
+        return cls(four_digit_codes, final_full_codes)
+
+    @property
+    def four_digit_codes(self) -> tuple:
+        return self._four_digit_codes
+
+    @property
+    def final_full_codes(self) -> tuple:
+        return self._final_full_codes
+
+    @property
+    def version(self) -> str:
+        """
+        Content hash of the catalog, stable across processes and restarts.
+        """
+        if self._version is None:
+            digest = hashlib.sha256()
+            for item in self._four_digit_codes + self._final_full_codes:
+                digest.update(json.dumps(item, sort_keys=True, ensure_ascii=False).encode('utf-8'))
+            self._version = digest.hexdigest()[:16]
+        return self._version
+
+    def headings_for_chapter(self, chapter: str) -> tuple:
+        """
+        Get the 4-digit headings within a 2-digit chapter.
+        """
+        return self._chapters.get(chapter, ())
+
+    def lines_for_heading(self, heading: str) -> tuple:
+        """
+        Get the 10-digit statistical lines under a 4-digit heading.
+        """
+        return self._headings.get(heading, ())
+
+    def get(self, htsno: str):
+        """
+        Get the full code record for an exact HTS number, or None if it does not exist.
+        """
+        return self._records.get(htsno)
+
+    def __len__(self):
+        return len(self._final_full_codes)
@@ -0,0 +1,51 @@
+import aiohttp
+
+
+class HttpSessions:
+    """
+    Application-lifetime aiohttp sessions, one per upstream API.
+
+    Each upstream gets its own connector so connection limits, keep-alive and DNS caching
+    apply per service, and TCP/TLS connections are reused across requests instead of being
+    re-established for every call. With `metrics`, every request is timed under its upstream name.
+    """
+
+    def __init__(self, limit_per_host: int = 20, keepalive_timeout: float = 30, dns_cache_ttl: int = 300, total_timeout: float = 30, connect_timeout: float = 10, metrics=None):
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+        self.timeout = aiohttp.ClientTimeout(total=total_timeout, connect=connect_timeout)
+        self.metrics = metrics
+        self._sessions = {}
+
+    async def start(self, *upstreams: str):
+        """
+        Open sessions for the given upstream names, e.g. on application startup.
+        """
+        for name in upstreams:
+            self.session(name)
+
+    def session(self, name: str) -> aiohttp.ClientSession:
+        """
+        Get the shared session for an upstream, opening it on first use.
+        Must be called from within the running event loop.
+        """
+        session = self._sessions.get(name)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(
+                limit_per_host=self.limit_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+                ttl_dns_cache=self.dns_cache_ttl,
+            )
+            trace_configs = [self.metrics.trace_config(name)] if self.metrics is not None else None
+            session = aiohttp.ClientSession(connector=connector, timeout=self.timeout, trace_configs=trace_configs)
+            self._sessions[name] = session
+        return session
+
+    async def close(self):
+        """
+        Close every session, e.g. on application shutdown.
+        """
+        sessions, self._sessions = self._sessions, {}
+        for session in sessions.values():
+            await session.close()
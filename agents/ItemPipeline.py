@@ -0,0 +1,91 @@
+import asyncio
+
+from agents.ItemRecord import ItemRecord
+
+
+class ItemPipeline:
+    """
+    Per-item dataflow for an invoice: classification -> Tariffy code -> duty rates and descriptions.
+
+    Each item moves to its duty lookup as soon as its own classification and its Tariffy batch
+    are done, instead of waiting for every item in the invoice. The Tariffy request is split
+    into batches of `tariffy_batch_size` descriptions so an item only waits for the batch it
+    is in, and its Tariffy code is matched by position, not by description. Every stage has its
+    own concurrency bound for the run.
+
+    Args:
+        classify: Coroutine function `classify(description, item) -> final_codes`.
+        tariffy_lookup: Coroutine function `tariffy_lookup(descriptions) -> [code, ...]`, one code per description by position.
+        rates_lookup: Coroutine function `rates_lookup(item, final_codes, tariffy_code) -> dict`.
+        classify_concurrency (int): Items classified at once.
+        tariffy_batch_size (int): Descriptions per Tariffy request.
+        tariffy_concurrency (int): Tariffy requests in flight at once.
+        rates_concurrency (int): Items looking up duty rates at once.
+    """
+
+    def __init__(self, classify, tariffy_lookup, rates_lookup, classify_concurrency: int = 16, tariffy_batch_size: int = 25,
+                 tariffy_concurrency: int = 4, rates_concurrency: int = 16):
+        self.classify = classify
+        self.tariffy_lookup = tariffy_lookup
+        self.rates_lookup = rates_lookup
+        self.classify_concurrency = classify_concurrency
+        self.tariffy_batch_size = max(tariffy_batch_size, 1)
+        self.tariffy_concurrency = tariffy_concurrency
+        self.rates_concurrency = rates_concurrency
+
+    def new_slots(self) -> dict:
+        """
+        The concurrency bounds of one run, one semaphore per stage. Runs given the same slots share the bounds.
+        """
+        return {
+            "classify": asyncio.Semaphore(self.classify_concurrency),
+            "tariffy": asyncio.Semaphore(self.tariffy_concurrency),
+            "rates": asyncio.Semaphore(self.rates_concurrency),
+        }
+
+    async def run(self, items: list[dict], descriptions: list[str], slots: dict = None):
+        """
+        Process the items, yielding one record per item in completion order.
+
+        Args:
+            items (list[dict]): The invoice items, passed through to `rates_lookup`.
+            descriptions (list[str]): The product description of each item.
+            slots (dict): Stage bounds from `new_slots`, to share them with other runs; a fresh set when None.
+
+        Yields:
+            ItemRecord: One record per item with its codes and rates, or with `error` set if the item raised.
+        """
+        slots = slots if slots is not None else self.new_slots()
+        classify_slots = slots["classify"]
+        tariffy_slots = slots["tariffy"]
+        rates_slots = slots["rates"]
+
+        async def lookup_batch(batch):
+            async with tariffy_slots:
+                return await self.tariffy_lookup(batch)
+
+        batches = [
+            asyncio.ensure_future(lookup_batch(descriptions[start:start + self.tariffy_batch_size]))
+            for start in range(0, len(descriptions), self.tariffy_batch_size)
+        ]
+
+        async def process(index: int) -> ItemRecord:
+            record = ItemRecord(index, items[index], descriptions[index])
+            try:
+                async with classify_slots:
+                    record.final_codes = await self.classify(record.description, record.item)
+                record.tariffy_code = (await batches[index // self.tariffy_batch_size])[index % self.tariffy_batch_size]
+                async with rates_slots:
+                    record.rates = await self.rates_lookup(record.item, record.final_codes, record.tariffy_code)
+            except Exception as e:
+                record.error = e
+            return record
+
+        tasks = [asyncio.ensure_future(process(index)) for index in range(len(items))]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            # stop outstanding work if the consumer stops early (client disconnect, failed item)
+            for task in tasks + batches:
+                task.cancel()
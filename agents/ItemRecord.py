@@ -0,0 +1,94 @@
+RESULT_COLUMNS = ['most_likely_code',
+                  'most_likely_code_desc',
+                  'most_likely_code_duty_rate',
+                  'most_likely_code_lower_rate_code',
+                  'most_likely_code_lower_rate_desc',
+                  'most_likely_code_lower_rate_duty_rate',
+                  'tariffy_hts_code',
+                  'tariffy_hts_code_desc',
+                  'tariffy_hts_code_duty_rate']
+
+
+class ItemRecord:
+    """
+    One invoice item as it moves through the pipeline. It carries its position in the invoice,
+    so results are joined back to their item by index rather than by description.
+    """
+    __slots__ = ('index', 'item', 'description', 'final_codes', 'tariffy_code', 'rates', 'error')
+
+    def __init__(self, index: int, item: dict, description: str):
+        self.index = index
+        self.item = item
+        self.description = description
+        self.final_codes = None
+        self.tariffy_code = ""
+        self.rates = None
+        self.error = None
+
+    def row(self, columns: list) -> dict:
+        """
+        The output row: the item's own fields (with `Description` as `description`) and the result columns.
+        """
+        final_codes = self.final_codes or {}
+        rates = self.rates or {}
+        values = {
+            "most_likely_code": final_codes.get("most_likely_code", ""),
+            "most_likely_code_lower_rate_code": final_codes.get("most_likely_lower_rate_code", ""),
+            "tariffy_hts_code": self.tariffy_code,
+            "propagated_from": final_codes.get("propagated_from", ""),
+        }
+        row = {}
+        for column in columns:
+            if column in values:
+                row[column] = values[column]
+            elif column in rates:
+                row[column] = rates[column]
+            else:
+                row[column] = self.item.get("Description" if column == "description" else column)
+        return row
+
+
+def output_columns(items: list, propagated: bool = False) -> list:
+    """
+    Output columns for an invoice: every item field in first-seen order, then RESULT_COLUMNS,
+    then with `propagated` the `propagated_from` audit column naming the near-duplicate whose
+    classification an item reused (empty for items classified themselves).
+    """
+    fields = dict.fromkeys(("description" if key == "Description" else key) for item in items for key in item)
+    columns = [field for field in fields if field not in RESULT_COLUMNS] + RESULT_COLUMNS
+    return columns + ["propagated_from"] if propagated else columns
+
+
+class PositionalJoin:
+    """
+    Releases records in index order while they arrive in completion order, holding back only
+    the records that finished ahead of an earlier one.
+    """
+
+    def __init__(self, total: int):
+        self.total = total
+        self.next_index = 0
+        self._waiting = {}
+
+    def add(self, record: ItemRecord) -> list:
+        """
+        Add a finished record and return the records that are now next in order (possibly none).
+        """
+        self._waiting[record.index] = record
+        ready = []
+        while self.next_index in self._waiting:
+            ready.append(self._waiting.pop(self.next_index))
+            self.next_index += 1
+        return ready
+
+
+def to_dataframe(rows: list, columns: list):
+    """
+    Result rows as a pandas DataFrame, for callers that want one. pandas is imported on demand
+    and is not needed by the request path.
+    """
+    try:
+        import pandas as pd
+    except ImportError as e:
+        raise ImportError("pandas is required for DataFrame export: pip install pandas") from e
+    return pd.DataFrame(rows, columns=columns)
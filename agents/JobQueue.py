@@ -0,0 +1,143 @@
+import asyncio
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+
+class JobStore(ABC):
+    """
+    Storage for job status and results. `InMemoryJobStore` backs a single process; a shared
+    backend (SQLite, Redis) can implement the same methods so several workers see one view.
+    """
+
+    @abstractmethod
+    def create(self, job_uuid: str, total: int) -> bool:
+        """
+        Register a queued job. Returns False if the job already exists.
+        """
+
+    @abstractmethod
+    def update(self, job_uuid: str, **fields):
+        """
+        Set fields of the job, e.g. its status or results.
+        """
+
+    @abstractmethod
+    def item_done(self, job_uuid: str):
+        """
+        Count one more finished item for the job.
+        """
+
+    @abstractmethod
+    def get(self, job_uuid: str):
+        """
+        Get the job as a dict, or None if it is unknown.
+        """
+
+
+class InMemoryJobStore(JobStore):
+    """
+    Process-local job store that keeps the most recent `max_jobs` jobs.
+    """
+
+    def __init__(self, max_jobs: int = 1000):
+        self.max_jobs = max_jobs
+        self._jobs = OrderedDict()
+
+    def create(self, job_uuid: str, total: int) -> bool:
+        if job_uuid in self._jobs:
+            return False
+        self._jobs[job_uuid] = {
+            "job_uuid": job_uuid,
+            "status": "queued",
+            "items_total": total,
+            "items_done": 0,
+            "created": time.time(),
+            "started": None,
+            "finished": None,
+            "error": None,
+            "results": None,
+        }
+        # drop the oldest jobs that are no longer running
+        for old_uuid in list(self._jobs):
+            if len(self._jobs) <= self.max_jobs:
+                break
+            if self._jobs[old_uuid]["status"] in ("succeeded", "failed"):
+                del self._jobs[old_uuid]
+        return True
+
+    def update(self, job_uuid: str, **fields):
+        if job_uuid in self._jobs:
+            self._jobs[job_uuid].update(fields)
+
+    def item_done(self, job_uuid: str):
+        if job_uuid in self._jobs:
+            self._jobs[job_uuid]["items_done"] += 1
+
+    def get(self, job_uuid: str):
+        job = self._jobs.get(job_uuid)
+        return dict(job) if job is not None else None
+
+
+class JobQueue:
+    """
+    Bounded queue of classification jobs processed by a fixed pool of background workers.
+
+    Args:
+        store (JobStore): Where job status and results are kept.
+        handler: Coroutine function called as `handler(payload, on_item_done)` for each job.
+            Its return value is stored as the job results.
+        logger: Logfire logger.
+        workers (int): Number of jobs processed concurrently.
+        max_queued (int): Jobs waiting beyond this are rejected by `submit`.
+    """
+
+    def __init__(self, store: JobStore, handler, logger, workers: int = 2, max_queued: int = 100):
+        self.store = store
+        self.handler = handler
+        self.logger = logger
+        self.workers = workers
+        self._queue = asyncio.Queue(maxsize=max_queued)
+        self._tasks = []
+
+    async def start(self):
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, job_uuid: str, payload, total: int) -> bool:
+        """
+        Queue a job.
+
+        Returns:
+            bool: False if a job with this uuid already exists.
+
+        Raises:
+            asyncio.QueueFull: If the queue is at capacity.
+        """
+        if self._queue.full():
+            raise asyncio.QueueFull()
+        if not self.store.create(job_uuid, total):
+            return False
+        self._queue.put_nowait((job_uuid, payload))
+        return True
+
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    async def _worker(self):
+        while True:
+            job_uuid, payload = await self._queue.get()
+            self.store.update(job_uuid, status="running", started=time.time())
+            try:
+                results = await self.handler(payload, lambda: self.store.item_done(job_uuid))
+                self.store.update(job_uuid, status="succeeded", finished=time.time(), results=results)
+            except Exception as e:
+                self.logger.exception(f"Job {job_uuid} failed: {e}")
+                self.store.update(job_uuid, status="failed", finished=time.time(), error=str(e))
+            finally:
+                self._queue.task_done()
@@ -0,0 +1,245 @@
+import asyncio
+import re
+import time
+from collections import OrderedDict, deque
+
+from langchain_core.runnables import Runnable, ensure_config
+
+RETRY_AFTER = re.compile(r'retry[_ -]?(?:delay|after)\D{0,20}(\d+(?:\.\d+)?)', re.IGNORECASE)
+
+
+class TokenBucket:
+    """
+    Refills continuously at `per_minute` units per minute, holding at most one minute's worth.
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount: float):
+        amount = min(amount, self.capacity)
+        while True:
+            self._refill()
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return
+            await asyncio.sleep((amount - self.tokens) / self.rate)
+
+    def adjust(self, amount: float):
+        """
+        Charge (or refund, if negative) the difference between estimated and actual usage.
+        """
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+
+class _ModelLimits:
+    def __init__(self, rpm: float, tpm: float):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.paused_until = 0.0
+        self.backoff = 0.0
+        self.calls = 0
+        self.tokens_used = 0
+        self.rate_limited = 0
+
+
+class LLMScheduler:
+    """
+    Process-wide admission control for LLM calls.
+
+    Every call first draws from its model's requests/min and tokens/min buckets, then waits
+    for a slot under `max_in_flight`, so a throttled model's callers wait without holding
+    slots. Waiting calls are granted slots round-robin by invoice, so one large invoice cannot
+    starve the others. A rate-limit
+    error pauses the model for the server's retry-after hint (or an exponential backoff) so
+    `with_retry` does not hammer the API while it is throttling.
+
+    Args:
+        limits (dict): Model name -> {"rpm": ..., "tpm": ...}.
+        default_rpm (float): Requests/min for models not listed in `limits`.
+        default_tpm (float): Tokens/min for models not listed in `limits`.
+        max_in_flight (int): Maximum concurrent LLM calls across the process.
+        logger: Logfire logger.
+    """
+
+    def __init__(self, limits: dict, default_rpm: float, default_tpm: float, max_in_flight: int, logger):
+        self.limits = limits
+        self.default_rpm = default_rpm
+        self.default_tpm = default_tpm
+        self.max_in_flight = max_in_flight
+        self.logger = logger
+        self.in_flight = 0
+        self._models = {}
+        self._waiting = OrderedDict()  # invoice -> deque of futures
+        self._turns = deque()          # invoices with waiting calls, in round-robin order
+        self.waits = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+
+    def wrap(self, llm, model: str) -> "ScheduledModel":
+        """
+        Route every call made through `llm` via the scheduler, accounted against `model`.
+        """
+        return ScheduledModel(llm=llm, scheduler=self, model=model)
+
+    def queue_depth(self) -> int:
+        return sum(len(waiting) for waiting in self._waiting.values())
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.queue_depth(),
+            "in_flight": self.in_flight,
+            "waits": self.waits,
+            "mean_wait_s": self.wait_time / self.waits if self.waits else 0.0,
+            "max_wait_s": self.max_wait,
+            "models": {
+                name: {"calls": m.calls, "tokens": m.tokens_used, "rate_limited": m.rate_limited}
+                for name, m in self._models.items()
+            },
+        }
+
+    async def run(self, model: str, invoice: str, estimated_tokens: int, call):
+        """
+        Run `call()` once the scheduler admits it.
+        """
+        limits = self._model(model)
+        start = time.monotonic()
+        while True:
+            # wait out a pause and the model's buckets before taking a slot, so callers of a
+            # throttled model do not hold slots that calls to other models could use
+            while time.monotonic() < limits.paused_until:
+                await asyncio.sleep(limits.paused_until - time.monotonic())
+            await limits.requests.acquire(1)
+            await limits.tokens.acquire(estimated_tokens)
+            try:
+                await self._acquire_slot(invoice)
+            except asyncio.CancelledError:
+                self._refund(limits, estimated_tokens)
+                raise
+            if time.monotonic() >= limits.paused_until:
+                break
+            # the model was paused while this call waited for its slot: hand both back and wait again
+            self._refund(limits, estimated_tokens)
+            self.in_flight -= 1
+            self._dispatch()
+        self._record_wait(time.monotonic() - start)
+
+        try:
+            try:
+                response = await call()
+            except Exception as e:
+                if _is_rate_limit(e):
+                    self._pause(model, limits, e)
+                raise
+
+            limits.backoff = 0.0
+            limits.calls += 1
+            usage = getattr(response, "usage_metadata", None) or {}
+            actual = usage.get("total_tokens", estimated_tokens)
+            limits.tokens_used += actual
+            limits.tokens.adjust(actual - estimated_tokens)
+            return response
+        finally:
+            self.in_flight -= 1
+            self._dispatch()
+
+    def _refund(self, limits: _ModelLimits, estimated_tokens: int):
+        limits.requests.adjust(-1)
+        limits.tokens.adjust(-estimated_tokens)
+
+    def _model(self, model: str) -> _ModelLimits:
+        if model not in self._models:
+            limit = self.limits.get(model, {})
+            self._models[model] = _ModelLimits(rpm=limit.get("rpm", self.default_rpm), tpm=limit.get("tpm", self.default_tpm))
+        return self._models[model]
+
+    async def _acquire_slot(self, invoice: str):
+        future = asyncio.get_running_loop().create_future()
+        if invoice not in self._waiting:
+            self._waiting[invoice] = deque()
+            self._turns.append(invoice)
+        self._waiting[invoice].append(future)
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # slot was granted just before cancellation; hand it back
+                self.in_flight -= 1
+                self._dispatch()
+            else:
+                waiting = self._waiting.get(invoice)
+                if waiting is not None and future in waiting:
+                    waiting.remove(future)
+            raise
+
+    def _dispatch(self):
+        while self.in_flight < self.max_in_flight and self._turns:
+            invoice = self._turns.popleft()
+            waiting = self._waiting[invoice]
+            future = waiting.popleft() if waiting else None
+            if waiting:
+                self._turns.append(invoice)
+            else:
+                del self._waiting[invoice]
+            if future is not None and not future.done():
+                self.in_flight += 1
+                future.set_result(None)
+
+    def _record_wait(self, waited: float):
+        self.waits += 1
+        self.wait_time += waited
+        self.max_wait = max(self.max_wait, waited)
+
+    def _pause(self, model: str, limits: _ModelLimits, error: Exception):
+        limits.rate_limited += 1
+        match = RETRY_AFTER.search(str(error))
+        if match:
+            delay = float(match.group(1))
+        else:
+            limits.backoff = min(max(limits.backoff * 2, 1.0), 60.0)
+            delay = limits.backoff
+        limits.paused_until = max(limits.paused_until, time.monotonic() + delay)
+        self.logger.warning(f"Rate limited by {model}, pausing calls for {delay:.1f}s")
+
+
+def _is_rate_limit(error: Exception) -> bool:
+    if getattr(error, "code", None) == 429 or getattr(error, "status_code", None) == 429:
+        return True
+    message = str(error)
+    return "429" in message or "RESOURCE_EXHAUSTED" in message or "rate limit" in message.lower()
+
+
+class ScheduledModel(Runnable):
+    """
+    Runnable wrapper that sends every call to the wrapped chat model through an `LLMScheduler`.
+    Calls are grouped for fair queuing by the `invoice_number` in the run metadata.
+    """
+
+    def __init__(self, llm, scheduler: LLMScheduler, model: str):
+        self.llm = llm
+        self.scheduler = scheduler
+        self.model = model
+
+    def invoke(self, input, config=None, **kwargs):
+        return self.llm.invoke(input, config, **kwargs)
+
+    async def ainvoke(self, input, config=None, **kwargs):
+        config = ensure_config(config)
+        invoice = config.get("metadata", {}).get("invoice_number", "")
+        text = input.to_string() if hasattr(input, "to_string") else str(input)
+        return await self.scheduler.run(
+            model=self.model,
+            invoice=invoice,
+            estimated_tokens=len(text) // 4,
+            call=lambda: self.llm.ainvoke(input, config, **kwargs),
+        )
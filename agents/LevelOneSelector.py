@@ -1,7 +1,9 @@
 from langchain_core.prompts import ChatPromptTemplate
 
+from agents.CodeExtractor import parse_selection, selection_schema
+
 class LevelOneSelector:
-    def __init__(self, llm, logger, code_extractor, agent_actions):
+    def __init__(self, llm, logger, code_extractor, agent_actions, structured_output=False, ranker=None, top_headings=0):
         self.logger = logger
 
         self.system_prompt = """You are a helpful assistant that can answer questions about the Harmonized Tariff Schedule (HTS) of the United States. The HTS is a system for classifying goods imported into the United States. It is used by U.S. Customs and Border Protection (CBP) to determine the duties and taxes that apply to imported goods. You will be provided with a product description, and you will help identify its relevant HTS code.
@@ -25,7 +27,7 @@ Consider:
 Overall, assume the product is as described. But don't rule out a code if you can make a reasonable argument for why it belongs.
 """
         
-        self.human_prompt = """Select up to 6 of the most likely HTS codes for the following product: {product_description}."""
+        self.human_prompt = """Select up to 6 of the most likely HTS codes for the following product: {product_description}.""" + code_extractor.selected_line_instruction("0101, 2345, 0390")
 
         self.prompt = ChatPromptTemplate.from_messages(
             [
@@ -36,10 +38,21 @@ Overall, assume the product is as described. But don't rule out a code if you ca
 
         self.agent_deploy = self.prompt | llm.with_retry(stop_after_attempt=3)
 
+        # Single call returning reasoning and codes together, instead of a second extraction call
+        self.structured_deploy = None
+        if structured_output:
+            output_structure = selection_schema('code_list', 'The selected four digit HTS codes, such as 0101, 2345, 0390.')
+            self.structured_deploy = self.prompt | llm.bind(generation_config={"response_mime_type":'application/json',
+                "response_schema": output_structure}).with_retry(stop_after_attempt=3)
+
         self.code_extractor = code_extractor
 
         self.agent_actions = agent_actions
 
+        # Optional lexical pre-ranking: only show the top candidates to the LLM
+        self.ranker = ranker
+        self.top_headings = top_headings
+
     async def select_four_digit_codes(self, state):
         """
         Selects the most relevant HTS codes for a given product description.
@@ -50,20 +63,33 @@ Overall, assume the product is as described. But don't rule out a code if you ca
         Returns:
             str: The selected HTS codes.
         """
-        tag = [state["product_description"]]
+        tag = [state["product_description"], state.get("invoice_number", "")]
         try:
-            four_digit_code_options = self.agent_actions.get_four_digit_code_options(state['chapters_list'], tags=tag)
-            
-            initial_code_response = await self.agent_deploy.ainvoke({
+            limit_to = None
+            if self.ranker is not None and self.top_headings:
+                limit_to = set(self.ranker.rank_headings(state["product_description"], state['chapters_list'], self.top_headings))
+            four_digit_code_options = self.agent_actions.get_four_digit_code_options(state['chapters_list'], tags=tag, limit_to=limit_to)
+            inputs = {
                 "product_description": state["product_description"],
                 "chapter_response": state["responses"][-1],
                 "relevant_data": four_digit_code_options,
-            })
+            }
+
+            if self.structured_deploy is not None:
+                try:
+                    response = await self.structured_deploy.ainvoke(inputs)
+                    initial_code_response, four_digit_code_list = parse_selection(response, 'code_list')
+                    self.logger.info(f"Selected initial codes: {initial_code_response.content}", _tags=tag)
+                    return {"responses": initial_code_response, "four_digit_code_list": four_digit_code_list}
+                except Exception as e:
+                    self.logger.warning(f"Structured four-digit selection failed, falling back to extraction: {e}", _tags=tag)
+
+            initial_code_response = await self.agent_deploy.ainvoke(inputs)
             self.logger.info(f"Selected initial codes: {initial_code_response}", _tags=tag)
             
             four_digit_code_list = await self.code_extractor.extract_four_digit_codes(initial_code_response, tags=tag)
             
             return {"responses": initial_code_response, "four_digit_code_list": four_digit_code_list}
         except Exception as e:
-            self.logger.error(f"Error selecting HTS codes: {e}")
+            self.logger.error(f"Error selecting HTS codes: {e}", _tags=tag)
             raise e
\ No newline at end of file
@@ -0,0 +1,233 @@
+import time
+from bisect import bisect_left
+
+import aiohttp
+from langchain_core.runnables import Runnable
+
+# Seconds; covers cache hits through slow thinking-model calls
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _label_text(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    """
+    Monotonic count per label combination.
+    """
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> list:
+        return [f"{self.name}{_label_text(self.labelnames, labels)} {_number(value)}" for labels, value in self._values.items()]
+
+
+class Gauge:
+    """
+    Current value per label combination, either set directly or read from `function` at scrape time.
+    A gauge with a function costs nothing on the hot path.
+    """
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: tuple = (), function=None):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.function = function
+        self._values = {}
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) - amount
+
+    def set(self, value: float, *labels):
+        self._values[labels] = value
+
+    def render(self) -> list:
+        if self.function is not None:
+            return [f"{self.name} {_number(self.function())}"]
+        return [f"{self.name}{_label_text(self.labelnames, labels)} {_number(value)}" for labels, value in self._values.items()]
+
+
+class Histogram:
+    """
+    Observations per label combination in fixed buckets. `observe` only bumps one bucket;
+    the cumulative counts Prometheus expects are computed at scrape time.
+    """
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # labels -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, value: float, *labels):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self) -> list:
+        lines = []
+        for labels, series in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series):
+                cumulative += count
+                le = 'le="' + (bound if bound == "+Inf" else _number(bound)) + '"'
+                lines.append(f"{self.name}_bucket{_label_text(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_label_text(self.labelnames, labels)} {_number(series[-1])}")
+            lines.append(f"{self.name}_count{_label_text(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class Metrics:
+    """
+    Process-wide metrics in the Prometheus text format, plus the hooks the app uses to record them:
+    graph node durations, LLM calls and tokens by model and agent, external HTTP calls by upstream,
+    and email sends. Updates are plain dict and list operations on the event loop thread, so
+    recording stays cheap on the hot path.
+
+    Args:
+        namespace (str): Prefix for every metric name.
+        buckets (tuple): Histogram bucket bounds in seconds.
+    """
+
+    def __init__(self, namespace: str = "classification", buckets: tuple = DEFAULT_BUCKETS):
+        self.namespace = namespace
+        self._metrics = {}
+        self.graph_node_seconds = self.histogram("graph_node_seconds", "Time spent in each graph node.", ("node", "outcome"), buckets)
+        self.llm_call_seconds = self.histogram("llm_call_seconds", "LLM call latency, excluding scheduler wait.", ("model", "agent", "outcome"), buckets)
+        self.llm_tokens = self.counter("llm_tokens_total", "Tokens reported by the LLM.", ("model", "agent", "kind"))
+        self.http_request_seconds = self.histogram("http_request_seconds", "External HTTP call latency.", ("upstream", "method", "status"), buckets)
+        self.http_in_flight = self.gauge("http_requests_in_flight", "External HTTP calls in progress.", ("upstream",))
+        self.email_batch_seconds = self.histogram("email_batch_seconds", "Time to hand one batch of emails to the transport.", ("transport",), buckets)
+        self.emails = self.counter("emails_total", "Email send attempts by outcome.", ("transport", "outcome"))
+
+    def counter(self, name: str, help: str, labelnames: tuple = ()) -> Counter:
+        return self._register(Counter(f"{self.namespace}_{name}", help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames: tuple = (), function=None) -> Gauge:
+        return self._register(Gauge(f"{self.namespace}_{name}", help, labelnames, function))
+
+    def histogram(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(f"{self.namespace}_{name}", help, labelnames, buckets))
+
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """
+        Every metric in the Prometheus text exposition format (version 0.0.4).
+        """
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def timed_node(self, node: str, function):
+        """
+        Wrap an async graph node so its duration is recorded under `node`.
+        """
+        histogram = self.graph_node_seconds
+
+        async def timed(state):
+            start = time.perf_counter()
+            outcome = "error"
+            try:
+                result = await function(state)
+                outcome = "ok"
+                return result
+            finally:
+                histogram.observe(time.perf_counter() - start, node, outcome)
+        return timed
+
+    def wrap_llm(self, llm, model: str, agent: str) -> "MeteredModel":
+        """
+        Record every call made through `llm` under `model` and `agent`.
+        """
+        return MeteredModel(llm=llm, metrics=self, model=model, agent=agent)
+
+    def trace_config(self, upstream: str):
+        """
+        aiohttp trace config that records each request made through a session under `upstream`.
+        """
+        histogram = self.http_request_seconds
+        in_flight = self.http_in_flight
+
+        async def on_request_start(session, context, params):
+            context.start = time.perf_counter()
+            in_flight.inc(upstream)
+
+        async def on_request_end(session, context, params):
+            in_flight.dec(upstream)
+            histogram.observe(time.perf_counter() - context.start, upstream, params.method, str(params.response.status))
+
+        async def on_request_exception(session, context, params):
+            in_flight.dec(upstream)
+            histogram.observe(time.perf_counter() - context.start, upstream, params.method, "error")
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_request_end.append(on_request_end)
+        trace_config.on_request_exception.append(on_request_exception)
+        return trace_config
+
+
+class MeteredModel(Runnable):
+    """
+    Runnable wrapper that times every call to the wrapped chat model and counts the tokens it
+    reports. Each attempt made by `with_retry` is recorded, so failed attempts show up as retries.
+    """
+
+    def __init__(self, llm, metrics: Metrics, model: str, agent: str):
+        self.llm = llm
+        self.metrics = metrics
+        self.model = model
+        self.agent = agent
+
+    def invoke(self, input, config=None, **kwargs):
+        return self.llm.invoke(input, config, **kwargs)
+
+    async def ainvoke(self, input, config=None, **kwargs):
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            response = await self.llm.ainvoke(input, config, **kwargs)
+            outcome = "ok"
+        finally:
+            self.metrics.llm_call_seconds.observe(time.perf_counter() - start, self.model, self.agent, outcome)
+        usage = getattr(response, "usage_metadata", None) or {}
+        for kind in ("input_tokens", "output_tokens"):
+            if usage.get(kind):
+                self.metrics.llm_tokens.inc(self.model, self.agent, kind.split("_")[0], amount=usage[kind])
+        return response
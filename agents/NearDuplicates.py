@@ -0,0 +1,152 @@
+import random
+import re
+import zlib
+
+from agents.CandidateRanker import STOPWORDS
+from agents.ClassificationStore import normalize_description
+
+# Tokens that tell variants of one product apart without changing what the product is. Colors,
+# "set" and tokens with digits other than bare counts (12v, 5w, 100%, 500ml) can change the
+# heading, so they are kept
+SIZES = {'xxs', 'xs', 's', 'm', 'l', 'xl', 'xxl', 'xxxl', 'small', 'medium', 'large', 'size', 'sz', 'one-size'}
+QUANTITY_WORDS = {'pack', 'pk', 'pcs', 'pc', 'piece', 'pieces', 'qty', 'units', 'unit', 'lot', 'sku', 'item', 'no', 'x'}
+VARIANT_WORDS = SIZES | QUANTITY_WORDS | STOPWORDS
+TOKEN = re.compile(r"[a-z0-9]+(?:[-'.][a-z0-9]+)*%?")
+# Bare numbers, counts and pack sizes (12, 1.5, x3, 3x, 10pcs, 2pk) and numbered sizes (2xl, 3xs)
+COUNT = re.compile(r"\d+(?:\.\d+)?|x\d+|\d+x|\d+(?:pcs|pc|pk|pack|ct|count|pieces|piece|units|unit)|\d+x+[sl]")
+
+# Tokens that can move a product to another heading on their own: colors (red vs white wine,
+# green vs black tea), sets and kits. With every token containing a digit, a description only
+# joins a representative whose spec tokens are the same
+COLORS = {'black', 'white', 'red', 'blue', 'green', 'yellow', 'purple', 'pink', 'brown', 'grey', 'gray', 'beige',
+          'navy', 'khaki', 'maroon', 'teal', 'burgundy', 'multicolor'}
+SET_WORDS = {'set', 'sets', 'kit', 'kits'}
+
+# Fewer product tokens than this say too little about the product to group it with anything
+MIN_TOKENS = 2
+
+# Modulus for the MinHash permutations, a Mersenne prime above the 32-bit token hashes
+PRIME = (1 << 61) - 1
+
+
+def product_tokens(description: str) -> frozenset:
+    """
+    The words of a description that identify the product: normalized, with stopwords, sizes,
+    quantity words, bare numbers and counts removed. Specs such as 12v, 5w or 100% are kept.
+    """
+    return frozenset(token for token in TOKEN.findall(normalize_description(description))
+                     if token not in VARIANT_WORDS and not COUNT.fullmatch(token))
+
+
+def spec_tokens(tokens: frozenset) -> frozenset:
+    """
+    The product tokens that must match exactly for two descriptions to be grouped: colors,
+    set words and specs with digits (12v, 5w, 100%, 500ml).
+    """
+    return frozenset(token for token in tokens if token in COLORS or token in SET_WORDS or any(char.isdigit() for char in token))
+
+
+def lsh_bands(threshold: float, num_perm: int) -> tuple[int, int]:
+    """
+    Bands and rows per band for which two sets with Jaccard similarity `threshold` become
+    candidates with probability about one half, i.e. (1 / bands) ** (1 / rows) ~ threshold.
+    """
+    best = None
+    for rows in range(1, num_perm + 1):
+        bands = num_perm // rows
+        error = abs((1 / bands) ** (1 / rows) - threshold)
+        if best is None or error < best[0]:
+            best = (error, bands, rows)
+    return best[1], best[2]
+
+
+class NearDuplicateClusterer:
+    """
+    Groups descriptions that differ only in size, SKU number or quantity, so one representative
+    per group is classified and its codes are reused for the rest.
+
+    Descriptions are reduced to their product tokens (see `product_tokens`) and compared by the
+    Jaccard similarity of those token sets; descriptions with fewer than `MIN_TOKENS` product
+    tokens are never grouped, and a description only joins a representative with the same
+    colors, set words and specs (see `spec_tokens`). MinHash signatures with LSH banding find candidate
+    pairs without comparing every pair. In input order, each description joins the earlier
+    representative with the highest exact Jaccard similarity at or above `threshold`, or starts
+    a group of its own. Every member is therefore within the threshold of its representative;
+    similarity is not chained from member to member.
+
+    Args:
+        threshold (float): Minimum Jaccard similarity of product tokens, from 0 to 1. 1.0 only
+            groups descriptions whose product tokens are identical.
+        num_perm (int): MinHash permutations per signature.
+        seed (int): Seed for the permutations, so groupings are reproducible.
+    """
+
+    def __init__(self, threshold: float = 0.8, num_perm: int = 64, seed: int = 1):
+        self.threshold = threshold
+        self.bands, self.rows = lsh_bands(threshold, num_perm)
+        rng = random.Random(seed)
+        self.permutations = [(rng.randrange(1, PRIME), rng.randrange(0, PRIME)) for _ in range(self.bands * self.rows)]
+        self.descriptions = 0
+        self.propagated = 0
+        self.groups = 0
+
+    def signature(self, tokens: frozenset) -> tuple:
+        hashes = [zlib.crc32(token.encode('utf-8')) for token in tokens]
+        return tuple(min((a * h + b) % PRIME for h in hashes) for a, b in self.permutations)
+
+    def representatives(self, descriptions: list) -> dict:
+        """
+        Map each near-duplicate description to the description classified in its place.
+
+        Returns:
+            dict: `{description: representative}` for descriptions grouped under another one.
+                Representatives, descriptions without near-duplicates and descriptions with fewer
+                than `MIN_TOKENS` product tokens are not included.
+        """
+        unique = list(dict.fromkeys(descriptions))
+        # variants that differ only in dropped tokens share a token set and are grouped without hashing
+        by_tokens = {}
+        for description in unique:
+            by_tokens.setdefault(product_tokens(description), []).append(description)
+        token_sets = list(by_tokens)
+
+        # each token set joins the most similar earlier representative it reaches the threshold
+        # with, or becomes a representative itself; only representatives go into the LSH buckets,
+        # so every member is checked against its own representative and groups cannot chain
+        buckets = {}
+        representative_of = {}
+        for index, token_set in enumerate(token_sets):
+            # too little left to compare on once the variant tokens are gone
+            if len(token_set) < MIN_TOKENS:
+                continue
+            signature = self.signature(token_set)
+            keys = [(band, signature[band * self.rows:(band + 1) * self.rows]) for band in range(self.bands)]
+            specs = spec_tokens(token_set)
+            best = None
+            for other in dict.fromkeys(other for key in keys for other in buckets.get(key, ())):
+                if spec_tokens(token_sets[other]) != specs:
+                    continue
+                similarity = len(token_set & token_sets[other]) / len(token_set | token_sets[other])
+                if similarity >= self.threshold and (best is None or similarity > best[0]):
+                    best = (similarity, other)
+            if best is not None:
+                representative_of[index] = best[1]
+                continue
+            for key in keys:
+                buckets.setdefault(key, []).append(index)
+
+        mapping = {}
+        for index, token_set in enumerate(token_sets):
+            if len(token_set) < MIN_TOKENS:
+                continue
+            representative = by_tokens[token_sets[representative_of.get(index, index)]][0]
+            for description in by_tokens[token_set]:
+                if description != representative:
+                    mapping[description] = representative
+        self.descriptions += len(unique)
+        self.propagated += len(mapping)
+        self.groups += len(set(mapping.values()))
+        return mapping
+
+    def stats(self) -> dict:
+        return {"descriptions": self.descriptions, "propagated": self.propagated, "groups": self.groups}
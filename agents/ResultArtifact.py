@@ -0,0 +1,140 @@
+import csv
+import gzip
+import io
+import math
+import re
+import tempfile
+import zipfile
+from xml.sax.saxutils import escape
+
+FORMATS = {
+    'csv': ('csv', 'text/csv'),
+    'csv.gz': ('csv.gz', 'application/gzip'),
+    'xlsx': ('xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+}
+
+# Characters XML 1.0 does not allow, which Excel refuses to open
+ILLEGAL_XML = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+XLSX_PARTS = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    'xl/workbook.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Results" sheetId="1" r:id="rId1"/></sheets></workbook>'
+    ),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'
+    ),
+}
+
+
+class ResultArtifact:
+    """
+    Results attachment for one job, written row by row into a spooled temporary file that
+    stays in memory up to `max_memory` bytes and moves to disk beyond that. Nothing is shared
+    between jobs, so concurrent requests cannot pick up each other's results.
+
+    XLSX is written directly as a single-sheet workbook with inline strings, so no spreadsheet
+    library is needed.
+
+    Args:
+        columns (list): Column names, in output order.
+        fmt (str): 'csv', 'csv.gz' or 'xlsx'.
+        basename (str): File name without extension; unsafe characters are replaced.
+        max_memory (int): Bytes kept in memory before spilling to a temporary file.
+    """
+
+    def __init__(self, columns: list, fmt: str = 'csv', basename: str = 'classification_results', max_memory: int = 5 * 1024 * 1024):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unsupported result format {fmt!r}, expected one of {', '.join(FORMATS)}")
+        self.columns = list(columns)
+        self.fmt = fmt
+        extension, self.content_type = FORMATS[fmt]
+        self.filename = f"{re.sub(r'[^A-Za-z0-9._-]+', '_', basename)}.{extension}"
+        self.rows = 0
+        self._file = tempfile.SpooledTemporaryFile(max_size=max_memory)
+        self._zip = None
+        self._gzip = None
+        if fmt == 'xlsx':
+            self._zip = zipfile.ZipFile(self._file, 'w', compression=zipfile.ZIP_DEFLATED)
+            self._sheet = self._zip.open('xl/worksheets/sheet1.xml', 'w')
+            self._sheet.write(b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                              b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>')
+            self._write_xlsx_row(self.columns)
+        else:
+            binary = self._file
+            if fmt == 'csv.gz':
+                self._gzip = binary = gzip.GzipFile(filename=self.filename[:-3], mode='wb', fileobj=self._file)
+            self._text = io.TextIOWrapper(binary, encoding='utf-8', newline='', write_through=True)
+            self._csv = csv.writer(self._text)
+            self._csv.writerow(self.columns)
+
+    def write_row(self, row: dict):
+        """
+        Append one result row; missing columns are left empty.
+        """
+        values = [row.get(column) for column in self.columns]
+        if self._zip is not None:
+            self._write_xlsx_row(values)
+        else:
+            self._csv.writerow(['' if _is_missing(value) else value for value in values])
+        self.rows += 1
+
+    def finish(self) -> bytes:
+        """
+        Complete the file and return its bytes. The artifact is closed afterwards.
+        """
+        try:
+            if self._zip is not None:
+                self._sheet.write(b'</sheetData></worksheet>')
+                self._sheet.close()
+                for name, content in XLSX_PARTS.items():
+                    self._zip.writestr(name, content)
+                self._zip.close()
+            else:
+                self._text.flush()
+                self._text.detach()
+                if self._gzip is not None:
+                    self._gzip.close()
+            self._file.seek(0)
+            return self._file.read()
+        finally:
+            self.close()
+
+    def close(self):
+        self._file.close()
+
+    def _write_xlsx_row(self, values: list):
+        cells = []
+        for value in values:
+            if _is_missing(value):
+                cells.append('<c/>')
+            elif isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value):
+                cells.append(f'<c><v>{value}</v></c>')
+            else:
+                text = escape(ILLEGAL_XML.sub('', str(value)))
+                cells.append(f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>')
+        self._sheet.write(f'<row>{"".join(cells)}</row>'.encode('utf-8'))
+
+
+def _is_missing(value) -> bool:
+    return value is None or (isinstance(value, float) and math.isnan(value))
@@ -0,0 +1,63 @@
+import asyncio
+
+
+class _Flight:
+    __slots__ = ('task', 'waiters')
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key into one in-flight call.
+
+    The first caller for a key starts the call; callers arriving while it runs await the same
+    task and get the same result object (or exception) instead of repeating the work. Once it
+    finishes the key is free again, so this suppresses duplicates in flight only; caching is
+    left to the stores and caches behind the call. The shared call is cancelled only when every
+    caller waiting on it has been cancelled, so one client disconnecting does not fail the others.
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self.calls = 0
+        self.shared = 0
+
+    async def run(self, key, call):
+        """
+        Await `call()` for `key`, or the call already in flight for it.
+
+        Args:
+            key: Hashable key identifying duplicate calls.
+            call: Coroutine function with no arguments, only called when no call for `key` is in flight.
+        """
+        self.calls += 1
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _Flight(asyncio.ensure_future(call()))
+            self._flights[key] = flight
+            flight.task.add_done_callback(lambda _: self._flights.pop(key, None) if self._flights.get(key) is flight else None)
+        else:
+            self.shared += 1
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            if flight.waiters == 1 and not flight.task.done():
+                # the next caller for this key starts afresh instead of joining a cancelled call
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                flight.task.cancel()
+            raise
+        finally:
+            flight.waiters -= 1
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "shared": self.shared,
+            "in_flight": len(self._flights),
+            "suppression_rate": round(self.shared / self.calls, 4) if self.calls else 0.0,
+        }
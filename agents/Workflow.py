@@ -0,0 +1,154 @@
+from typing import Annotated
+from typing_extensions import TypedDict
+
+from langgraph.graph import START, END, StateGraph
+from langgraph.graph.message import add_messages
+
+from agents.ChapterSelector import ChapterSelector
+from agents.CodeExtractor import CodeExtractor
+from agents.LevelOneSelector import LevelOneSelector
+from agents.DeepSelector import DeepSelector
+from agents.FinalSelector import FinalSelector
+
+
+BASE_MODEL = "gemini-2.0-flash"
+DEEP_MODEL = "gemini-2.0-flash-thinking-exp-01-21"
+FINAL_MODEL = "gemini-2.5-flash-preview-04-17"
+
+
+class State(TypedDict):
+    responses: Annotated[list, add_messages]
+    product_description: str
+    invoice_number: str
+    origin: str
+    chapters_list: list
+    four_digit_code_list: list
+    full_code_list: list
+    final_codes: dict
+
+
+class PathStats:
+    """
+    How often each adaptive step took its shortcut, and how long the full path took when it
+    ran, to estimate the latency the shortcuts saved.
+    """
+
+    def __init__(self):
+        self._steps = {}
+
+    def record(self, step: str, fast: bool, elapsed: float = 0.0):
+        counts = self._steps.setdefault(step, {"full": 0, "fast": 0, "full_time": 0.0})
+        if fast:
+            counts["fast"] += 1
+        else:
+            counts["full"] += 1
+            counts["full_time"] += elapsed
+
+    def stats(self) -> dict:
+        stats = {}
+        for step, counts in self._steps.items():
+            mean_full = counts["full_time"] / counts["full"] if counts["full"] else 0.0
+            stats[step] = {"full": counts["full"], "fast": counts["fast"], "mean_full_s": mean_full,
+                           "estimated_saved_s": counts["fast"] * mean_full}
+        return stats
+
+
+def build_workflow(llm, logger, agent_actions, chapters_list, structured_output=False, scheduler=None,
+                   ranker=None, top_chapters=0, top_headings=0, top_lines=0, chapter_skip_margin=None, prefetch_codes=0, metrics=None,
+                   skip_deep_max_candidates=0, regex_extraction=False, path_stats=None):
+    """
+    Build the agents and compile the classification graph.
+
+    The compiled graph holds no per-request state, so it is built once and shared by every
+    request. The invoice number travels in the graph state and is attached to logs as a tag;
+    callers also pass it as `invoice_number` run metadata so the scheduler can queue fairly.
+
+    Args:
+        llm: Chat model used by the selectors and the code extractor.
+        logger: Logfire logger shared by all agents.
+        agent_actions (AgentActions): Catalog lookups and external API calls.
+        chapters_list (list): HTS chapter headers shown to the chapter selector.
+        structured_output (bool): Have each selector return its reasoning and codes in one
+            structured response, falling back to the code extractor if that fails.
+        scheduler (LLMScheduler): Optional process-wide scheduler that every LLM call goes through.
+        ranker (CandidateRanker): Optional lexical ranker used to shorten candidate lists.
+        top_chapters, top_headings, top_lines (int): How many ranked candidates each selector
+            shows the LLM; 0 shows all of them.
+        chapter_skip_margin (float): Pick chapters from the ranking alone, without an LLM call,
+            when the ranking margin is at least this high. None never skips.
+        prefetch_codes (int): Start duty lookups for this many of the deep selector's candidates
+            while the final selector runs, for items whose state has an `origin`. 0 disables it.
+        metrics (Metrics): Optional metrics that record node durations and each LLM call by model and agent.
+        skip_deep_max_candidates (int): Skip the deep selector and give the final selector every
+            candidate when the selected headings have at most this many 10-digit lines. 0 never skips.
+        regex_extraction (bool): Ask selectors to end with a "Selected:" line and read the codes
+            from it, calling the code extractor only when the line is missing or malformed.
+        path_stats (PathStats): Optional counts of which path each item took through the adaptive steps.
+
+    Returns:
+        The compiled graph configured for async execution.
+    """
+    try:
+        deep_llm = llm.with_config(config={"model": DEEP_MODEL})
+        final_llm = llm.with_config(config={"model": FINAL_MODEL})
+
+        def agent_llm(model_llm, model, agent):
+            # metrics sit inside the scheduler so call latency excludes the wait for a slot
+            if metrics is not None:
+                model_llm = metrics.wrap_llm(model_llm, model, agent)
+            if scheduler is not None:
+                model_llm = scheduler.wrap(model_llm, model)
+            return model_llm
+
+        code_extractor = CodeExtractor(llm=agent_llm(llm, BASE_MODEL, "code_extractor"), logger=logger, regex_first=regex_extraction, path_stats=path_stats)
+
+        chapter_selector = ChapterSelector(llm=agent_llm(llm, BASE_MODEL, "chapter_selector"), logger=logger, chapters_list=chapters_list, code_extractor=code_extractor,
+                                           structured_output=structured_output, ranker=ranker, top_chapters=top_chapters, skip_margin=chapter_skip_margin)
+
+        level_one_selector = LevelOneSelector(llm=agent_llm(llm, BASE_MODEL, "level_one_selector"), logger=logger, code_extractor=code_extractor, agent_actions=agent_actions,
+                                              structured_output=structured_output, ranker=ranker, top_headings=top_headings)
+
+        deep_selector = DeepSelector(llm=agent_llm(deep_llm, DEEP_MODEL, "deep_selector"), logger=logger, code_extractor=code_extractor, agent_actions=agent_actions,
+                                     structured_output=structured_output, ranker=ranker, top_lines=top_lines, prefetch_codes=prefetch_codes,
+                                     skip_max_candidates=skip_deep_max_candidates, path_stats=path_stats)
+
+        final_selector = FinalSelector(llm=agent_llm(final_llm, FINAL_MODEL, "final_selector"), logger=logger, agent_actions=agent_actions)
+
+    except Exception as e:
+        logger.exception(f"Failed to initialize agents: {e}")
+        raise
+
+    # Build the graph
+    logger.debug("Building workflow graph...")
+    try:
+        graph_builder = StateGraph(State)
+
+        def node(name, function):
+            return metrics.timed_node(name, function) if metrics is not None else function
+
+        graph_builder.add_node("chapter_selector", node("chapter_selector", chapter_selector.select_chapters))
+        graph_builder.add_edge(START, "chapter_selector")
+
+        graph_builder.add_node("select_four_digit_codes", node("select_four_digit_codes", level_one_selector.select_four_digit_codes))
+        graph_builder.add_edge("chapter_selector", "select_four_digit_codes")
+
+        graph_builder.add_node("select_full_codes", node("select_full_codes", deep_selector.select_full_codes))
+        if skip_deep_max_candidates:
+            graph_builder.add_node("take_all_full_codes", node("take_all_full_codes", deep_selector.take_all_full_codes))
+            graph_builder.add_conditional_edges("select_four_digit_codes", deep_selector.route, ["select_full_codes", "take_all_full_codes"])
+            graph_builder.add_edge("take_all_full_codes", "select_final_codes")
+        else:
+            graph_builder.add_edge("select_four_digit_codes", "select_full_codes")
+
+        graph_builder.add_node("select_final_codes", node("select_final_codes", final_selector.select_final_codes))
+        graph_builder.add_edge("select_full_codes", "select_final_codes")
+
+        graph_builder.add_edge("select_final_codes", END)
+
+        graph = graph_builder.compile()
+        # Configure the graph for async execution
+        graph_async = graph.with_config({"executor": "async"})
+    except Exception as e:
+        logger.exception(f"Failed to build or compile workflow: {e}")
+        raise
+    return graph_async
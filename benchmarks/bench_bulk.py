@@ -0,0 +1,106 @@
+"""
+Offline bulk run with a crash in the middle, to check throughput and what a resume costs.
+
+Writes a CSV of synthetic items, runs it through the app's bulk runner (fake LLM, stub
+Tariffy/SimplyDuty, synthetic catalog as in bench_classify), cancels the run once
+`--interrupt-at` of the rows are done, then runs it again on the same output. Reports rows/s
+for each run and the LLM calls spent, so a resume that re-classifies finished rows shows up
+as more calls per row than the first run.
+
+    python -m benchmarks.bench_bulk
+    python -m benchmarks.bench_bulk --rows 2000 --chunk-size 200 --interrupt-at 0.3
+"""
+import argparse
+import asyncio
+import csv
+import importlib
+import json
+import os
+import sys
+import tempfile
+import time
+
+from benchmarks.bench_classify import REPO_ROOT, configure
+from benchmarks.fake_llm import FakeChatModel
+from benchmarks.stub_servers import StubSmtp, StubUpstreams
+from benchmarks.synthetic_hts import make_descriptions
+
+
+def write_input(path: str, rows: int, origin: str):
+    with open(path, 'w', encoding='utf-8', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=["Description", "Country of Origin"])
+        writer.writeheader()
+        for i, description in enumerate(make_descriptions(rows, seed=11)):
+            writer.writerow({"Description": f"{description} lot {i}", "Country of Origin": origin})
+
+
+async def run_until(app, input_path: str, output_path: str, stop_at: int = None) -> dict:
+    """
+    One bulk run, cancelled once `stop_at` rows are done (counting rows resumed from the output).
+    """
+    progress = {}
+    run = asyncio.ensure_future(app.bulk_runner.run("bench-bulk", input_path, output_path, on_progress=lambda p: progress.update(current=p)))
+    start = time.perf_counter()
+    while not run.done():
+        current = progress.get("current")
+        if stop_at is not None and current is not None and current.skipped + current.done >= stop_at:
+            run.cancel()
+            break
+        await asyncio.sleep(0.01)
+    await asyncio.gather(run, return_exceptions=True)
+    snapshot = progress["current"].snapshot()
+    snapshot["wall_s"] = time.perf_counter() - start
+    return snapshot
+
+
+async def main(args):
+    os.chdir(REPO_ROOT)
+    if str(REPO_ROOT) not in sys.path:
+        sys.path.insert(0, str(REPO_ROOT))
+    os.environ.update({"BULK_CHUNK_SIZE": str(args.chunk_size), "BULK_BATCH_SIZE": str(args.batch_size), "BULK_CLASSIFY_CONCURRENCY": str(args.concurrency),
+                       "BULK_PROGRESS_INTERVAL": "0"})
+    # the default per-model limits would make this a benchmark of the rate limiter
+    os.environ.setdefault("LLM_DEFAULT_RPM", "1000000")
+    os.environ.setdefault("LLM_DEFAULT_TPM", "1000000000")
+    llm = FakeChatModel(latency=args.llm_latency)
+    with tempfile.TemporaryDirectory() as workdir, StubSmtp() as smtp:
+        async with StubUpstreams(latency=args.http_latency) as stubs:
+            configure(args, workdir, stubs, smtp, llm)
+            app = importlib.import_module("classification_and_duties_deploy")
+            input_path = os.path.join(workdir, 'items.csv')
+            output_path = os.path.join(workdir, 'results.jsonl')
+            write_input(input_path, args.rows, args.origin)
+            await app.http_sessions.start('tariffy', 'simplyduty')
+            try:
+                for label, stop_at in (("interrupted", int(args.rows * args.interrupt_at)), ("resumed", None)):
+                    calls = llm.calls
+                    result = await run_until(app, input_path, output_path, stop_at)
+                    processed = result["rows_done"] - result["rows_resumed"]
+                    print(f"{label:>11}: {result['rows_resumed']:5d} resumed   {processed:5d} processed   {result['rows_failed']} failed"
+                          f"   {processed / result['wall_s']:7.1f} rows/s   LLM calls {llm.calls - calls:6d}"
+                          f" ({(llm.calls - calls) / max(processed, 1):.1f}/row)")
+            finally:
+                await app.http_sessions.close()
+            with open(output_path, 'r', encoding='utf-8') as file:
+                rows = [json.loads(line)["row"] for line in file]
+            print(f"output: {len(rows)} lines, {len(set(rows))} distinct rows of {args.rows}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1000, help="Rows in the input file")
+    parser.add_argument("--chunk-size", type=int, default=100, help="BULK_CHUNK_SIZE")
+    parser.add_argument("--batch-size", type=int, default=25, help="BULK_BATCH_SIZE")
+    parser.add_argument("--concurrency", type=int, default=32, help="BULK_CLASSIFY_CONCURRENCY")
+    parser.add_argument("--interrupt-at", type=float, default=0.5, help="Fraction of rows done when the first run is cancelled")
+    parser.add_argument("--llm-latency", type=float, default=0.02, help="Seconds per fake LLM call")
+    parser.add_argument("--http-latency", type=float, default=0.01, help="Seconds per Tariffy/SimplyDuty response")
+    parser.add_argument("--headings-per-chapter", type=int, default=8, help="Size of the synthetic catalog")
+    parser.add_argument("--subheadings", type=int, default=4, help="8-digit subheadings per heading")
+    parser.add_argument("--lines", type=int, default=3, help="10-digit lines per subheading")
+    parser.add_argument("--origin", default="CN", help="Country of origin of the items")
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,54 @@
+"""
+Micro-benchmark: linear-scan HTS lookups versus the indexed HtsCatalog.
+
+    python -m benchmarks.bench_catalog_lookup
+"""
+import copy
+import random
+import timeit
+
+from agents.AgentActions import AgentActions
+from agents.HtsCatalog import HtsCatalog
+from benchmarks.synthetic_hts import make_htsdata
+
+
+def scan_four_digit(four_digit_codes, chapters):
+    return [item for chapter in chapters for item in four_digit_codes if item['htsno'][:2] == chapter]
+
+
+def scan_full(final_full_codes, headings):
+    return [item for code in headings for item in final_full_codes if item['htsno'][:4] == code]
+
+
+def scan_exact(final_full_codes, codes):
+    return [next((item for item in final_full_codes if item['htsno'] == code), None) for code in codes]
+
+
+def main():
+    four_digit_codes, final_full_codes = AgentActions.wrangle_hts_data(copy.deepcopy(make_htsdata()))
+    catalog = HtsCatalog(four_digit_codes, final_full_codes)
+    print(f"catalog: {len(four_digit_codes)} headings, {len(final_full_codes)} full codes")
+
+    rng = random.Random(1)
+    chapters = [i['htsno'][:2] for i in rng.sample(four_digit_codes, 3)]
+    headings = [i['htsno'] for i in rng.sample(four_digit_codes, 6)]
+    codes = [i['htsno'] for i in rng.sample(final_full_codes, 6)]
+
+    cases = [
+        ('chapter -> headings', lambda: scan_four_digit(four_digit_codes, chapters),
+         lambda: [i for c in chapters for i in catalog.headings_for_chapter(c)]),
+        ('heading -> lines', lambda: scan_full(final_full_codes, headings),
+         lambda: [i for h in headings for i in catalog.lines_for_heading(h)]),
+        ('exact htsno', lambda: scan_exact(final_full_codes, codes),
+         lambda: [catalog.get(c) for c in codes]),
+    ]
+    for name, scan, indexed in cases:
+        assert scan() == indexed()
+        n = 200
+        scan_t = timeit.timeit(scan, number=n) / n
+        index_t = timeit.timeit(indexed, number=n) / n
+        print(f"{name:22s} scan {scan_t * 1e6:10.1f} us   indexed {index_t * 1e6:8.2f} us   x{scan_t / index_t:,.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""
+Startup benchmark: json.load + wrangle_hts_data versus opening a prebuilt snapshot.
+
+    python -m benchmarks.bench_catalog_startup [files/htsdata.json]
+
+Uses the real export when a path is given, otherwise synthetic HTS data.
+"""
+import json
+import os
+import sys
+import tempfile
+import time
+
+from agents.CatalogSnapshot import CatalogSnapshot, build_snapshot
+from agents.HtsCatalog import HtsCatalog
+from benchmarks.synthetic_hts import make_htsdata
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        raw_path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(tmp, 'htsdata.json')
+        if len(sys.argv) <= 1:
+            with open(raw_path, 'w', encoding='utf-8') as file:
+                json.dump(make_htsdata(), file)
+        snapshot_path = os.path.join(tmp, 'htsdata.snapshot')
+
+        with open(raw_path, 'r', encoding='utf-8') as file:
+            catalog = build_snapshot(json.load(file), snapshot_path)
+
+        start = time.perf_counter()
+        with open(raw_path, 'r', encoding='utf-8') as file:
+            wrangled = HtsCatalog.from_hts_data(json.load(file))
+        wrangle_t = time.perf_counter() - start
+
+        start = time.perf_counter()
+        snapshot = CatalogSnapshot(snapshot_path)
+        open_t = time.perf_counter() - start
+        sample = catalog.final_full_codes[len(catalog) // 2]['htsno']
+        start = time.perf_counter()
+        snapshot.headings_for_chapter(sample[:2])
+        snapshot.lines_for_heading(sample[:4])
+        snapshot.get(sample)
+        first_lookup_t = time.perf_counter() - start
+
+        assert snapshot.version == wrangled.version
+        assert snapshot.get(sample) == wrangled.get(sample)
+        assert snapshot.lines_for_heading(sample[:4]) == wrangled.lines_for_heading(sample[:4])
+
+        print(f"catalog: {len(catalog)} full codes, snapshot {os.path.getsize(snapshot_path) / 1e6:.1f} MB")
+        print(f"json.load + wrangle   {wrangle_t * 1e3:9.1f} ms")
+        print(f"snapshot open         {open_t * 1e3:9.3f} ms")
+        print(f"snapshot first lookup {first_lookup_t * 1e3:9.3f} ms")
+        snapshot.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,223 @@
+"""
+Offline end-to-end benchmark of POST /classify.
+
+Runs the real API app in-process with the fake chat model in place of `init_chat_model`,
+local stub servers for Tariffy and SimplyDuty, an SMTP sink for the results emails and a
+synthetic HTS catalog, so it spends no quota and needs no network. For each invoice size
+and concurrency it sends synthetic invoices and reports request latency percentiles,
+items/sec, LLM usage and the time spent in each stage.
+
+    python -m benchmarks.bench_classify
+    python -m benchmarks.bench_classify --sizes 1 10 100 --concurrency 1 16 --requests 32 --llm-latency 0.2
+    python -m benchmarks.bench_classify --json results.json
+
+App settings are read from the environment as usual, e.g.
+`SKIP_DEEP_MAX_CANDIDATES=8 REGEX_EXTRACTION=true python -m benchmarks.bench_classify`.
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import math
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+from langchain_core.callbacks import BaseCallbackHandler
+
+from benchmarks.fake_llm import FakeChatModel
+from benchmarks.stub_servers import StubSmtp, StubUpstreams
+from benchmarks.synthetic_hts import make_descriptions, make_htsdata
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+GRAPH_NODES = ("chapter_selector", "select_four_digit_codes", "select_full_codes", "take_all_full_codes", "select_final_codes")
+
+
+class StageTimer(BaseCallbackHandler):
+    """
+    Accumulates wall time per stage: graph nodes through LangChain callbacks, everything
+    else through `timed` wrappers.
+    """
+    run_inline = True
+
+    def __init__(self):
+        self.totals = {}
+        self.counts = {}
+        self._started = {}
+
+    def add(self, stage: str, elapsed: float):
+        self.totals[stage] = self.totals.get(stage, 0.0) + elapsed
+        self.counts[stage] = self.counts.get(stage, 0) + 1
+
+    def timed(self, stage: str, function):
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await function(*args, **kwargs)
+            finally:
+                self.add(stage, time.perf_counter() - start)
+        return wrapper
+
+    def on_chain_start(self, serialized, inputs, *, run_id, name=None, **kwargs):
+        if name in GRAPH_NODES:
+            self._started[run_id] = (name, time.perf_counter())
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        started = self._started.pop(run_id, None)
+        if started is not None:
+            self.add(started[0], time.perf_counter() - started[1])
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._started.pop(run_id, None)
+
+    def reset(self):
+        self.totals.clear()
+        self.counts.clear()
+
+
+def percentile(values: list, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[max(math.ceil(q * len(ordered)) - 1, 0)]
+
+
+def invoice(request_number: int, size: int, origin: str = "CN") -> dict:
+    descriptions = make_descriptions(size, seed=request_number)
+    return {
+        "id": str(request_number), "job_uuid": f"bench-{request_number}", "created": 0, "api_version": "1", "type": "classification",
+        "data": {
+            "caller": {"email": "bench@example.com"},
+            "value": {
+                "General Information": {"Invoice Number": f"BENCH-{request_number}"},
+                # a per-request suffix keeps the classification store from answering repeats
+                "Items": [{"Description": f"{d} lot {request_number}-{i}", "Country of Origin": origin} for i, d in enumerate(descriptions)],
+            },
+        },
+    }
+
+
+def configure(args, workdir: str, stubs: StubUpstreams, smtp: StubSmtp, llm: FakeChatModel):
+    """
+    Point the app at the local stand-ins. Must run before the app module is imported.
+    """
+    hts_path = os.path.join(workdir, 'htsdata.json')
+    with open(hts_path, 'w', encoding='utf-8') as file:
+        json.dump(make_htsdata(headings_per_chapter=args.headings_per_chapter, subheadings=args.subheadings, lines=args.lines), file)
+    os.environ.update({
+        "HTS_DATA_PATH": hts_path,
+        "HTS_SNAPSHOT_PATH": os.path.join(workdir, 'htsdata.snapshot'),
+        "TARIFFY_URL": stubs.tariffy_url,
+        "SIMPLEDUTY_URL": stubs.simplyduty_url,
+        "TARIFFY_ORG_ID": "bench", "TARIFFY_API_KEY": "bench", "SIMPLEDUTY_API_KEY": "bench", "GOOGLE_API_KEY": "bench",
+        "EMAIL_TRANSPORT": "smtp", "SMTP_HOST": "127.0.0.1", "SMTP_PORT": str(smtp.port),
+        "LOGFIRE_SEND_TO_LOGFIRE": "false", "LOGFIRE_CONSOLE": "false",
+    })
+    import langchain.chat_models
+    langchain.chat_models.init_chat_model = lambda **kwargs: llm
+
+
+def instrument(app, timer: StageTimer):
+    app.graph_async = app.graph_async.with_config(callbacks=[timer])
+    app.agent_actions.get_tariffy_chunk = timer.timed("tariffy", app.agent_actions.get_tariffy_chunk)
+    app.agent_actions.get_rates_and_descs = timer.timed("duty_lookup", app.agent_actions.get_rates_and_descs)
+    app.email_transport.send_batch = timer.timed("email_batch", app.email_transport.send_batch)
+
+
+async def run_config(app, client, llm: FakeChatModel, timer: StageTimer, size: int, concurrency: int, requests: int, first_request: int,
+                     origin: str = "CN") -> dict:
+    timer.reset()
+    calls, prompt_chars = llm.calls, llm.prompt_chars
+    emails_before = app.email_delivery.sent + app.email_delivery.failed
+    slots = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def send(request_number):
+        async with slots:
+            start = time.perf_counter()
+            response = await client.post("/classify", json=invoice(request_number, size, origin))
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[send(first_request + n) for n in range(requests)])
+    elapsed = time.perf_counter() - start
+    while app.email_delivery.sent + app.email_delivery.failed < emails_before + requests:
+        await asyncio.sleep(0.01)
+
+    items = size * requests
+    return {
+        "size": size,
+        "concurrency": concurrency,
+        "requests": requests,
+        "p50_s": statistics.median(latencies),
+        "p95_s": percentile(latencies, 0.95),
+        "p99_s": percentile(latencies, 0.99),
+        "items_per_s": items / elapsed,
+        "llm_calls_per_item": (llm.calls - calls) / items,
+        "prompt_tokens_per_item": (llm.prompt_chars - prompt_chars) / 4 / items,
+        "stages_ms": {stage: timer.totals[stage] / timer.counts[stage] * 1e3 for stage in timer.totals},
+    }
+
+
+def report(result: dict):
+    print(f"{result['size']:5d} items x{result['concurrency']:3d}   p50 {result['p50_s'] * 1e3:7.0f} ms   p95 {result['p95_s'] * 1e3:7.0f} ms"
+          f"   p99 {result['p99_s'] * 1e3:7.0f} ms   {result['items_per_s']:7.1f} items/s   LLM calls/item {result['llm_calls_per_item']:.1f}"
+          f"   prompt tokens/item {result['prompt_tokens_per_item']:.0f}")
+    print("      mean per call: " + "   ".join(f"{stage} {ms:.1f} ms" for stage, ms in result['stages_ms'].items()))
+
+
+async def main(args):
+    os.chdir(REPO_ROOT)
+    if str(REPO_ROOT) not in sys.path:
+        sys.path.insert(0, str(REPO_ROOT))
+    llm = FakeChatModel(latency=args.llm_latency, output_tokens=args.output_tokens)
+    timer = StageTimer()
+    results = []
+    with tempfile.TemporaryDirectory() as workdir, StubSmtp(delay=args.smtp_delay) as smtp:
+        async with StubUpstreams(latency=args.http_latency) as stubs:
+            configure(args, workdir, stubs, smtp, llm)
+            app = importlib.import_module("classification_and_duties_deploy")
+            instrument(app, timer)
+            print(f"LLM {args.llm_latency * 1e3:.0f} ms/call, HTTP {args.http_latency * 1e3:.0f} ms, SMTP {args.smtp_delay * 1e3:.0f} ms")
+            async with app.lifespan(app.api_app):
+                transport = httpx.ASGITransport(app=app.api_app)
+                async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+                    # one untimed request so connection pools and lazy setup are not billed to the first config
+                    await run_config(app, client, llm, timer, 1, 1, 1, 0)
+                    request_number = 1
+                    for size in args.sizes:
+                        for concurrency in args.concurrency:
+                            result = await run_config(app, client, llm, timer, size, concurrency, args.requests, request_number, args.origin)
+                            request_number += args.requests
+                            report(result)
+                            results.append(result)
+            print(f"upstream requests: {stubs.requests}")
+            for step, counts in app.path_stats.stats().items():
+                print(f"{step}: {counts['full']} full, {counts['fast']} shortcut, ~{counts['estimated_saved_s']:.1f}s saved")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 10, 50], help="Items per invoice")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8], help="Requests in flight")
+    parser.add_argument("--requests", type=int, default=8, help="Requests per size and concurrency")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="Seconds per fake LLM call")
+    parser.add_argument("--output-tokens", type=int, default=60, help="Length of fake free-text answers")
+    parser.add_argument("--http-latency", type=float, default=0.02, help="Seconds per Tariffy/SimplyDuty response")
+    parser.add_argument("--smtp-delay", type=float, default=0.0, help="Seconds per email at the SMTP sink")
+    parser.add_argument("--headings-per-chapter", type=int, default=8, help="Size of the synthetic catalog")
+    parser.add_argument("--subheadings", type=int, default=4, help="8-digit subheadings per heading")
+    parser.add_argument("--lines", type=int, default=3, help="10-digit lines per subheading")
+    parser.add_argument("--origin", default="CN", help="Country of origin of the invoice items")
+    parser.add_argument("--json", help="Also write the results to this file")
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    asyncio.run(main(parse_args()))
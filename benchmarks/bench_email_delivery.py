@@ -0,0 +1,77 @@
+"""
+Load test for result email delivery: request latency with the email sent inline (a blocking
+call on the event loop, as the handler used to do) versus queued to EmailDelivery, against a
+local SMTP stub that takes EMAIL_DELAY seconds per message.
+
+    python -m benchmarks.bench_email_delivery
+"""
+import asyncio
+import statistics
+import time
+
+from agents.EmailDelivery import EmailDelivery, OutgoingEmail, SmtpTransport
+from benchmarks.stub_servers import StubSmtp
+from benchmarks.support import offline_logger
+
+REQUESTS = 40
+CONCURRENCY = 20
+WORK = 0.05
+ATTACHMENT = b"description,most_likely_code\n" + b"cotton shirt,6109.10.00.12\n" * 1000
+
+
+def email(i: int) -> OutgoingEmail:
+    return OutgoingEmail(job_uuid=f"job-{i}", recipient="ops@example.com", subject=f"Classification results for INV-{i}",
+                         body="Results attached.", attachment=ATTACHMENT, filename="classification_results.csv")
+
+
+async def load(send) -> list:
+    """
+    REQUESTS requests, CONCURRENCY at a time; each awaits WORK seconds of classification then sends its email.
+    """
+    slots = asyncio.Semaphore(CONCURRENCY)
+    latencies = []
+
+    async def request(i):
+        async with slots:
+            start = time.perf_counter()
+            await asyncio.sleep(WORK)
+            await send(email(i))
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*[request(i) for i in range(REQUESTS)])
+    return latencies
+
+
+async def main():
+    logger = offline_logger()
+    for delay in (0.0, 0.2):
+        with StubSmtp(delay=delay) as smtp:
+            transport = SmtpTransport(host='127.0.0.1', port=smtp.port)
+
+            async def inline(message):
+                transport._send_batch([message])
+
+            start = time.perf_counter()
+            inline_latencies = await load(inline)
+            inline_total = time.perf_counter() - start
+
+            delivery = EmailDelivery(transport=transport, logger=logger, workers=2, batch_size=10)
+            await delivery.start()
+
+            async def queued(message):
+                delivery.submit(message)
+
+            start = time.perf_counter()
+            queued_latencies = await load(queued)
+            await delivery.stop(drain_timeout=60)
+            queued_total = time.perf_counter() - start
+            assert delivery.sent == REQUESTS and len(smtp.messages) == 2 * REQUESTS
+
+        print(f"SMTP {delay * 1e3:4.0f} ms/message   inline  p50 {statistics.median(inline_latencies) * 1e3:6.0f} ms"
+              f"  max {max(inline_latencies) * 1e3:6.0f} ms  all sent {inline_total:5.2f} s")
+        print(f"                      queued  p50 {statistics.median(queued_latencies) * 1e3:6.0f} ms"
+              f"  max {max(queued_latencies) * 1e3:6.0f} ms  all sent {queued_total:5.2f} s  ({smtp.connections - REQUESTS} connections)")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,56 @@
+"""
+Connection reuse check against local stub upstreams: a fresh ClientSession per call versus
+the shared HttpSessions pool used by AgentActions.
+
+    python -m benchmarks.bench_http_reuse
+"""
+import asyncio
+import time
+
+import aiohttp
+
+from agents.AgentActions import AgentActions
+from agents.HtsCatalog import HtsCatalog
+from agents.HttpSessions import HttpSessions
+from benchmarks.stub_servers import StubUpstreams
+from benchmarks.support import offline_logger
+
+CALLS = 300
+
+
+async def per_call_sessions(url: str):
+    async def one(i):
+        async with aiohttp.ClientSession() as session:
+            async with session.post(url, json={'HSCode': f'6109.10.{i:04d}'}) as response:
+                await response.json()
+    await asyncio.gather(*[one(i) for i in range(CALLS)])
+
+
+async def main():
+    logger = offline_logger()
+    async with StubUpstreams() as stubs:
+        start = time.perf_counter()
+        await per_call_sessions(stubs.simplyduty_url)
+        fresh_t = time.perf_counter() - start
+        fresh_connections = len(stubs.connections['simplyduty'])
+
+        stubs.connections['simplyduty'].clear()
+        http_sessions = HttpSessions(limit_per_host=10)
+        await http_sessions.start('tariffy', 'simplyduty')
+        agent_actions = AgentActions(logger=logger, chapter_descs={}, catalog=HtsCatalog([], []), tariffy_org_id='bench', tariffy_api_key='bench',
+                                     simpleduty_api_key='bench', http_sessions=http_sessions, tariffy_url=stubs.tariffy_url, simpleduty_url=stubs.simplyduty_url)
+        start = time.perf_counter()
+        results = await asyncio.gather(*[agent_actions.get_duty_rates('CN', 'US', f'6109.10.{i:04d}') for i in range(CALLS)])
+        shared_t = time.perf_counter() - start
+        await http_sessions.close()
+        shared_connections = len(stubs.connections['simplyduty'])
+
+    assert all(r['DutyRate'] != 'unable to retrieve code' for r in results)
+    assert shared_connections <= 10
+    print(f"{CALLS} SimplyDuty calls")
+    print(f"session per call   {fresh_connections:4d} connections  {fresh_t * 1e3:8.1f} ms")
+    print(f"shared session     {shared_connections:4d} connections  {shared_t * 1e3:8.1f} ms")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
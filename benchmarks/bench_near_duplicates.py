@@ -0,0 +1,82 @@
+"""
+Near-duplicate grouping: regression pairs and grouping speed.
+
+Checks pairs whose HTS codes differ (colors, composition, sets, voltages, wattages) are never
+grouped, and pairs that differ only in size, SKU number or pack count are, at each threshold.
+Then times `representatives` on synthetic invoices. Exits with status 1 if a pair is wrong.
+
+    python -m benchmarks.bench_near_duplicates
+    python -m benchmarks.bench_near_duplicates --thresholds 0.8 1.0 --sizes 100 10000
+"""
+import argparse
+import sys
+import time
+
+from agents.NearDuplicates import NearDuplicateClusterer
+from benchmarks.synthetic_hts import make_descriptions
+
+# Different products that share all words but a color, a spec or "set"
+KEEP_APART = [
+    ("Red wine", "White wine"),
+    ("Green tea", "Black tea"),
+    ("Brown rice", "White rice"),
+    ("Black pepper", "White pepper"),
+    ("Cotton yarn 100%", "Cotton yarn 50%"),
+    ("Knife", "Knife set"),
+    ("Tool set 10 pcs", "Tool"),
+    ("12V battery", "24V battery"),
+    ("LED 5W", "LED 60W"),
+    ("Stainless steel kitchen knife set", "Stainless steel kitchen knife"),
+]
+
+# Variants of one product: size, SKU number and pack count only
+GROUP = [
+    ("Cotton knit T-shirt M 1234", "Cotton knit T-shirt XL 5678"),
+    ("Ceramic coffee mug 2 pack", "Ceramic coffee mug 6 pcs"),
+    ("Leather wallet brown small", "Leather wallet brown large"),
+    ("Polyester zip hoodie size 2XL", "Polyester zip hoodie size S"),
+]
+
+
+def check_pairs(threshold: float) -> list[str]:
+    failures = []
+    for pairs, grouped in ((KEEP_APART, False), (GROUP, True)):
+        for first, second in pairs:
+            mapping = NearDuplicateClusterer(threshold=threshold).representatives([first, second])
+            if (second in mapping) != grouped:
+                failures.append(f"threshold {threshold}: {first!r} / {second!r} {'not ' if grouped else ''}grouped")
+    return failures
+
+
+def time_grouping(threshold: float, size: int) -> tuple[float, int]:
+    # each product in three sizes with their own SKU numbers, as in a catalog of variants
+    base = make_descriptions((size + 2) // 3, seed=5)
+    descriptions = [f"{base[i // 3]} {'SML'[i % 3]} {1000 + i}" for i in range(size)]
+    clusterer = NearDuplicateClusterer(threshold=threshold)
+    start = time.perf_counter()
+    mapping = clusterer.representatives(descriptions)
+    return time.perf_counter() - start, len(mapping)
+
+
+def main(args) -> int:
+    failures = []
+    for threshold in args.thresholds:
+        failures += check_pairs(threshold)
+        for size in args.sizes:
+            elapsed, propagated = time_grouping(threshold, size)
+            print(f"threshold {threshold:.2f}   {size:6d} descriptions   {elapsed * 1000:8.1f} ms   {propagated:6d} propagated")
+    for failure in failures:
+        print(f"FAIL {failure}")
+    print(f"pairs: {len(failures)} wrong of {len(args.thresholds) * (len(KEEP_APART) + len(GROUP))}")
+    return 1 if failures else 0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[0.6, 0.8, 1.0], help="NEAR_DUPLICATE_THRESHOLD values")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000], help="Descriptions per timed invoice")
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    sys.exit(main(parse_args()))
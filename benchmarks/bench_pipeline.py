@@ -0,0 +1,98 @@
+"""
+End-to-end wall time of an invoice with the old gather barriers versus the per-item
+ItemPipeline, on a skewed workload: most items classify quickly but a few take much longer,
+and a Tariffy request gets slower with the number of descriptions in it. Classification is
+a stubbed sleep; Tariffy and SimplyDuty are the local stub servers.
+
+    python -m benchmarks.bench_pipeline
+"""
+import asyncio
+import random
+import statistics
+import time
+
+from agents.AgentActions import AgentActions
+from agents.HtsCatalog import HtsCatalog
+from agents.HttpSessions import HttpSessions
+from agents.ItemPipeline import ItemPipeline
+from benchmarks.stub_servers import StubUpstreams
+from benchmarks.support import offline_logger
+
+FAST_CLASSIFY = 0.05
+SLOW_CLASSIFY = 1.5
+SLOW_SHARE = 0.05
+HTTP_LATENCY = 0.02
+TARIFFY_ITEM_LATENCY = 0.002
+
+
+def classify_stub():
+    async def classify(description, item=None):
+        index = int(description.split()[-1])
+        slow = random.Random(index).random() < SLOW_SHARE
+        await asyncio.sleep(SLOW_CLASSIFY if slow else FAST_CLASSIFY)
+        code = f"61{index % 90 + 10:02d}.10.00.{index % 100:02d}"
+        return {"most_likely_code": code, "most_likely_lower_rate_code": code}
+    return classify
+
+
+def lookups(agent_actions):
+    async def tariffy_lookup(descriptions):
+        return await agent_actions.get_tariffy_chunk(descriptions)
+
+    async def rates_lookup(item, final_codes, tariffy_code):
+        return await agent_actions.get_rates_and_descs(origin=item["Country of Origin"], dest='US', code_one=final_codes["most_likely_code"],
+                                                       code_two=final_codes["most_likely_lower_rate_code"], code_three=tariffy_code)
+    return tariffy_lookup, rates_lookup
+
+
+async def with_barriers(items, descriptions, agent_actions):
+    """
+    The previous handler: all classifications and the whole-invoice Tariffy call, then all duty lookups.
+    """
+    start = time.perf_counter()
+    classify = classify_stub()
+    tariffy_lookup, rates_lookup = lookups(agent_actions)
+    codes, tariffy_codes = await asyncio.gather(asyncio.gather(*[classify(d) for d in descriptions]), tariffy_lookup(descriptions))
+    tariffy_codes = dict(zip(descriptions, tariffy_codes))
+    done = []
+
+    async def rates(index):
+        await rates_lookup(items[index], codes[index], tariffy_codes.get(descriptions[index], ""))
+        done.append(time.perf_counter() - start)
+    await asyncio.gather(*[rates(index) for index in range(len(items))])
+    return done
+
+
+async def with_pipeline(items, descriptions, agent_actions):
+    start = time.perf_counter()
+    tariffy_lookup, rates_lookup = lookups(agent_actions)
+    pipeline = ItemPipeline(classify=classify_stub(), tariffy_lookup=tariffy_lookup, rates_lookup=rates_lookup,
+                            classify_concurrency=len(items), tariffy_batch_size=25, tariffy_concurrency=4, rates_concurrency=16)
+    done = []
+    async for record in pipeline.run(items, descriptions):
+        assert record.error is None, record.error
+        done.append(time.perf_counter() - start)
+    return done
+
+
+async def main():
+    logger = offline_logger()
+    async with StubUpstreams(latency=HTTP_LATENCY, tariffy_item_latency=TARIFFY_ITEM_LATENCY) as stubs:
+        http_sessions = HttpSessions(limit_per_host=20)
+        await http_sessions.start('tariffy', 'simplyduty')
+        agent_actions = AgentActions(logger=logger, chapter_descs={}, catalog=HtsCatalog([], []), tariffy_org_id='bench', tariffy_api_key='bench',
+                                     simpleduty_api_key='bench', http_sessions=http_sessions, tariffy_url=stubs.tariffy_url, simpleduty_url=stubs.simplyduty_url)
+        print(f"classify {FAST_CLASSIFY * 1e3:.0f} ms, {SLOW_SHARE:.0%} of items {SLOW_CLASSIFY * 1e3:.0f} ms; "
+              f"HTTP {HTTP_LATENCY * 1e3:.0f} ms + {TARIFFY_ITEM_LATENCY * 1e3:.0f} ms per Tariffy description")
+        for count in (50, 500):
+            items = [{"Description": f"cotton shirt {i}", "Country of Origin": "CN"} for i in range(count)]
+            descriptions = [item["Description"] for item in items]
+            for name, run in (('gather barriers', with_barriers), ('per-item pipeline', with_pipeline)):
+                done = await run(items, descriptions, agent_actions)
+                print(f"{count:4d} items  {name:18s} first {done[0] * 1e3:7.0f} ms   median {statistics.median(done) * 1e3:7.0f} ms"
+                      f"   last {done[-1] * 1e3:7.0f} ms")
+        await http_sessions.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,61 @@
+"""
+Per-item latency from classification to finished duty lookups, with and without prefetching
+duty rates for the deep selector's candidates while the final selector runs. Uses the fake
+LLM and the local SimplyDuty stub, with no duty cache so every lookup is an HTTP call.
+
+    python -m benchmarks.bench_prefetch
+"""
+import asyncio
+import copy
+import statistics
+import time
+
+from agents.AgentActions import AgentActions
+from agents.HtsCatalog import HtsCatalog
+from agents.HttpSessions import HttpSessions
+from agents.Workflow import build_workflow
+from benchmarks.fake_llm import FakeChatModel
+from benchmarks.stub_servers import StubUpstreams
+from benchmarks.support import offline_logger
+from benchmarks.synthetic_hts import make_chapter_descs, make_descriptions, make_headers, make_htsdata
+
+LLM_LATENCY = 0.1
+HTTP_LATENCY = 0.15
+ITEMS = 20
+
+
+async def main():
+    logger = offline_logger()
+    catalog = HtsCatalog.from_hts_data(copy.deepcopy(make_htsdata(headings_per_chapter=8)))
+    chapter_descs = make_chapter_descs()
+    descriptions = make_descriptions(ITEMS)
+
+    print(f"{ITEMS} items, {LLM_LATENCY * 1e3:.0f} ms per LLM call, {HTTP_LATENCY * 1e3:.0f} ms per SimplyDuty call")
+    async with StubUpstreams(latency=HTTP_LATENCY) as stubs:
+        for prefetch_codes in (0, 6):
+            http_sessions = HttpSessions(limit_per_host=100)
+            await http_sessions.start('simplyduty')
+            agent_actions = AgentActions(logger=logger, chapter_descs=chapter_descs, catalog=catalog, tariffy_org_id='bench', tariffy_api_key='bench',
+                                         simpleduty_api_key='bench', http_sessions=http_sessions, simpleduty_url=stubs.simplyduty_url)
+            graph = build_workflow(llm=FakeChatModel(latency=LLM_LATENCY), logger=logger, agent_actions=agent_actions,
+                                   chapters_list=make_headers(chapter_descs), prefetch_codes=prefetch_codes)
+            stubs.requests['simplyduty'] = 0
+            latencies = []
+
+            async def process(description):
+                start = time.perf_counter()
+                result = await graph.ainvoke({"product_description": description, "invoice_number": "bench", "origin": "CN"})
+                codes = result["final_codes"]
+                await agent_actions.get_rates_and_descs(origin="CN", dest="US", code_one=codes["most_likely_code"],
+                                                        code_two=codes["most_likely_lower_rate_code"], code_three=codes["most_likely_code"])
+                latencies.append(time.perf_counter() - start)
+
+            await asyncio.gather(*[process(d) for d in descriptions])
+            await asyncio.sleep(HTTP_LATENCY * 2)  # let unused prefetches finish before counting requests
+            await http_sessions.close()
+            print(f"prefetch {prefetch_codes}   median {statistics.median(latencies) * 1e3:6.0f} ms   max {max(latencies) * 1e3:6.0f} ms"
+                  f"   SimplyDuty calls/item {stubs.requests['simplyduty'] / ITEMS:4.1f}   {agent_actions.prefetch_stats()}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
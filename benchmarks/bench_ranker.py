@@ -0,0 +1,77 @@
+"""
+Prompt size, latency and agreement of the selector pipeline with and without the lexical
+CandidateRanker, using the fake LLM (fixed latency per call).
+
+    python -m benchmarks.bench_ranker
+
+The fake model picks at random from whatever it is shown, so comparing final codes between
+runs says nothing. Recall instead reports how often the baseline's final code would still be
+among the candidates after pre-ranking (its chapter, heading and line each within the top N);
+that is the upper bound on agreement with a real model. The synthetic descriptions are random
+bags of catalog words, so recall and the chapter-skip rate here are a floor; real product
+descriptions separate far more clearly.
+"""
+import asyncio
+import copy
+import time
+
+from agents.AgentActions import AgentActions
+from agents.CandidateRanker import CandidateRanker
+from agents.HtsCatalog import HtsCatalog
+from agents.HttpSessions import HttpSessions
+from agents.Workflow import build_workflow
+from benchmarks.fake_llm import FakeChatModel
+from benchmarks.support import offline_logger
+from benchmarks.synthetic_hts import make_chapter_descs, make_descriptions, make_headers, make_htsdata
+
+LLM_LATENCY = 0.02
+ITEMS = 30
+
+CONFIGS = [
+    ('baseline', {}),
+    ('ranked', {'top_chapters': 10, 'top_headings': 12, 'top_lines': 20}),
+    ('ranked + chapter skip', {'top_chapters': 10, 'top_headings': 12, 'top_lines': 20, 'chapter_skip_margin': 0.01}),
+]
+
+
+async def main():
+    logger = offline_logger()
+    catalog = HtsCatalog.from_hts_data(copy.deepcopy(make_htsdata(headings_per_chapter=20)))
+    chapter_descs = make_chapter_descs()
+    agent_actions = AgentActions(logger=logger, chapter_descs=chapter_descs, catalog=catalog, tariffy_org_id=None, tariffy_api_key=None,
+                                 simpleduty_api_key=None, http_sessions=HttpSessions())
+    start = time.perf_counter()
+    ranker = CandidateRanker(catalog, chapter_descs)
+    print(f"ranker built over {len(catalog)} lines in {(time.perf_counter() - start) * 1e3:.0f} ms")
+    descriptions = make_descriptions(ITEMS)
+
+    baseline = None
+    for name, options in CONFIGS:
+        llm = FakeChatModel(latency=LLM_LATENCY)
+        graph = build_workflow(llm=llm, logger=logger, agent_actions=agent_actions, chapters_list=make_headers(chapter_descs),
+                               ranker=ranker if options else None, **options)
+        start = time.perf_counter()
+        results = await asyncio.gather(*[graph.ainvoke({"product_description": d, "invoice_number": "bench"}) for d in descriptions])
+        elapsed = time.perf_counter() - start
+        if baseline is None:
+            baseline = [r["final_codes"]["most_likely_code"] for r in results]
+        recall = sum(_kept(ranker, d, code, options) for d, code in zip(descriptions, baseline)) / ITEMS
+        print(f"{name:22s} prompt tokens/item {llm.prompt_chars / 4 / ITEMS:8.0f}   LLM calls/item {llm.calls / ITEMS:4.1f}"
+              f"   wall {elapsed * 1e3:7.0f} ms   recall {recall:5.0%}")
+
+
+def _kept(ranker, description, code, options) -> bool:
+    if not options:
+        return True
+    chapters = ranker.rank_chapters(description, max(options['top_chapters'], 4))
+    if 'chapter_skip_margin' in options and CandidateRanker.margin(chapters, 3) >= options['chapter_skip_margin']:
+        chapters = chapters[:3]
+    else:
+        chapters = chapters[:options['top_chapters']]
+    return (code[:2] in [chapter for chapter, _ in chapters]
+            and code[:4] in ranker.rank_headings(description, [code[:2]], options['top_headings'])
+            and code in ranker.rank_lines(description, [code[:4]], options['top_lines']))
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,89 @@
+"""
+Cost of assembling result rows for an invoice: the previous pandas path (three DataFrames, two
+merges on description, iterrows, a positional concat) against ItemRecord with a positional
+join. Classification, Tariffy and duty results are precomputed, so only the assembly is timed.
+One in ten descriptions is repeated to show the row multiplication of merging on description.
+
+    python -m benchmarks.bench_record_join
+"""
+import random
+import time
+import tracemalloc
+
+from agents.ItemRecord import ItemRecord, PositionalJoin, output_columns
+
+SIZES = (10, 1000, 50000)
+
+
+def make_invoice(count: int):
+    rng = random.Random(count)
+    items = []
+    for i in range(count):
+        description = f"cotton shirt {rng.randrange(count) if i % 10 == 0 else i}"
+        items.append({"Description": description, "Country of Origin": "CN", "Quantity": i})
+    codes = {item["Description"]: {"most_likely_code": "6109.10.00.12", "most_likely_lower_rate_code": "6109.10.00.14"} for item in items}
+    rates = {
+        "most_likely_code_desc": "T-shirts, knitted", "most_likely_code_duty_rate": 16.5,
+        "most_likely_code_lower_rate_desc": "T-shirts, cotton", "most_likely_code_lower_rate_duty_rate": 12.0,
+        "tariffy_hts_code_desc": "T-shirts", "tariffy_hts_code_duty_rate": 16.5,
+    }
+    return items, codes, rates
+
+
+def pandas_rows(items, codes, rates):
+    import pandas as pd
+    df = pd.DataFrame(items).rename(columns={"Description": "description"})
+    classification_df = pd.DataFrame([{"description": d, "most_likely_code": c["most_likely_code"],
+                                       "most_likely_code_lower_rate_code": c["most_likely_lower_rate_code"]}
+                                      for d, c in ((item["Description"], codes[item["Description"]]) for item in items)])
+    tariffy_df = pd.DataFrame([{"description": item["Description"], "tariffy_hts_code": "6109.10.00.12"} for item in items])
+    final_df = pd.merge(df, classification_df, on="description", how="left")
+    final_df = pd.merge(final_df, tariffy_df, on="description", how="left")
+    results = [dict(rates) for _ in final_df.iterrows()]
+    final_df = pd.concat([final_df, pd.DataFrame(results)], axis=1)
+    final_df = final_df[output_columns(items)]
+    return final_df.astype(object).where(final_df.notna(), None).to_dict(orient="records")
+
+
+def record_rows(items, codes, rates):
+    columns = output_columns(items)
+    in_order = PositionalJoin(total=len(items))
+    rows = []
+    # finish records out of order, as the pipeline does
+    order = list(range(len(items)))
+    random.Random(0).shuffle(order)
+    for index in order:
+        record = ItemRecord(index, items[index], items[index]["Description"])
+        record.final_codes = codes[record.description]
+        record.tariffy_code = "6109.10.00.12"
+        record.rates = rates
+        for ready in in_order.add(record):
+            rows.append(ready.row(columns))
+    return rows
+
+
+def measure(build, *args):
+    start = time.perf_counter()
+    rows = build(*args)
+    elapsed = time.perf_counter() - start
+    # memory in a second run, since tracing allocations slows the build down
+    tracemalloc.start()
+    build(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return rows, elapsed, peak
+
+
+def main():
+    start = time.perf_counter()
+    import pandas  # noqa: F401
+    print(f"import pandas {(time.perf_counter() - start) * 1e3:.0f} ms")
+    for count in SIZES:
+        invoice = make_invoice(count)
+        for name, build in (('pandas merges', pandas_rows), ('ItemRecord join', record_rows)):
+            rows, elapsed, peak = measure(build, *invoice)
+            print(f"{count:6d} lines  {name:16s} {elapsed * 1e3:9.1f} ms   peak {peak / 2 ** 20:7.1f} MiB   rows out {len(rows)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+Request overhead benchmark: rebuilding agents and recompiling the graph on every request
+versus compiling it once, with a zero-latency fake LLM so only setup cost is measured.
+
+    python -m benchmarks.bench_request_overhead
+"""
+import asyncio
+import copy
+import time
+
+from agents.AgentActions import AgentActions
+from agents.HtsCatalog import HtsCatalog
+from agents.HttpSessions import HttpSessions
+from agents.Workflow import build_workflow
+from benchmarks.fake_llm import FakeChatModel
+from benchmarks.support import offline_logger
+from benchmarks.synthetic_hts import make_chapter_descs, make_descriptions, make_headers, make_htsdata
+
+logger = offline_logger()
+
+
+def make_agent_actions(catalog, chapter_descs):
+    return AgentActions(logger=logger, chapter_descs=chapter_descs, catalog=catalog, tariffy_org_id=None, tariffy_api_key=None, simpleduty_api_key=None, http_sessions=HttpSessions())
+
+
+async def run(requests: int, items: int):
+    catalog = HtsCatalog.from_hts_data(copy.deepcopy(make_htsdata(headings_per_chapter=8)))
+    chapter_descs = make_chapter_descs()
+    headers = make_headers(chapter_descs)
+    llm = FakeChatModel()
+    descriptions = make_descriptions(items)
+
+    async def invoke(graph, invoice):
+        return await asyncio.gather(*[
+            graph.ainvoke({"product_description": d, "invoice_number": invoice}) for d in descriptions
+        ])
+
+    # per request: build everything, then classify
+    start = time.perf_counter()
+    for n in range(requests):
+        graph = build_workflow(llm=llm, logger=logger, agent_actions=make_agent_actions(catalog, chapter_descs), chapters_list=headers)
+        await invoke(graph, f"INV-{n}")
+    per_request = (time.perf_counter() - start) / requests
+
+    # once: build at startup, classify per request
+    graph = build_workflow(llm=llm, logger=logger, agent_actions=make_agent_actions(catalog, chapter_descs), chapters_list=headers)
+    start = time.perf_counter()
+    for n in range(requests):
+        await invoke(graph, f"INV-{n}")
+    shared = (time.perf_counter() - start) / requests
+
+    start = time.perf_counter()
+    for _ in range(requests):
+        build_workflow(llm=llm, logger=logger, agent_actions=make_agent_actions(catalog, chapter_descs), chapters_list=headers)
+    build_only = (time.perf_counter() - start) / requests
+
+    print(f"{requests} requests x {items} items, fake LLM with no latency")
+    print(f"build per request   {per_request * 1e3:8.2f} ms/request")
+    print(f"build once          {shared * 1e3:8.2f} ms/request")
+    print(f"setup alone         {build_only * 1e3:8.2f} ms/request")
+
+
+if __name__ == '__main__':
+    asyncio.run(run(requests=20, items=5))
@@ -0,0 +1,51 @@
+"""
+Latency comparison of the default selector path (free-text answer, then a CodeExtractor call)
+against the single-call structured mode, using a fake LLM with fixed per-call latency.
+
+    python -m benchmarks.bench_structured_mode
+"""
+import asyncio
+import copy
+import time
+
+from agents.AgentActions import AgentActions
+from agents.HtsCatalog import HtsCatalog
+from agents.HttpSessions import HttpSessions
+from agents.Workflow import build_workflow
+from benchmarks.fake_llm import FakeChatModel
+from benchmarks.support import offline_logger
+from benchmarks.synthetic_hts import make_chapter_descs, make_descriptions, make_headers, make_htsdata
+
+LLM_LATENCY = 0.05
+ITEMS = 20
+
+
+async def main():
+    logger = offline_logger()
+    catalog = HtsCatalog.from_hts_data(copy.deepcopy(make_htsdata(headings_per_chapter=8)))
+    chapter_descs = make_chapter_descs()
+    agent_actions = AgentActions(logger=logger, chapter_descs=chapter_descs, catalog=catalog, tariffy_org_id=None, tariffy_api_key=None,
+                                 simpleduty_api_key=None, http_sessions=HttpSessions())
+    descriptions = make_descriptions(ITEMS)
+
+    print(f"{ITEMS} items, {LLM_LATENCY * 1e3:.0f} ms per LLM call")
+    for structured in (False, True):
+        llm = FakeChatModel(latency=LLM_LATENCY)
+        graph = build_workflow(llm=llm, logger=logger, agent_actions=agent_actions, chapters_list=make_headers(chapter_descs), structured_output=structured)
+
+        latencies = []
+
+        async def classify(description):
+            start = time.perf_counter()
+            result = await graph.ainvoke({"product_description": description, "invoice_number": "bench"})
+            latencies.append(time.perf_counter() - start)
+            return result
+
+        results = await asyncio.gather(*[classify(d) for d in descriptions])
+        assert all(r["final_codes"]["most_likely_code"] for r in results)
+        mode = "structured" if structured else "extractor "
+        print(f"{mode}  {llm.calls / ITEMS:.1f} LLM calls/item   mean item latency {sum(latencies) / ITEMS * 1e3:7.1f} ms")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
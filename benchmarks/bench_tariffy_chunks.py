@@ -0,0 +1,49 @@
+"""
+Tariffy lookups for a large invoice sent as one request versus in parallel chunks with a
+per-chunk timeout and retry, against a stub that fails some requests and rejects very large
+ones. Reports how many items got a code and the wall time.
+
+    python -m benchmarks.bench_tariffy_chunks
+"""
+import asyncio
+import time
+
+from agents.AgentActions import AgentActions
+from agents.HtsCatalog import HtsCatalog
+from agents.HttpSessions import HttpSessions
+from benchmarks.stub_servers import StubUpstreams
+from benchmarks.support import offline_logger
+
+LINES = 10000
+FAIL_RATE = 0.1
+MAX_BATCH = 5000
+
+CONFIGS = [
+    ('single request', {}),
+    ('chunks of 100', {'chunk_size': 100, 'max_concurrency': 8}),
+    ('chunks of 100, 2 retries', {'chunk_size': 100, 'max_concurrency': 8, 'timeout': 10, 'retries': 2}),
+]
+
+
+async def main():
+    logger = offline_logger()
+    descriptions = [f"cotton shirt {i}" for i in range(LINES)]
+    print(f"{LINES} descriptions, {FAIL_RATE:.0%} of Tariffy requests fail, more than {MAX_BATCH} per request rejected")
+    async with StubUpstreams(latency=0.05, tariffy_item_latency=0.0001, tariffy_fail_rate=FAIL_RATE, tariffy_max_batch=MAX_BATCH) as stubs:
+        http_sessions = HttpSessions(limit_per_host=20)
+        await http_sessions.start('tariffy')
+        agent_actions = AgentActions(logger=logger, chapter_descs={}, catalog=HtsCatalog([], []), tariffy_org_id='bench', tariffy_api_key='bench',
+                                     simpleduty_api_key='bench', http_sessions=http_sessions, tariffy_url=stubs.tariffy_url)
+        for name, options in CONFIGS:
+            stubs.requests['tariffy'] = 0
+            start = time.perf_counter()
+            results = await agent_actions.get_tariffy_codes(descriptions, **options)
+            elapsed = time.perf_counter() - start
+            assert [r['description'] for r in results] == descriptions
+            coded = sum(r['tariffy_hts_code'] != 'unable to retrieve code' for r in results)
+            print(f"{name:26s} coded {coded / LINES:6.1%}   requests {stubs.requests['tariffy']:4d}   wall {elapsed * 1e3:6.0f} ms")
+        await http_sessions.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
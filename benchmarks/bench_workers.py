@@ -0,0 +1,130 @@
+"""
+Resident memory per worker of the pre-fork server (serve.py), with the HTS catalog shared
+through the memory-mapped snapshot versus wrangled from the raw JSON in every worker.
+
+Starts `python serve.py` on a synthetic full-size catalog, waits until the workers are up and
+their memory has settled, then reads /proc/<pid>/smaps_rollup for each worker. RSS counts
+shared pages in full for every process; PSS splits them between the processes sharing them,
+and the private bytes are what each extra worker really adds. Linux only.
+
+    python -m benchmarks.bench_workers
+    python -m benchmarks.bench_workers --workers 8
+"""
+import argparse
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from pathlib import Path
+
+from benchmarks.synthetic_hts import make_htsdata
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+FIELDS = ('Rss', 'Pss', 'Shared_Clean', 'Shared_Dirty', 'Private_Clean', 'Private_Dirty')
+
+
+def memory(pid: int) -> dict:
+    """
+    Memory counters of a process in MiB.
+    """
+    values = {}
+    with open(f'/proc/{pid}/smaps_rollup', 'r', encoding='utf-8') as file:
+        for line in file:
+            name, _, rest = line.partition(':')
+            if name in FIELDS:
+                values[name] = int(rest.split()[0]) / 1024
+    return values
+
+
+def children(pid: int) -> list:
+    with open(f'/proc/{pid}/task/{pid}/children', 'r', encoding='utf-8') as file:
+        return [int(child) for child in file.read().split()]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def request(port: int, path: str):
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}{path}", timeout=5) as response:
+        return response.read()
+
+
+def wait_until_settled(process, port: int, workers: int, timeout: float = 300) -> list:
+    """
+    Wait for every worker to be forked and answering, and for their RSS to stop growing.
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"serve.py exited with {process.returncode}")
+        pids = children(process.pid)
+        try:
+            if len(pids) == workers:
+                request(port, "/health")
+                before = [memory(pid)['Rss'] for pid in pids]
+                time.sleep(1.0)
+                after = [memory(pid)['Rss'] for pid in pids]
+                if all(abs(a - b) < 1 for a, b in zip(after, before)):
+                    return pids
+        except OSError:
+            pass
+        time.sleep(0.5)
+    raise TimeoutError("Workers did not settle")
+
+
+def run(mode: str, args, workdir: str, hts_path: str) -> dict:
+    port = free_port()
+    env = dict(os.environ)
+    env.update({
+        "PORT": str(port), "HOST": "127.0.0.1", "SERVER_WORKERS": str(args.workers),
+        "HTS_DATA_PATH": hts_path,
+        "HTS_SNAPSHOT_PATH": os.path.join(workdir, 'htsdata.snapshot') if mode == 'snapshot' else '',
+        "TARIFFY_ORG_ID": "bench", "TARIFFY_API_KEY": "bench", "SIMPLEDUTY_API_KEY": "bench", "GOOGLE_API_KEY": "bench",
+        "EMAIL_TRANSPORT": "smtp", "LOGFIRE_SEND_TO_LOGFIRE": "false", "LOGFIRE_CONSOLE": "false",
+    })
+    process = subprocess.Popen([sys.executable, "serve.py"], cwd=REPO_ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        pids = wait_until_settled(process, port, args.workers)
+        workers = [memory(pid) for pid in pids]
+        parent = memory(process.pid)
+    finally:
+        process.send_signal(signal.SIGTERM)
+        process.wait(timeout=60)
+    return {"mode": mode, "parent": parent, "workers": workers}
+
+
+def report(result: dict):
+    workers = result["workers"]
+    mean = {field: sum(w[field] for w in workers) / len(workers) for field in FIELDS}
+    private = mean['Private_Clean'] + mean['Private_Dirty']
+    total_pss = sum(w['Pss'] for w in workers) + result['parent']['Pss']
+    print(f"{result['mode']:>8}: {len(workers)} workers   RSS/worker {mean['Rss']:6.1f} MiB   PSS/worker {mean['Pss']:6.1f} MiB"
+          f"   private/worker {private:6.1f} MiB   parent RSS {result['parent']['Rss']:6.1f} MiB   total PSS {total_pss:7.1f} MiB")
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as workdir:
+        hts_path = os.path.join(workdir, 'htsdata.json')
+        with open(hts_path, 'w', encoding='utf-8') as file:
+            json.dump(make_htsdata(), file)
+        for mode in args.modes:
+            report(run(mode, args, workdir, hts_path))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--workers", type=int, default=4, help="Worker processes")
+    parser.add_argument("--modes", nargs="+", default=["snapshot", "raw"], choices=["snapshot", "raw"])
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    main(parse_args())
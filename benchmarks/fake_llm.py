@@ -0,0 +1,106 @@
+"""
+Deterministic stand-in for the Gemini chat model, for benchmarks that must not spend quota.
+
+The fake reads the candidate codes out of the prompt it is given and answers in the same
+shape as the real model: free text naming its picks for the selector prompts, and JSON
+matching `response_schema` when a `generation_config` is passed.
+"""
+import asyncio
+import json
+import random
+import re
+import time
+import zlib
+from typing import Any, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+FULL_CODE = re.compile(r'\b\d{4}\.\d{2}\.\d{2}\.\d{2}\b')
+HEADING_OPTION = re.compile(r'"htsno": "(\d{4})"')
+HEADING_PICK = re.compile(r'Heading (\d{4})')
+CHAPTER = re.compile(r'Chapter (\d{1,2})\b')
+
+
+class FakeChatModel(BaseChatModel):
+    latency: float = 0.0
+    """Seconds to sleep per call."""
+    output_tokens: int = 60
+    """Approximate length of free-text answers, in tokens."""
+    calls: int = 0
+    prompt_chars: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-gemini"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        if self.latency:
+            time.sleep(self.latency)
+        return self._respond(messages, kwargs.get("generation_config"))
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._respond(messages, kwargs.get("generation_config"))
+
+    def _respond(self, messages, generation_config: Optional[dict]) -> ChatResult:
+        text = "\n".join(str(m.content) for m in messages)
+        self.calls += 1
+        self.prompt_chars += len(text)
+        rng = random.Random(zlib.crc32(text.encode("utf-8")))
+
+        schema = (generation_config or {}).get("response_schema")
+        if schema:
+            content = json.dumps(self._structured(text, schema, rng))
+        else:
+            content = self._free_text(text, rng)
+
+        message = AIMessage(
+            content=content,
+            usage_metadata={
+                "input_tokens": len(text) // 4,
+                "output_tokens": len(content) // 4,
+                "total_tokens": (len(text) + len(content)) // 4,
+            },
+        )
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _pick(self, candidates: list, k: int, rng) -> list:
+        unique = list(dict.fromkeys(candidates))
+        return rng.sample(unique, min(k, len(unique))) if unique else []
+
+    def _free_text(self, text: str, rng) -> str:
+        if "select the full code" in text:
+            picks = self._pick(FULL_CODE.findall(text), 6, rng)
+            answer = "The most likely codes are " + ", ".join(picks)
+            codes = picks
+        elif "relevant codes within these chapters" in text:
+            picks = self._pick(HEADING_OPTION.findall(text), 4, rng)
+            answer = "The most likely headings are " + ", ".join(f"Heading {p}" for p in picks)
+            codes = picks
+        else:
+            picks = self._pick(CHAPTER.findall(text), 3, rng)
+            answer = "The most likely chapters are " + ", ".join(f"Chapter {int(p):02d}" for p in picks)
+            codes = [f"{int(p):02d}" for p in picks]
+        filler = " reasoning" * max(self.output_tokens - len(answer) // 4, 0)
+        # follow the regex extraction instruction when the prompt carries it
+        selected = "\nSelected: " + ", ".join(codes) if "\nSelected: " in text else ""
+        return answer + "." + filler + selected
+
+    def _structured(self, text: str, schema: dict, rng) -> dict:
+        result = {}
+        full_codes = FULL_CODE.findall(text)
+        for name, spec in schema.get("properties", {}).items():
+            if name == "chapters_list":
+                result[name] = [f"{int(c):02d}" for c in dict.fromkeys(CHAPTER.findall(text))][:3]
+            elif name == "code_list":
+                picks = full_codes or HEADING_PICK.findall(text) or HEADING_OPTION.findall(text)
+                result[name] = list(dict.fromkeys(picks))[:6]
+            elif spec.get("type") == "STRING" and "code" in name:
+                picks = self._pick(full_codes, 2, rng) or [""]
+                result[name] = picks[0] if name == "most_likely_code" else picks[-1]
+            else:
+                result[name] = "fake " + name
+        return result
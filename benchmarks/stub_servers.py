@@ -0,0 +1,145 @@
+"""
+Local aiohttp stand-ins for the Tariffy and SimplyDuty endpoints.
+
+    async with StubUpstreams(latency=0.05) as stubs:
+        stubs.tariffy_url, stubs.simplyduty_url
+
+`tariffy_item_latency` adds that many seconds per description to each Tariffy response, so
+large batches are slower than small ones as with the real service. `tariffy_fail_rate`
+answers that share of Tariffy requests with a 500, and requests with more than
+`tariffy_max_batch` descriptions get a 413. `StubSmtp` is an SMTP sink for the email transports.
+"""
+import asyncio
+import json
+import random
+import socketserver
+import threading
+import time
+import zlib
+
+from aiohttp import web
+
+
+class StubUpstreams:
+    def __init__(self, latency: float = 0.0, codes: list = None, host: str = '127.0.0.1', tariffy_item_latency: float = 0.0,
+                 tariffy_fail_rate: float = 0.0, tariffy_max_batch: int = None, seed: int = 0):
+        self.latency = latency
+        self.tariffy_item_latency = tariffy_item_latency
+        self.tariffy_fail_rate = tariffy_fail_rate
+        self.tariffy_max_batch = tariffy_max_batch
+        self._rng = random.Random(seed)
+        self.codes = codes or ['6109.10.00.12']
+        self.host = host
+        self.requests = {'tariffy': 0, 'simplyduty': 0}
+        self.connections = {'tariffy': set(), 'simplyduty': set()}
+        self._runner = None
+        self.base_url = None
+
+    @property
+    def tariffy_url(self) -> str:
+        return f"{self.base_url}/v1/lookup-codes"
+
+    @property
+    def simplyduty_url(self) -> str:
+        return f"{self.base_url}/api/duty/getduty"
+
+    def _record(self, name: str, request: web.Request):
+        self.requests[name] += 1
+        self.connections[name].add(id(request.transport))
+
+    def _code_for(self, description: str) -> str:
+        return self.codes[zlib.crc32(description.encode('utf-8')) % len(self.codes)]
+
+    async def _tariffy(self, request: web.Request):
+        self._record('tariffy', request)
+        body = await request.json()
+        if self.tariffy_max_batch is not None and len(body['descriptions']) > self.tariffy_max_batch:
+            return web.json_response({'error': 'too many descriptions'}, status=413)
+        await asyncio.sleep(self.latency + self.tariffy_item_latency * len(body['descriptions']))
+        if self._rng.random() < self.tariffy_fail_rate:
+            return web.json_response({'error': 'internal error'}, status=500)
+        return web.json_response([
+            {'description': d, 'hs_code_usa': self._code_for(d)} for d in body['descriptions']
+        ])
+
+    async def _simplyduty(self, request: web.Request):
+        self._record('simplyduty', request)
+        body = json.loads(await request.text())
+        await asyncio.sleep(self.latency)
+        rate = random.Random(body['HSCode']).choice([0.0, 2.5, 6.5, 12.0])
+        return web.json_response({'duty': {'DutyRate': rate}})
+
+    async def __aenter__(self):
+        app = web.Application()
+        app.router.add_post('/v1/lookup-codes', self._tariffy)
+        app.router.add_post('/api/duty/getduty', self._simplyduty)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, 0)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        self.base_url = f"http://{self.host}:{port}"
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._runner.cleanup()
+
+
+class StubSmtp:
+    """
+    Minimal SMTP sink on a background thread, accepting every message after `delay` seconds.
+    Runs outside the event loop so blocking and async clients can both be measured against it.
+
+        with StubSmtp(delay=0.3) as smtp:
+            smtp.port, smtp.messages
+    """
+
+    def __init__(self, delay: float = 0.0, host: str = '127.0.0.1'):
+        self.delay = delay
+        self.host = host
+        self.messages = []
+        self.connections = 0
+        self._server = None
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    def __enter__(self):
+        stub = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                stub.connections += 1
+                self.wfile.write(b'220 stub ESMTP\r\n')
+                while True:
+                    line = self.rfile.readline()
+                    if not line:
+                        return
+                    command = line.strip().upper()
+                    if command.startswith(b'EHLO') or command.startswith(b'HELO'):
+                        self.wfile.write(b'250 stub\r\n')
+                    elif command == b'DATA':
+                        self.wfile.write(b'354 end with .\r\n')
+                        data = []
+                        for data_line in iter(self.rfile.readline, b''):
+                            if data_line == b'.\r\n':
+                                break
+                            data.append(data_line)
+                        time.sleep(stub.delay)
+                        stub.messages.append(b''.join(data))
+                        self.wfile.write(b'250 queued\r\n')
+                    elif command == b'QUIT':
+                        self.wfile.write(b'221 bye\r\n')
+                        return
+                    else:
+                        self.wfile.write(b'250 ok\r\n')
+
+        self._server = socketserver.ThreadingTCPServer((self.host, 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
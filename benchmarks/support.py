@@ -0,0 +1,12 @@
+"""
+Shared setup for the benchmark scripts.
+"""
+import logfire
+
+
+def offline_logger(tag: str = 'benchmark'):
+    """
+    A real Logfire logger that neither exports nor prints, so agents log exactly as in production.
+    """
+    logfire.configure(send_to_logfire=False, console=False)
+    return logfire.with_tags(tag)
@@ -0,0 +1,58 @@
+"""
+Synthetic HTS data shaped like the usitc `htsdata.json` export, for benchmarks that
+must run without the real schedule on disk.
+"""
+import random
+
+WORDS = ['cotton', 'wool', 'steel', 'plastic', 'glass', 'leather', 'rubber', 'wood', 'paper', 'copper',
+         'knitted', 'woven', 'frozen', 'fresh', 'dried', 'electric', 'manual', 'printed', 'coated', 'alloy',
+         'shirts', 'trousers', 'screws', 'bolts', 'bottles', 'tables', 'chairs', 'lamps', 'motors', 'toys']
+
+RATES = ['Free', '2.5%', '6.5%', '12%', '2.4¢/kg', '2.4¢/kg + 5%', '32%']
+
+
+def _words(rng, n):
+    return ' '.join(rng.choice(WORDS) for _ in range(n))
+
+
+def make_htsdata(headings_per_chapter: int = 40, subheadings: int = 4, lines: int = 3, seed: int = 7) -> list[dict]:
+    """
+    Build a raw HTS list with section headers, 4-digit headings, 8-digit subheadings and
+    10-digit statistical lines. The defaults give roughly the size of the real schedule.
+    """
+    rng = random.Random(seed)
+    data = []
+    for chapter in range(1, 98):
+        if chapter == 77:
+            continue
+        for h in range(1, headings_per_chapter + 1):
+            heading = f"{chapter:02d}{h:02d}"
+            data.append({'htsno': heading, 'indent': '0', 'description': _words(rng, 6), 'general': ''})
+            data.append({'htsno': '', 'indent': '1', 'description': _words(rng, 3), 'general': ''})
+            for s in range(1, subheadings + 1):
+                sub = f"{heading}.{s:02d}.00"
+                data.append({'htsno': sub, 'indent': '2', 'description': _words(rng, 4), 'general': rng.choice(RATES)})
+                for line in range(1, lines + 1):
+                    data.append({'htsno': f"{sub}.{line * 10:02d}", 'indent': '3', 'description': _words(rng, 3), 'general': ''})
+    return data
+
+
+def make_chapter_descs() -> dict:
+    rng = random.Random(11)
+    return {f"{c:02d}": _words(rng, 5) for c in range(1, 98) if c != 77}
+
+
+def make_descriptions(n: int, seed: int = 3) -> list[str]:
+    rng = random.Random(seed)
+    return [_words(rng, rng.randint(3, 7)) for _ in range(n)]
+
+
+def make_headers(chapter_descs: dict) -> list[str]:
+    """
+    Chapter header lines in the layout of `files/chapter_headers_final.txt`.
+    """
+    lines = []
+    for chapter, description in chapter_descs.items():
+        lines.append(f"- ### [Chapter {int(chapter)}]\n")
+        lines.append(f"{description}\n")
+    return lines
@@ -0,0 +1,67 @@
+"""
+Bulk classification of a CSV or JSONL file of items, outside the API server.
+
+    python bulk.py items.csv results.jsonl
+    python bulk.py items.jsonl results.jsonl --chunk-size 1000 --concurrency 16
+
+Items have the same fields as a request's `Items` (`Description`, `Country of Origin`, ...);
+CSV files need a header row. Every finished row is appended to the JSONL output with its input
+`row` number. The output is also the checkpoint: running the same command again after a crash
+or Ctrl-C skips the rows already in it and only classifies the rest. Failed rows are left out
+and retried by the next run. Progress with throughput and ETA is printed to stderr.
+
+Settings are read from the environment like the API server's; no results emails are sent.
+"""
+import argparse
+import asyncio
+import os
+import sys
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("input", help="CSV or JSONL file of items")
+    parser.add_argument("output", help="JSONL results file, resumed if it exists")
+    parser.add_argument("--format", choices=["csv", "jsonl"], help="Input format; taken from the extension by default")
+    parser.add_argument("--name", help="Run name for logs and LLM fair queuing; defaults to the input file name")
+    parser.add_argument("--chunk-size", type=int, help="Rows in flight at once and between checkpoints (BULK_CHUNK_SIZE)")
+    parser.add_argument("--batch-size", type=int, help="Rows per pipeline run (BULK_BATCH_SIZE)")
+    parser.add_argument("--concurrency", type=int, help="Items classified at once (BULK_CLASSIFY_CONCURRENCY)")
+    parser.add_argument("--progress-interval", type=float, help="Seconds between progress reports (BULK_PROGRESS_INTERVAL)")
+    return parser.parse_args(argv)
+
+
+async def run(args, deploy) -> dict:
+    await deploy.http_sessions.start('tariffy', 'simplyduty')
+    try:
+        return await deploy.bulk_runner.run(
+            args.name or f"bulk-{os.path.splitext(os.path.basename(args.input))[0]}", args.input, args.output, fmt=args.format,
+            on_progress=lambda progress: print(progress.describe(), file=sys.stderr, flush=True),
+        )
+    finally:
+        await deploy.http_sessions.close()
+        deploy.duty_cache.close()
+        deploy.classification_store.close()
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # the API module reads these when it is imported
+    for variable, value in (("BULK_CHUNK_SIZE", args.chunk_size), ("BULK_BATCH_SIZE", args.batch_size),
+                            ("BULK_CLASSIFY_CONCURRENCY", args.concurrency),
+                            ("BULK_PROGRESS_INTERVAL", args.progress_interval)):
+        if value is not None:
+            os.environ[variable] = str(value)
+    import classification_and_duties_deploy as deploy
+
+    try:
+        summary = asyncio.run(run(args, deploy))
+    except KeyboardInterrupt:
+        print(f"Interrupted; run the same command again to resume from {args.output}", file=sys.stderr)
+        return 130
+    print(f"Done: {summary['rows_done']}/{summary['rows_total']} rows in {args.output}, {summary['rows_failed']} failed", file=sys.stderr)
+    return 1 if summary['rows_failed'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,30 +2,39 @@ from dotenv import load_dotenv
 import json
 import re
 import os
-import pandas as pd 
 
 from langchain.chat_models import init_chat_model
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import BaseTransformOutputParser, StrOutputParser
-from langgraph.graph import START, END, StateGraph 
-from langgraph.graph.message import add_messages
-from typing import Annotated
-from typing_extensions import TypedDict
-from operator import add
 from pydantic import BaseModel, Field, ValidationError
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
 import uvicorn
 import asyncio
+import time
+import uuid
+from contextlib import aclosing, asynccontextmanager
 
 from agents.AgentActions import AgentActions
-from agents.ChapterSelector import ChapterSelector
-from agents.CodeExtractor import CodeExtractor
-from agents.LevelOneSelector import LevelOneSelector
-from agents.DeepSelector import DeepSelector
-from agents.FinalSelector import FinalSelector
+from agents.CatalogSnapshot import load_catalog
+from agents.HttpSessions import HttpSessions
+from agents.DutyRateCache import DutyRateCache
+from agents.DutyEngine import DutyEngine
+from agents.ClassificationStore import ClassificationStore, normalize_description
+from agents.JobQueue import InMemoryJobStore, JobQueue
+from agents.ItemPipeline import ItemPipeline
+from agents.BulkRun import INPUT_FORMATS as BULK_FORMATS, BulkRunner
+from agents.ItemRecord import PositionalJoin, output_columns
+from agents.ResultArtifact import FORMATS as RESULT_FORMATS, ResultArtifact
+from agents.EmailDelivery import ComposioTransport, EmailDelivery, GmailApiTransport, OutgoingEmail, SmtpTransport
+from agents.LLMScheduler import LLMScheduler
+from agents.Metrics import Metrics
+from agents.SingleFlight import SingleFlight
+from agents.NearDuplicates import NearDuplicateClusterer
+from agents.CandidateRanker import CandidateRanker
+from agents.Workflow import PathStats, build_workflow
 # from agents.Gmail import create_message_with_attachment, send_message
 
-from composio import ComposioToolSet, Action
 # from firecrawl import FirecrawlApp
 
 import logfire
@@ -40,9 +49,75 @@ try:
     TARIFFY_ORG_ID = os.getenv("TARIFFY_ORG_ID")
     TARIFFY_API_KEY = os.getenv("TARIFFY_API_KEY")
     SIMPLEDUTY_API_KEY = os.getenv("SIMPLEDUTY_API_KEY")
-    # GMAIL_TOKEN = os.getenv("GMAIL_TOKEN")
+    GMAIL_TOKEN = os.getenv("GMAIL_TOKEN")
     COMPOSIO_API_KEY = os.getenv("COMPOSIO_API_KEY")
     COMPOSIO_ENTITY_ID = 'default'
+    HTS_DATA_PATH = os.getenv("HTS_DATA_PATH", "files/htsdata.json")
+    HTS_SNAPSHOT_PATH = os.getenv("HTS_SNAPSHOT_PATH", "files/htsdata.snapshot")
+    TARIFFY_URL = os.getenv("TARIFFY_URL", "https://api.tariffy.net/v1/lookup-codes")
+    SIMPLEDUTY_URL = os.getenv("SIMPLEDUTY_URL", "https://www.api.simplyduty.com/api/duty/getduty")
+    HTTP_LIMIT_PER_HOST = int(os.getenv("HTTP_LIMIT_PER_HOST", 20))
+    HTTP_KEEPALIVE_TIMEOUT = float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", 30))
+    HTTP_DNS_CACHE_TTL = int(os.getenv("HTTP_DNS_CACHE_TTL", 300))
+    HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", 30))
+    HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", 10))
+    DUTY_CACHE_SIZE = int(os.getenv("DUTY_CACHE_SIZE", 10000))
+    DUTY_CACHE_TTL = float(os.getenv("DUTY_CACHE_TTL", 86400))
+    DUTY_CACHE_NEGATIVE_TTL = float(os.getenv("DUTY_CACHE_NEGATIVE_TTL", 900))
+    DUTY_CACHE_PATH = os.getenv("DUTY_CACHE_PATH")  # SQLite file; unset keeps the cache in memory only
+    CLASSIFICATION_STORE_PATH = os.getenv("CLASSIFICATION_STORE_PATH", ":memory:")
+    CLASSIFICATION_STORE_SIZE = int(os.getenv("CLASSIFICATION_STORE_SIZE", 100000))
+    STRUCTURED_SELECTORS = os.getenv("STRUCTURED_SELECTORS", "false").lower() == "true"
+    RANKER_TOP_CHAPTERS = int(os.getenv("RANKER_TOP_CHAPTERS", 0))  # 0 disables pre-ranking at that level
+    RANKER_TOP_HEADINGS = int(os.getenv("RANKER_TOP_HEADINGS", 0))
+    RANKER_TOP_LINES = int(os.getenv("RANKER_TOP_LINES", 0))
+    RANKER_SKIP_CHAPTER_MARGIN = float(os.getenv("RANKER_SKIP_CHAPTER_MARGIN")) if os.getenv("RANKER_SKIP_CHAPTER_MARGIN") else None
+    LLM_MAX_IN_FLIGHT = int(os.getenv("LLM_MAX_IN_FLIGHT", 32))
+    LLM_DEFAULT_RPM = float(os.getenv("LLM_DEFAULT_RPM", 1000))
+    LLM_DEFAULT_TPM = float(os.getenv("LLM_DEFAULT_TPM", 1000000))
+    LLM_RATE_LIMITS = json.loads(os.getenv("LLM_RATE_LIMITS", "{}"))  # e.g. {"gemini-2.0-flash": {"rpm": 2000, "tpm": 4000000}}
+    PIPELINE_CLASSIFY_CONCURRENCY = int(os.getenv("PIPELINE_CLASSIFY_CONCURRENCY", 32))
+    TARIFFY_BATCH_SIZE = int(os.getenv("TARIFFY_BATCH_SIZE", 25))
+    TARIFFY_CONCURRENCY = int(os.getenv("TARIFFY_CONCURRENCY", 4))
+    TARIFFY_TIMEOUT = float(os.getenv("TARIFFY_TIMEOUT", 30))
+    TARIFFY_RETRIES = int(os.getenv("TARIFFY_RETRIES", 2))
+    DUTY_LOOKUP_CONCURRENCY = int(os.getenv("DUTY_LOOKUP_CONCURRENCY", 16))
+    DUTY_PREFETCH_CODES = int(os.getenv("DUTY_PREFETCH_CODES", 0))  # 0 disables prefetching
+    DUTY_PREFETCH_MAX_PENDING = int(os.getenv("DUTY_PREFETCH_MAX_PENDING", 1000))
+    LOCAL_DUTY_RATES = os.getenv("LOCAL_DUTY_RATES", "false").lower() == "true"
+    DUTY_RULES_PATH = os.getenv("DUTY_RULES_PATH")  # JSON rule list; unset uses agents.DutyEngine.DEFAULT_RULES
+    SKIP_DEEP_MAX_CANDIDATES = int(os.getenv("SKIP_DEEP_MAX_CANDIDATES", 0))  # 0 always runs the deep selector
+    REGEX_EXTRACTION = os.getenv("REGEX_EXTRACTION", "false").lower() == "true"
+    COALESCE_REQUESTS = os.getenv("COALESCE_REQUESTS", "false").lower() == "true"
+    NEAR_DUPLICATE_THRESHOLD = float(os.getenv("NEAR_DUPLICATE_THRESHOLD")) if os.getenv("NEAR_DUPLICATE_THRESHOLD") else None  # unset classifies every description
+    EMAIL_TRANSPORT = os.getenv("EMAIL_TRANSPORT", "composio")  # composio, gmail or smtp
+    SMTP_HOST = os.getenv("SMTP_HOST", "localhost")
+    SMTP_PORT = int(os.getenv("SMTP_PORT", 25))
+    SMTP_SENDER = os.getenv("SMTP_SENDER", "classification@localhost")
+    SMTP_USERNAME = os.getenv("SMTP_USERNAME")
+    SMTP_PASSWORD = os.getenv("SMTP_PASSWORD")
+    SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "false").lower() == "true"
+    EMAIL_WORKERS = int(os.getenv("EMAIL_WORKERS", 2))
+    EMAIL_QUEUE_SIZE = int(os.getenv("EMAIL_QUEUE_SIZE", 1000))
+    EMAIL_BATCH_SIZE = int(os.getenv("EMAIL_BATCH_SIZE", 10))
+    EMAIL_ENQUEUE_TIMEOUT = float(os.getenv("EMAIL_ENQUEUE_TIMEOUT", 5))
+    EMAIL_MAX_ATTEMPTS = int(os.getenv("EMAIL_MAX_ATTEMPTS", 5))
+    EMAIL_BACKOFF_BASE = float(os.getenv("EMAIL_BACKOFF_BASE", 2))
+    RESULT_FORMAT = os.getenv("RESULT_FORMAT", "csv")  # csv, csv.gz or xlsx
+    if RESULT_FORMAT not in RESULT_FORMATS:
+        raise ValueError(f"Unknown RESULT_FORMAT: {RESULT_FORMAT}")
+    RESULT_SPOOL_MAX_MEMORY = int(os.getenv("RESULT_SPOOL_MAX_MEMORY", 5 * 1024 * 1024))
+    SERVER_WORKERS = int(os.getenv("SERVER_WORKERS", 1))  # worker processes started by serve.py; LLM limits are split between them
+    JOB_WORKERS = int(os.getenv("JOB_WORKERS", 2))
+    JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", 100))
+    JOB_HISTORY_SIZE = int(os.getenv("JOB_HISTORY_SIZE", 1000))
+    BULK_DIR = os.getenv("BULK_DIR")  # where uploaded bulk files and their results are kept; unset disables POST /bulk
+    BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", 500))
+    BULK_BATCH_SIZE = int(os.getenv("BULK_BATCH_SIZE", 100))
+    BULK_CLASSIFY_CONCURRENCY = int(os.getenv("BULK_CLASSIFY_CONCURRENCY", PIPELINE_CLASSIFY_CONCURRENCY))
+    BULK_MAX_RUNNING = int(os.getenv("BULK_MAX_RUNNING", 1))
+    BULK_MAX_UPLOAD_BYTES = int(os.getenv("BULK_MAX_UPLOAD_BYTES", 1024 ** 3))
+    BULK_PROGRESS_INTERVAL = float(os.getenv("BULK_PROGRESS_INTERVAL", 10))
 except Exception as e:
     raise ValueError("Environment variables not set correctly") from e
 
@@ -50,17 +125,10 @@ except Exception as e:
 logfire.configure(token=LOGFIRE_TOKEN, scrubbing=False)
 logger = logfire.with_tags('tariff_classification')
 
-try:
-    toolset = ComposioToolSet(entity_id=COMPOSIO_ENTITY_ID, api_key=COMPOSIO_API_KEY)
-except Exception as e:
-    logger.exception(f"Failed to initialize ComposioToolSet: {e}")
-    raise
 
-# Load HTS data
+# Load HTS data (from the prebuilt snapshot when there is one, see agents/CatalogSnapshot.py)
 try:
-    with open('files/htsdata.json', 'r', encoding='utf-8') as file:
-        htsdata = json.load(file) 
-        four_digit_codes, final_full_codes = AgentActions.wrangle_hts_data(htsdata)
+    hts_catalog = load_catalog(HTS_DATA_PATH, HTS_SNAPSHOT_PATH, logger)
 except Exception as e:
     logger.exception(f"Failed to load HTS data: {e}")
     raise
@@ -78,6 +146,16 @@ except Exception as e:
     logger.exception(f"Failed to load chapter headers: {e}")
     raise
 
+# Stored classifications from earlier requests, only valid for the current catalog
+try:
+    classification_store = ClassificationStore(catalog_version=hts_catalog.version, db_path=CLASSIFICATION_STORE_PATH, max_entries=CLASSIFICATION_STORE_SIZE)
+    removed = classification_store.invalidate()
+    if removed:
+        logger.info(f"Removed {removed} stored classifications from previous HTS catalog versions")
+except Exception as e:
+    logger.exception(f"Failed to open classification store: {e}")
+    raise
+
 # Initialize LLM
 try:
     llm = init_chat_model(
@@ -92,64 +170,107 @@ except Exception as e:
     logger.exception(f"Failed to initialize LLM: {e}")
     raise
 
-    # Initialize agents
-def initialize_agents(tag: str):
-    logger = logfire.with_tags(tag)
+# Lexical pre-ranker to shorten the candidate lists in the prompts, only built when enabled
+candidate_ranker = None
+if RANKER_TOP_CHAPTERS or RANKER_TOP_HEADINGS or RANKER_TOP_LINES or RANKER_SKIP_CHAPTER_MARGIN is not None:
     try:
-        agent_actions = AgentActions(logger=logger, chapter_descs=chapter_descs, four_digit_codes=four_digit_codes, final_full_codes=final_full_codes, tariffy_org_id=TARIFFY_ORG_ID, tariffy_api_key=TARIFFY_API_KEY, simpleduty_api_key=SIMPLEDUTY_API_KEY)
+        candidate_ranker = CandidateRanker(catalog=hts_catalog, chapter_descs=chapter_descs)
+    except Exception as e:
+        logger.exception(f"Failed to build candidate ranker: {e}")
+        raise
 
-        code_extractor = CodeExtractor(llm=llm, logger=logger)
+# Prometheus metrics for graph nodes, LLM calls, external HTTP calls and email sends, served on /metrics
+metrics = Metrics()
+graph_runs_in_flight = metrics.gauge("graph_runs_in_flight", "Descriptions currently being classified by the graph.")
 
-        chapter_selector = ChapterSelector(llm=llm, logger=logger, chapters_list=headers, code_extractor=code_extractor)
+# Rate limits and fair queuing for every LLM call in the process; with several worker processes each gets an equal share of the limits
+worker_share = 1 / max(SERVER_WORKERS, 1)
+llm_scheduler = LLMScheduler(limits={model: {key: value * worker_share for key, value in limit.items()} for model, limit in LLM_RATE_LIMITS.items()},
+                             default_rpm=LLM_DEFAULT_RPM * worker_share, default_tpm=LLM_DEFAULT_TPM * worker_share,
+                             max_in_flight=max(LLM_MAX_IN_FLIGHT // max(SERVER_WORKERS, 1), 1), logger=logger)
 
-        level_one_selector = LevelOneSelector(llm=llm, logger=logger, code_extractor=code_extractor, agent_actions=agent_actions)
+# Shared HTTP sessions for Tariffy and SimplyDuty, opened and closed with the app
+http_sessions = HttpSessions(limit_per_host=HTTP_LIMIT_PER_HOST, keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT, dns_cache_ttl=HTTP_DNS_CACHE_TTL,
+                             total_timeout=HTTP_TIMEOUT, connect_timeout=HTTP_CONNECT_TIMEOUT, metrics=metrics)
 
-        deep_selector = DeepSelector(llm=llm.with_config(config={"model":"gemini-2.0-flash-thinking-exp-01-21"}), logger=logger, code_extractor=code_extractor, agent_actions=agent_actions)
+# Result emails go out from background workers through the configured transport
+try:
+    if EMAIL_TRANSPORT == "composio":
+        from composio import ComposioToolSet, Action
+        toolset = ComposioToolSet(entity_id=COMPOSIO_ENTITY_ID, api_key=COMPOSIO_API_KEY)
+        email_transport = ComposioTransport(toolset=toolset, action=Action.GMAIL_SEND_EMAIL)
+    elif EMAIL_TRANSPORT == "gmail":
+        email_transport = GmailApiTransport(access_token=GMAIL_TOKEN, http_sessions=http_sessions)
+    elif EMAIL_TRANSPORT == "smtp":
+        email_transport = SmtpTransport(host=SMTP_HOST, port=SMTP_PORT, sender=SMTP_SENDER, username=SMTP_USERNAME, password=SMTP_PASSWORD, starttls=SMTP_STARTTLS)
+    else:
+        raise ValueError(f"Unknown EMAIL_TRANSPORT: {EMAIL_TRANSPORT}")
+except Exception as e:
+    logger.exception(f"Failed to initialize email transport: {e}")
+    raise
+email_delivery = EmailDelivery(transport=email_transport, logger=logger, workers=EMAIL_WORKERS, max_queued=EMAIL_QUEUE_SIZE, batch_size=EMAIL_BATCH_SIZE,
+                               max_attempts=EMAIL_MAX_ATTEMPTS, backoff_base=EMAIL_BACKOFF_BASE, history_size=JOB_HISTORY_SIZE,
+                               metrics=metrics)
 
-        final_selector = FinalSelector(llm=llm.with_config(config={"model":"gemini-2.5-flash-preview-04-17"}), logger=logger, agent_actions=agent_actions)
+# Duty rates by (code, origin, destination), optionally persisted to SQLite
+duty_cache = DutyRateCache(max_entries=DUTY_CACHE_SIZE, ttl=DUTY_CACHE_TTL, negative_ttl=DUTY_CACHE_NEGATIVE_TTL, db_path=DUTY_CACHE_PATH)
 
-    except Exception as e:
-        logger.exception(f"Failed to initialize agents: {e}")
-        raise
-
-    class State(TypedDict):
-        responses: Annotated[list, add_messages]
-        product_description: str
-        chapters_list: list
-        four_digit_code_list: list
-        full_code_list: list
-        final_codes: dict
+# Which path items take through the adaptive graph steps
+path_stats = PathStats()
 
-    # Build the graph
-    logger.debug("Building workflow graph...")
+# Column-1 duty rates from the catalog, with SimplyDuty only for origins and codes the rules send there
+duty_engine = None
+if LOCAL_DUTY_RATES:
     try:
-        graph_builder = StateGraph(State)
-
-        graph_builder.add_node("chapter_selector", chapter_selector.select_chapters)
-        graph_builder.add_edge(START, "chapter_selector")
-
-        graph_builder.add_node("select_four_digit_codes", level_one_selector.select_four_digit_codes)
-        graph_builder.add_edge("chapter_selector", "select_four_digit_codes")
-
-        graph_builder.add_node("select_full_codes", deep_selector.select_full_codes)
-        graph_builder.add_edge("select_four_digit_codes", "select_full_codes")
+        duty_engine = DutyEngine.from_file(catalog=hts_catalog, path=DUTY_RULES_PATH)
+    except Exception as e:
+        logger.exception(f"Failed to load duty rules: {e}")
+        raise
 
-        graph_builder.add_node("select_final_codes", final_selector.select_final_codes)
-        graph_builder.add_edge("select_full_codes", "select_final_codes")
+# Identical descriptions and duty lookups in flight at the same time share one graph run or SimplyDuty call
+classification_flights = SingleFlight() if COALESCE_REQUESTS else None
+duty_flights = SingleFlight() if COALESCE_REQUESTS else None
 
-        graph_builder.add_edge("select_final_codes", END)
+# Near-duplicate descriptions in an invoice reuse the classification of the first one in their group
+near_duplicates = NearDuplicateClusterer(threshold=NEAR_DUPLICATE_THRESHOLD) if NEAR_DUPLICATE_THRESHOLD is not None else None
 
-        graph = graph_builder.compile()
-        # Configure the graph for async execution
-        graph_async = graph.with_config({"executor": "async"})
+# Initialize agents and compile the workflow once, shared by every request
+def initialize_agents():
+    try:
+        agent_actions = AgentActions(logger=logger, chapter_descs=chapter_descs, catalog=hts_catalog, tariffy_org_id=TARIFFY_ORG_ID, tariffy_api_key=TARIFFY_API_KEY, simpleduty_api_key=SIMPLEDUTY_API_KEY,
+                                     http_sessions=http_sessions, duty_cache=duty_cache, tariffy_url=TARIFFY_URL, simpleduty_url=SIMPLEDUTY_URL,
+                                     max_prefetch_pending=DUTY_PREFETCH_MAX_PENDING, duty_engine=duty_engine, duty_flights=duty_flights)
     except Exception as e:
-        logger.exception(f"Failed to build or compile workflow: {e}")
+        logger.exception(f"Failed to initialize agents: {e}")
         raise
-    return graph_async, agent_actions, logger
+    graph_async = build_workflow(llm=llm, logger=logger, agent_actions=agent_actions, chapters_list=headers, structured_output=STRUCTURED_SELECTORS, scheduler=llm_scheduler,
+                                 ranker=candidate_ranker, top_chapters=RANKER_TOP_CHAPTERS, top_headings=RANKER_TOP_HEADINGS,
+                                 top_lines=RANKER_TOP_LINES, chapter_skip_margin=RANKER_SKIP_CHAPTER_MARGIN, prefetch_codes=DUTY_PREFETCH_CODES,
+                                 metrics=metrics, skip_deep_max_candidates=SKIP_DEEP_MAX_CANDIDATES, regex_extraction=REGEX_EXTRACTION, path_stats=path_stats)
+    return graph_async, agent_actions
+
+graph_async, agent_actions = initialize_agents()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await http_sessions.start('tariffy', 'simplyduty')
+    await job_queue.start()
+    await email_delivery.start()
+    yield
+    # interrupted bulk jobs keep their checkpoint and continue with POST /bulk/{job_id}/resume
+    for job in bulk_jobs.values():
+        job["task"].cancel()
+    await asyncio.gather(*(job["task"] for job in bulk_jobs.values()), return_exceptions=True)
+    await job_queue.stop()
+    await email_delivery.stop()
+    await http_sessions.close()
+    duty_cache.close()
+    classification_store.close()
 
 # FastAPI app
 api_app = FastAPI(title="Tariff Classification API", 
-                  description="API for classifying products into the Harmonized Tariff Schedule (HTS) codes")
+                  description="API for classifying products into the Harmonized Tariff Schedule (HTS) codes",
+                  lifespan=lifespan)
 
 class IncomingRequest(BaseModel):
     id: str
@@ -159,117 +280,459 @@ class IncomingRequest(BaseModel):
     type: str
     data: dict
 
-@api_app.post("/classify")
-async def classify_product(request: IncomingRequest):
+def extract_request_fields(request: IncomingRequest) -> tuple[str, str, list]:
     """
-    Classify a product according to the Harmonized Tariff Schedule
+    Get the requestor email, invoice number and items from a request.
+
+    Raises:
+        HTTPException: 422 if a required field is missing.
     """
-    
     try:
-        # Extract data 
         requestor = request.data["caller"]["email"]
         invoice_number = request.data["value"]["General Information"]["Invoice Number"]
         items = request.data["value"]["Items"]
+    except (KeyError, TypeError) as e:
+        raise HTTPException(status_code=422, detail=f"Missing required field: {e}")
+    return requestor, invoice_number, items
 
-        # Initialize the graph and agents
-        graph_async, agent_actions, logger = initialize_agents(tag=invoice_number)
-
-        # Create a dataframe from the items
-        df = pd.DataFrame(items)
-        df = df.rename(columns={"Description": "description"})
-
-        
-        # Get all descriptions from the DataFrame
-        descriptions = df["description"].tolist()
-        logger.info(f"Received request: {invoice_number}. Classifying {len(descriptions)} items", product_descriptions=descriptions)
-        
-        # Create tasks for all product descriptions to run in parallel
-        classification_tasks = [
-            graph_async.ainvoke({"product_description": description}) 
-            for description in descriptions
-        ]
-
-        tariffy_task = agent_actions.get_tariffy_codes(descriptions=descriptions)
-        
-        # Run all tasks in parallel and wait for all results
-        results, tariffy_results = await asyncio.gather(
-            asyncio.gather(*classification_tasks),  # Run classification tasks
-            tariffy_task  # Run Tarrify API call
-        )
-        
-        # Format the results into a structured response
-        classification_results = []
-        for result in results:
-            classification_results.append({
-                "description": result.get("product_description", ""),
-                "most_likely_code": result["final_codes"].get("most_likely_code", ""),
-                "most_likely_code_lower_rate_code": result["final_codes"].get("most_likely_lower_rate_code", ""),
-            })
-        #make classification results into a pandas dataframe and save locally
-        classification_df = pd.DataFrame(classification_results)
-        tariffy_df = pd.DataFrame(tariffy_results)
-        tariffy_df['tariffy_hts_code'] = tariffy_df['tariffy_hts_code'].apply(lambda x: re.sub(r'\.', '', x))
-        tariffy_df['tariffy_hts_code'] = tariffy_df['tariffy_hts_code'].apply(lambda x: f"{x[:4]}.{x[4:6]}.{x[6:8]}.{x[8:]}")
-
-        final_df = pd.merge(df, classification_df, on="description", how="left")
-        final_df = pd.merge(final_df, tariffy_df, on="description", how="left")
-
-        logger.info(f"Getting duty rates for selected HTS codes")
-        final_tasks = [
-            agent_actions.get_rates_and_descs(
-            origin=row['Country of Origin'],
+def format_tariffy_code(code: str) -> str:
+    """
+    Format a Tariffy code as a dotted 10-digit HTS code, e.g. 8471300100 -> 8471.30.01.00.
+    Anything that is not a code (such as "unable to retrieve code") is returned unchanged.
+    """
+    digits = re.sub(r'\.', '', code)
+    if not digits.isdigit():
+        return code
+    return f"{digits[:4]}.{digits[4:6]}.{digits[6:8]}.{digits[8:]}"
+
+async def classify_description(description: str, invoice_number: str, stored_codes: dict, origin: str = "") -> dict:
+    """
+    Classify one description, reusing the stored classification when there is one. With
+    `COALESCE_REQUESTS`, a description already being classified for another item or request
+    waits for that graph run instead of starting its own. With `DUTY_PREFETCH_CODES`, only runs
+    for the same origin are shared, since the run prefetches duty rates for its caller's origin.
+    """
+    if description in stored_codes:
+        return {"product_description": description, "final_codes": stored_codes[description]}
+
+    async def run_graph():
+        graph_runs_in_flight.inc()
+        try:
+            return await graph_async.ainvoke({"product_description": description, "invoice_number": invoice_number, "origin": origin},
+                                             config={"metadata": {"invoice_number": invoice_number}})
+        finally:
+            graph_runs_in_flight.dec()
+
+    if classification_flights is None:
+        return await run_graph()
+    key = (normalize_description(description), origin) if DUTY_PREFETCH_CODES else normalize_description(description)
+    return await classification_flights.run(key, run_graph)
+
+def description_origins(items: list) -> dict:
+    """
+    Country of origin of the first item with each description.
+    """
+    origins = {}
+    for item in items:
+        origins.setdefault(item.get("Description", ""), item.get("Country of Origin", ""))
+    return origins
+
+def build_item_pipeline(invoice_number: str, stored_codes: dict, new_codes: dict, representatives: dict = None, origins: dict = None,
+                        classify_concurrency: int = PIPELINE_CLASSIFY_CONCURRENCY) -> ItemPipeline:
+    """
+    Per-item pipeline for one invoice. Classifications that were not already stored are collected in `new_codes`.
+
+    Descriptions in `representatives` (from `NearDuplicateClusterer.representatives`) that are not
+    stored take the codes of their representative, classified once for the whole group, with
+    `propagated_from` set to it. Propagated codes are not saved to the store under the near-duplicate.
+    The group run prefetches duty rates for the representative's own origin from `origins` (see
+    `description_origins`), or for none when it is missing; near-duplicates from other countries
+    get their rates in the duty stage.
+    """
+    representatives = representatives or {}
+    origins = origins or {}
+    grouped = set(representatives.values())
+    group_runs = {}
+
+    async def classify_own(description, origin):
+        result = await classify_description(description, invoice_number, stored_codes, origin=origin)
+        if description not in stored_codes:
+            new_codes[description] = result["final_codes"]
+        return result["final_codes"]
+
+    async def classify(description, item):
+        origin = item.get("Country of Origin", "")
+        representative = description if description in stored_codes else representatives.get(description, description)
+        if representative not in grouped:
+            return await classify_own(description, origin)
+        # one run per group, awaited by the representative's own items and by its near-duplicates
+        if representative not in group_runs:
+            group_runs[representative] = asyncio.ensure_future(classify_own(representative, origins.get(representative, "")))
+        final_codes = await group_runs[representative]
+        return final_codes if representative == description else dict(final_codes, propagated_from=representative)
+
+    async def tariffy_lookup(descriptions):
+        codes = await agent_actions.get_tariffy_chunk(descriptions, tags=[invoice_number], timeout=TARIFFY_TIMEOUT, retries=TARIFFY_RETRIES)
+        return [format_tariffy_code(code) for code in codes]
+
+    async def rates_lookup(item, final_codes, tariffy_code):
+        return await agent_actions.get_rates_and_descs(
+            origin=item.get("Country of Origin"),
             dest='US',
-            code_one=row['most_likely_code'],
-            code_two=row['most_likely_code_lower_rate_code'],
-            code_three=row['tariffy_hts_code']
-                )
-                for _, row in final_df.iterrows()
-            ]
-
-        final_results = await asyncio.gather(*final_tasks)
-        results_df = pd.DataFrame(final_results)
-        final_df = pd.concat([final_df, results_df], axis=1)
-        final_columns = [i for i in df.columns] + ['most_likely_code', 
-                                                   "most_likely_code_desc",
-                                                   'most_likely_code_duty_rate',
-                                                   'most_likely_code_lower_rate_code',
-                                                    'most_likely_code_lower_rate_desc',
-                                                    'most_likely_code_lower_rate_duty_rate', 
-                                                   'tariffy_hts_code', 
-                                                   'tariffy_hts_code_desc',
-                                                   'tariffy_hts_code_duty_rate']
-        
-        final_df = final_df[final_columns]
-        
-        final_df.to_csv("classification_results.csv", index=False)  
-
-        # message = create_message_with_attachment(to=requestor,
-                                                # subject=f"Classification results for {invoice_number}", 
-                                                # msg_body="Hello, \n\n Please find your classification results attached. \n\n Thank you, \n Miller", 
-                                                # file_path="classification_results.csv")
-        # send_message(GMAIL_TOKEN, message)
-
-        toolset.execute_action(
-                    action=Action.GMAIL_SEND_EMAIL,
-                    params={
-                        "recipient_email": requestor,
-                        "subject": f"Classification results for {invoice_number}",
-                        "body": "Hello, \n\n Please find you classification results attached. \n\n Thank you, \n Miller",
-                        "attachment": "classification_results.csv"
-                    }
-                )
-
-        logger.info(f"Classification complete. Sending email to {requestor}")      
-
-        
+            code_one=final_codes.get("most_likely_code", ""),
+            code_two=final_codes.get("most_likely_lower_rate_code", ""),
+            code_three=tariffy_code,
+            tags=[invoice_number]
+        )
+
+    return ItemPipeline(classify=classify, tariffy_lookup=tariffy_lookup, rates_lookup=rates_lookup,
+                        classify_concurrency=classify_concurrency, tariffy_batch_size=TARIFFY_BATCH_SIZE,
+                        tariffy_concurrency=TARIFFY_CONCURRENCY, rates_concurrency=DUTY_LOOKUP_CONCURRENCY)
+
+async def run_classification(request: IncomingRequest, on_item_done=None) -> list[dict]:
+    """
+    Classify every item in a request, look up duty rates, and email the results.
+
+    Args:
+        request (IncomingRequest): The classification request.
+        on_item_done: Optional callback invoked as each item gets its codes and duty rates.
+
+    Returns:
+        list[dict]: One result row per item.
+    """
+    # Extract data 
+    requestor, invoice_number, items = extract_request_fields(request)
+
+    invoice_logger = logger.with_tags(invoice_number)
+
+    descriptions = [item.get("Description", "") for item in items]
+    invoice_logger.info(f"Received request: {invoice_number}. Classifying {len(descriptions)} items", product_descriptions=descriptions)
+    
+    # Reuse stored classifications; only descriptions not seen before go through the graph
+    stored_codes = await classification_store.get_many(descriptions)
+    invoice_logger.info(f"Found {len(stored_codes)} of {len(descriptions)} items in the classification store")
+
+    # Each item goes on to its duty lookup as soon as its own codes are ready
+    representatives = near_duplicates.representatives(descriptions) if near_duplicates is not None else {}
+    if representatives:
+        invoice_logger.info(f"Reusing classifications for {len(representatives)} near-duplicate descriptions")
+    columns = output_columns(items, propagated=near_duplicates is not None)
+    new_codes = {}
+    rows = []
+    in_order = PositionalJoin(total=len(items))
+    pipeline = build_item_pipeline(invoice_number, stored_codes, new_codes, representatives, description_origins(items))
+    artifact = ResultArtifact(columns=columns, fmt=RESULT_FORMAT, basename=f"classification_results_{invoice_number}", max_memory=RESULT_SPOOL_MAX_MEMORY)
+    try:
+        async with aclosing(pipeline.run(items, descriptions)) as records:
+            async for record in records:
+                if record.error is not None:
+                    invoice_logger.error(f"Error classifying item {record.index}: {record.error}", _tags=[record.description, invoice_number])
+                    raise record.error
+                # rows are joined back to their items by position and written as soon as every earlier row is done
+                for ready in in_order.add(record):
+                    row = ready.row(columns)
+                    artifact.write_row(row)
+                    rows.append(row)
+                if on_item_done is not None:
+                    on_item_done()
+        attachment = artifact.finish()
+    finally:
+        artifact.close()
+    await classification_store.put_many(new_codes)
+
+    # the work is done at this point, so a full email queue holds the email back instead of failing the request
+    await email_delivery.enqueue(OutgoingEmail(
+        job_uuid=request.job_uuid,
+        recipient=requestor,
+        subject=f"Classification results for {invoice_number}",
+        body="Hello, \n\n Please find you classification results attached. \n\n Thank you, \n Miller",
+        attachment=attachment,
+        filename=artifact.filename,
+    ), timeout=EMAIL_ENQUEUE_TIMEOUT)
+
+    invoice_logger.info(f"Classification complete. Queued results email to {requestor}")
+
+    return rows
+
+async def stream_classification(invoice_number: str, items: list):
+    """
+    Classify the items of a request and yield each item's result as soon as its codes and
+    duty rates are ready, in completion order, followed by a summary record.
+
+    Yields:
+        dict: `{"type": "item", "index", "row"}` per finished item, `{"type": "error", "index", "description", "error"}`
+            per failed item, then one `{"type": "summary", ...}`.
+    """
+    start = time.perf_counter()
+    invoice_logger = logger.with_tags(invoice_number)
+    descriptions = [item.get("Description", "") for item in items]
+    invoice_logger.info(f"Received streaming request: {invoice_number}. Classifying {len(descriptions)} items", product_descriptions=descriptions)
+
+    stored_codes = await classification_store.get_many(descriptions)
+    representatives = near_duplicates.representatives(descriptions) if near_duplicates is not None else {}
+    columns = output_columns(items, propagated=near_duplicates is not None)
+    new_codes = {}
+    failed = 0
+    # closing the pipeline cancels outstanding work if the client disconnects mid-stream
+    pipeline = build_item_pipeline(invoice_number, stored_codes, new_codes, representatives, description_origins(items))
+    async with aclosing(pipeline.run(items, descriptions)) as records:
+        async for record in records:
+            if record.error is not None:
+                failed += 1
+                invoice_logger.error(f"Error classifying item {record.index}: {record.error}", _tags=[record.description, invoice_number])
+                yield {"type": "error", "index": record.index, "description": record.description, "error": str(record.error)}
+            else:
+                yield {"type": "item", "index": record.index, "row": record.row(columns)}
+
+    await classification_store.put_many(new_codes)
+    elapsed = time.perf_counter() - start
+    invoice_logger.info(f"Streamed {len(items)} items in {elapsed:.1f}s, {failed} failed")
+    yield {
+        "type": "summary",
+        "invoice_number": invoice_number,
+        "items": len(items),
+        "succeeded": len(items) - failed,
+        "failed": failed,
+        "from_store": len(stored_codes),
+        "propagated": sum(1 for description in descriptions if description in representatives and description not in stored_codes),
+        "elapsed_s": round(elapsed, 3),
+    }
+
+# Large CSV/JSONL files from the bulk CLI (bulk.py) and POST /bulk, checkpointed in their JSONL output
+bulk_runner = BulkRunner(build_pipeline=lambda name, stored_codes, new_codes, representatives, items: build_item_pipeline(
+                             name, stored_codes, new_codes, representatives, description_origins(items),
+                             classify_concurrency=BULK_CLASSIFY_CONCURRENCY),
+                         store=classification_store, logger=logger, chunk_size=BULK_CHUNK_SIZE, batch_size=BULK_BATCH_SIZE,
+                         progress_interval=BULK_PROGRESS_INTERVAL,
+                         clusterer=near_duplicates)
+bulk_jobs = {}
+bulk_slots = asyncio.Semaphore(BULK_MAX_RUNNING)
+
+def bulk_paths(job_id: str) -> tuple[str, str]:
+    """
+    Input and output paths of an uploaded bulk job; the input keeps its format as extension.
+    """
+    for fmt in BULK_FORMATS:
+        input_path = os.path.join(BULK_DIR, f"{job_id}.{fmt}")
+        if os.path.exists(input_path):
+            return input_path, os.path.join(BULK_DIR, f"{job_id}.results.jsonl")
+    raise HTTPException(status_code=404, detail=f"Bulk job {job_id} not found")
+
+async def run_bulk_job(job_id: str):
+    """
+    Run an uploaded bulk job once a slot is free, keeping its status and progress in `bulk_jobs`.
+    """
+    job = bulk_jobs[job_id]
+    input_path, output_path = bulk_paths(job_id)
+    try:
+        async with bulk_slots:
+            job["status"] = "running"
+            job["summary"] = await bulk_runner.run(f"bulk-{job_id}", input_path, output_path, on_progress=lambda progress: job.update(progress=progress))
+        job["status"] = "succeeded"
+    except asyncio.CancelledError:
+        job["status"] = "interrupted"
+        raise
+    except Exception as e:
+        logger.exception(f"Bulk job {job_id} failed: {e}")
+        job["status"] = "failed"
+        job["error"] = str(e)
+
+def start_bulk_job(job_id: str):
+    bulk_jobs[job_id] = {"job_id": job_id, "status": "queued", "progress": None, "summary": None, "error": None}
+    bulk_jobs[job_id]["task"] = asyncio.create_task(run_bulk_job(job_id))
+
+# Background workers for requests submitted to POST /jobs
+job_store = InMemoryJobStore(max_jobs=JOB_HISTORY_SIZE)
+job_queue = JobQueue(store=job_store, handler=run_classification, logger=logger, workers=JOB_WORKERS, max_queued=JOB_QUEUE_SIZE)
+
+# Queue and in-flight gauges, read when /metrics is scraped
+metrics.gauge("job_queue_depth", "Jobs waiting for a worker.", function=job_queue.depth)
+metrics.gauge("email_queue_depth", "Emails waiting for a delivery worker.", function=email_delivery.depth)
+metrics.gauge("email_retrying", "Emails waiting to be retried.", function=lambda: email_delivery.stats()["retrying"])
+metrics.gauge("llm_queue_depth", "LLM calls waiting for a scheduler slot.", function=llm_scheduler.queue_depth)
+metrics.gauge("llm_in_flight", "LLM calls in progress.", function=lambda: llm_scheduler.in_flight)
+metrics.gauge("duty_prefetch_pending", "Prefetched duty lookups not yet used.", function=lambda: agent_actions.prefetch_stats()["pending"])
+
+@api_app.post("/classify")
+async def classify_product(request: IncomingRequest):
+    """
+    Classify a product according to the Harmonized Tariff Schedule
+    """
+    
+    try:
+        await run_classification(request)
         return {
             "status": "success",
         }
-    
+
+    except HTTPException:
+        raise
     except Exception as e:
         logger.exception(f"Error processing classification request: {e}")
         raise HTTPException(status_code=500, detail="Internal server error during classification")
 
+@api_app.post("/classify/stream")
+async def classify_product_stream(request: IncomingRequest, http_request: Request):
+    """
+    Classify the items of a request and stream each item's codes and duty rates as it finishes,
+    ending with a summary record. Responds with Server-Sent Events when the client accepts
+    `text/event-stream`, otherwise with newline-delimited JSON.
+    """
+    _, invoice_number, items = extract_request_fields(request)
+    sse = "text/event-stream" in http_request.headers.get("accept", "")
+
+    async def body():
+        try:
+            async for record in stream_classification(invoice_number, items):
+                data = json.dumps(record, default=str)
+                yield f"event: {record['type']}\ndata: {data}\n\n" if sse else data + "\n"
+        except Exception as e:
+            logger.exception(f"Error streaming classification request: {e}")
+            data = json.dumps({"type": "error", "error": "Internal server error during classification"})
+            yield f"event: error\ndata: {data}\n\n" if sse else data + "\n"
+
+    return StreamingResponse(body(), media_type="text/event-stream" if sse else "application/x-ndjson")
+
+@api_app.post("/jobs", status_code=202)
+async def submit_classification_job(request: IncomingRequest):
+    """
+    Queue a classification request and return immediately. Poll `GET /jobs/{job_uuid}` for progress and results.
+    """
+    _, invoice_number, items = extract_request_fields(request)
+    try:
+        created = job_queue.submit(request.job_uuid, request, total=len(items))
+    except asyncio.QueueFull:
+        raise HTTPException(status_code=503, detail="Classification queue is full, retry later")
+    if not created:
+        raise HTTPException(status_code=409, detail=f"Job {request.job_uuid} already exists")
+
+    logger.info(f"Queued job {request.job_uuid} for invoice {invoice_number} with {len(items)} items")
+    return {"job_uuid": request.job_uuid, "status": "queued"}
+
+@api_app.get("/jobs/{job_uuid}")
+async def get_classification_job(job_uuid: str):
+    """
+    Get the status, progress and (once finished) results of a queued classification job.
+    """
+    job = job_store.get(job_uuid)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_uuid} not found")
+    job["delivery"] = email_delivery.status(job_uuid)
+    return job
+
+@api_app.get("/jobs/{job_uuid}/delivery")
+async def get_delivery_status(job_uuid: str):
+    """
+    Get the delivery status of a request's results email, for both `/classify` and `/jobs` requests.
+    """
+    delivery = email_delivery.status(job_uuid)
+    if delivery is None:
+        raise HTTPException(status_code=404, detail=f"No results email for job {job_uuid}")
+    return delivery
+
+
+@api_app.post("/bulk", status_code=202)
+async def submit_bulk_job(http_request: Request, output_format: str = Query(None, alias="format"), job_id: str = None):
+    """
+    Upload a CSV or JSONL file of items and classify it in the background. The body is streamed
+    to `BULK_DIR`, up to `BULK_MAX_UPLOAD_BYTES`; the format comes from the `format` query
+    parameter or the content type. Poll `GET /bulk/{job_id}` for progress and download
+    `GET /bulk/{job_id}/results`.
+    """
+    if not BULK_DIR:
+        raise HTTPException(status_code=404, detail="Bulk uploads are disabled, set BULK_DIR")
+    if output_format is None:
+        content_type = http_request.headers.get("content-type", "")
+        output_format = "csv" if "csv" in content_type else "jsonl" if "ndjson" in content_type or "jsonl" in content_type else None
+    if output_format not in BULK_FORMATS:
+        raise HTTPException(status_code=422, detail=f"Bulk format must be one of {', '.join(BULK_FORMATS)}")
+    job_id = job_id or uuid.uuid4().hex
+    if not re.fullmatch(r'[A-Za-z0-9_-]{1,64}', job_id):
+        raise HTTPException(status_code=422, detail="job_id may only contain letters, digits, '-' and '_'")
+    if job_id in bulk_jobs or any(os.path.exists(os.path.join(BULK_DIR, f"{job_id}.{fmt}")) for fmt in BULK_FORMATS):
+        raise HTTPException(status_code=409, detail=f"Bulk job {job_id} already exists")
+    too_large = HTTPException(status_code=413, detail=f"Bulk uploads are limited to {BULK_MAX_UPLOAD_BYTES} bytes")
+    if int(http_request.headers.get("content-length") or 0) > BULK_MAX_UPLOAD_BYTES:
+        raise too_large
+
+    os.makedirs(BULK_DIR, exist_ok=True)
+    input_path = os.path.join(BULK_DIR, f"{job_id}.{output_format}")
+    part_path = input_path + ".part"
+    try:
+        received = 0
+        with open(part_path, 'wb') as file:
+            async for chunk in http_request.stream():
+                received += len(chunk)
+                # the declared length may be missing or wrong, so count what actually arrives
+                if received > BULK_MAX_UPLOAD_BYTES:
+                    raise too_large
+                await asyncio.to_thread(file.write, chunk)
+        os.replace(part_path, input_path)
+    except HTTPException:
+        os.remove(part_path)
+        raise
+    except Exception as e:
+        logger.exception(f"Failed to store bulk upload {job_id}: {e}")
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise e
+
+    start_bulk_job(job_id)
+    logger.info(f"Queued bulk job {job_id} from {input_path}")
+    return {"job_id": job_id, "status": "queued"}
+
+@api_app.post("/bulk/{job_id}/resume", status_code=202)
+async def resume_bulk_job(job_id: str):
+    """
+    Continue an interrupted or failed bulk job from its checkpoint; finished rows are not classified again.
+    """
+    if not BULK_DIR:
+        raise HTTPException(status_code=404, detail="Bulk uploads are disabled, set BULK_DIR")
+    bulk_paths(job_id)
+    job = bulk_jobs.get(job_id)
+    if job is not None and not job["task"].done():
+        raise HTTPException(status_code=409, detail=f"Bulk job {job_id} is already {job['status']}")
+    start_bulk_job(job_id)
+    return {"job_id": job_id, "status": "queued"}
+
+@api_app.get("/bulk/{job_id}")
+async def get_bulk_job(job_id: str):
+    """
+    Get the status of a bulk job with rows done and failed, throughput and ETA.
+    """
+    job = bulk_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Bulk job {job_id} not found")
+    progress = job["progress"]
+    return {"job_id": job_id, "status": job["status"], "progress": progress.snapshot() if progress is not None else None,
+            "summary": job["summary"], "error": job["error"]}
+
+@api_app.get("/bulk/{job_id}/results")
+async def get_bulk_results(job_id: str):
+    """
+    Download the JSONL results of a bulk job, including the rows finished so far by a running job.
+    """
+    if not BULK_DIR:
+        raise HTTPException(status_code=404, detail="Bulk uploads are disabled, set BULK_DIR")
+    _, output_path = bulk_paths(job_id)
+    if not os.path.exists(output_path):
+        raise HTTPException(status_code=404, detail=f"No results yet for bulk job {job_id}")
+    # only the bytes present now, since a running job keeps appending to the file
+    size = os.path.getsize(output_path)
+
+    def body():
+        with open(output_path, 'rb') as file:
+            remaining = size
+            while remaining > 0:
+                chunk = file.read(min(remaining, 1024 * 1024))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+    return StreamingResponse(body(), media_type="application/x-ndjson",
+                             headers={"Content-Disposition": f'attachment; filename="{job_id}.results.jsonl"'})
+
 @api_app.get("/health")
 async def health_check():
     """
@@ -277,6 +740,24 @@ async def health_check():
     """
     return {"status": "ok"}
 
+@api_app.get("/metrics")
+async def prometheus_metrics():
+    """
+    Latency, token and queue metrics in the Prometheus text format.
+    """
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@api_app.get("/stats")
+async def stats():
+    """
+    Cache and queue statistics for the running process.
+    """
+    return {"duty_cache": duty_cache.stats(), "classification_store": classification_store.stats(), "job_queue_depth": job_queue.depth(), "llm_scheduler": llm_scheduler.stats(),
+            "duty_prefetch": agent_actions.prefetch_stats(), "email_delivery": email_delivery.stats(), "graph_paths": path_stats.stats(),
+            "duty_engine": duty_engine.stats() if duty_engine is not None else None,
+            "coalescing": {"classification": classification_flights.stats(), "duty_rates": duty_flights.stats()} if COALESCE_REQUESTS else None,
+            "near_duplicates": near_duplicates.stats() if near_duplicates is not None else None}
+
 if __name__ == "__main__":
     
     port = int(os.getenv("PORT", 8080))  # Use the PORT environment variable or default to 8080
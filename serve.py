@@ -0,0 +1,150 @@
+"""
+Pre-fork server: one listening socket shared by several worker processes.
+
+    SERVER_WORKERS=4 python serve.py
+
+The parent makes sure the HTS catalog snapshot is current, imports the heavy libraries and
+binds the socket, then forks the workers. Each worker imports the API module and memory-maps
+the same snapshot, so the catalog pages are shared through the page cache instead of being
+wrangled into every worker's heap. The app itself is only imported after the fork, because
+its SQLite connections, Logfire exporter and LLM client must not be shared between processes.
+Workers that exit are restarted, with exponential backoff while they keep failing right after
+start; after SERVER_MAX_FAST_FAILURES such failures in a row the server gives up. SIGTERM or
+SIGINT stops them all.
+"""
+import os
+import signal
+import socket
+import sys
+import time
+import traceback
+
+from dotenv import load_dotenv
+import logfire
+
+from agents.CatalogSnapshot import ensure_snapshot
+
+# Imported before forking so their code is loaded once and shared copy-on-write
+PRELOAD_MODULES = ('aiohttp', 'fastapi', 'pydantic', 'uvicorn', 'langchain_core.runnables', 'langchain.chat_models',
+                   'langchain_google_genai', 'langgraph.graph')
+
+load_dotenv()
+
+try:
+    HOST = os.getenv("HOST", "0.0.0.0")
+    PORT = int(os.getenv("PORT", 8080))
+    SERVER_WORKERS = int(os.getenv("SERVER_WORKERS", os.cpu_count() or 1))
+    SERVER_BACKLOG = int(os.getenv("SERVER_BACKLOG", 2048))
+    SERVER_MIN_UPTIME = float(os.getenv("SERVER_MIN_UPTIME", 10))  # workers exiting sooner count as failing at startup
+    SERVER_MAX_FAST_FAILURES = int(os.getenv("SERVER_MAX_FAST_FAILURES", 5))
+    SERVER_RESTART_BACKOFF_MAX = float(os.getenv("SERVER_RESTART_BACKOFF_MAX", 60))
+    HTS_DATA_PATH = os.getenv("HTS_DATA_PATH", "files/htsdata.json")
+    HTS_SNAPSHOT_PATH = os.getenv("HTS_SNAPSHOT_PATH", "files/htsdata.snapshot")
+except Exception as e:
+    raise ValueError("Environment variables not set correctly") from e
+
+
+def run_worker(sock: socket.socket):
+    """
+    Worker process body: load the app and serve requests on the inherited socket until stopped.
+    """
+    import uvicorn
+
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    import classification_and_duties_deploy as deploy
+    server = uvicorn.Server(uvicorn.Config(deploy.api_app, lifespan="on"))
+    server.run(sockets=[sock])
+
+
+def serve(workers: int, logger):
+    """
+    Bind the socket, fork `workers` processes and supervise them until SIGTERM or SIGINT.
+
+    Returns:
+        int: Exit status for the server process, 1 if it gave up on workers failing at startup.
+    """
+    sock = socket.create_server((HOST, PORT), backlog=SERVER_BACKLOG)
+    sock.set_inheritable(True)
+    children = {}  # pid -> start time
+    stopping = False
+    fast_failures = 0
+    exit_status = 0
+
+    def start_worker():
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                run_worker(sock)
+            except BaseException:
+                code = 1
+                # os._exit below skips the interpreter's own traceback printing
+                traceback.print_exc()
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(code)
+        children[pid] = time.monotonic()
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    os.environ["SERVER_WORKERS"] = str(workers)
+    for _ in range(workers):
+        start_worker()
+    logger.info(f"Started {workers} workers on {HOST}:{PORT}: {sorted(children)}")
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        started = children.pop(pid, None)
+        if stopping:
+            continue
+        exit_code = os.waitstatus_to_exitcode(status)
+        if started is not None and time.monotonic() - started < SERVER_MIN_UPTIME:
+            fast_failures += 1
+        else:
+            fast_failures = 0
+        if fast_failures >= SERVER_MAX_FAST_FAILURES:
+            logger.error(f"Worker {pid} exited with status {exit_code}; {fast_failures} workers in a row failed within "
+                         f"{SERVER_MIN_UPTIME:g}s of starting, stopping the server")
+            stop(signal.SIGTERM, None)
+            exit_status = 1
+            continue
+        delay = min(2 ** max(fast_failures - 1, 0), SERVER_RESTART_BACKOFF_MAX)
+        logger.warning(f"Worker {pid} exited with status {exit_code}, restarting in {delay:g}s")
+        time.sleep(delay)
+        if not stopping:
+            start_worker()
+    sock.close()
+    logger.info("All workers stopped")
+    return exit_status
+
+
+if __name__ == "__main__":
+    logfire.configure(token=os.getenv('LOGFIRE_TOKEN'), scrubbing=False)
+    logger = logfire.with_tags('tariff_classification')
+
+    if HTS_SNAPSHOT_PATH:
+        try:
+            ensure_snapshot(HTS_DATA_PATH, HTS_SNAPSHOT_PATH, logger)
+        except Exception as e:
+            logger.exception(f"Failed to build HTS snapshot: {e}")
+            raise
+
+    for module in PRELOAD_MODULES:
+        __import__(module)
+    sys.stdout.flush()
+    sys.exit(serve(SERVER_WORKERS, logger))